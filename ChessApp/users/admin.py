@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, ChessBot, Tournament, TournamentParticipant, Match, ClassGroup
+from .models import (CustomUser, ChessBot, Tournament, TournamentParticipant, Match, ClassGroup, BotStats, SprtTest,
+                     TournamentStartJob)
 
 class CustomUserAdmin(UserAdmin):
     model = CustomUser
@@ -22,8 +23,8 @@ class ChessBotAdmin(admin.ModelAdmin):
 
 @admin.register(Tournament)
 class TournamentAdmin(admin.ModelAdmin):
-    list_display = ('name', 'created_by', 'status', 'created_at')
-    list_filter = ('status',)
+    list_display = ('name', 'created_by', 'format', 'status', 'created_at')
+    list_filter = ('status', 'format')
     search_fields = ('name', 'created_by__email')
 
 @admin.register(Match)
@@ -32,6 +33,21 @@ class MatchAdmin(admin.ModelAdmin):
     list_filter = ('status', 'result')
     search_fields = ('white_bot__name', 'black_bot__name')
 
+@admin.register(BotStats)
+class BotStatsAdmin(admin.ModelAdmin):
+    list_display = ('bot', 'tournament', 'games', 'wins', 'draws', 'losses', 'win_percentage')
+    search_fields = ('bot__name',)
+
+@admin.register(SprtTest)
+class SprtTestAdmin(admin.ModelAdmin):
+    list_display = ('tournament', 'candidate', 'baseline', 'llr', 'result')
+    list_filter = ('result',)
+
+@admin.register(TournamentStartJob)
+class TournamentStartJobAdmin(admin.ModelAdmin):
+    list_display = ('tournament', 'status', 'matches_created', 'matches_dispatched', 'created_at', 'finished_at')
+    list_filter = ('status',)
+
 @admin.register(ClassGroup)
 class ClassGroupAdmin(admin.ModelAdmin):
     list_display = ('name', 'teacher', 'created_at')
@@ -0,0 +1,128 @@
+"""
+Maximum-likelihood ratings over the full match graph, BayesElo style.
+
+Ratings are fitted to the whole head-to-head matrix of a tournament at once
+with a Bradley-Terry model, so unlike incremental Elo they don't depend on
+the order the games were played in. Draws count as half a win for each side
+and, as in BayesElo, every pair of bots that met gets a few virtual draws as
+a prior, which keeps ratings finite for bots that won or lost every game.
+
+The likelihood is maximized with Hunter's MM iteration. Error bars and
+likelihood of superiority come from the covariance of the estimate, the
+pseudo-inverse of the Fisher information at the optimum.
+"""
+import math
+import numpy as np
+
+# Virtual draws added between every pair of bots that played each other
+DEFAULT_PRIOR = 2.0
+
+ELO_PER_NATURAL_UNIT = 400 / math.log(10)
+
+# Two-sided 95% interval
+CONFIDENCE_Z = 1.959964
+
+MAX_ITERATIONS = 10000
+TOLERANCE = 1e-10
+
+
+def build_matrices(players, games):
+    """
+    Games and points matrices of a list of players from (white, black,
+    white_score) tuples: games[i, j] is the number of games between i and
+    j and points[i, j] what i scored in them.
+    """
+    index = {player: i for i, player in enumerate(players)}
+    n = len(players)
+    games_matrix = np.zeros((n, n))
+    points = np.zeros((n, n))
+    for white, black, score in games:
+        i, j = index[white], index[black]
+        games_matrix[i, j] += 1
+        games_matrix[j, i] += 1
+        points[i, j] += score
+        points[j, i] += 1 - score
+    return games_matrix, points
+
+
+def fit(games_matrix, points, prior=DEFAULT_PRIOR):
+    """
+    Fit Bradley-Terry strengths with the MM algorithm. Returns ratings in
+    Elo (mean zero) and their covariance matrix.
+    """
+    n = len(games_matrix)
+    if n == 0:
+        return np.zeros(0), np.zeros((0, 0))
+
+    # Virtual draws between every pair that met
+    met = games_matrix > 0
+    games_matrix = games_matrix + prior * met
+    points = points + prior / 2 * met
+    wins = points.sum(axis=1)
+
+    gamma = np.ones(n)
+    played = wins > 0
+    for _ in range(MAX_ITERATIONS):
+        denominator = (games_matrix / (gamma[:, None] + gamma[None, :])).sum(axis=1)
+        new_gamma = np.where(played, wins / np.where(denominator > 0, denominator, 1), gamma)
+        # Fix the scale: geometric mean of one
+        new_gamma /= np.exp(np.log(new_gamma).mean())
+        converged = np.max(np.abs(new_gamma - gamma) / gamma) < TOLERANCE
+        gamma = new_gamma
+        if converged:
+            break
+
+    theta = np.log(gamma)
+    ratings = (theta - theta.mean()) * ELO_PER_NATURAL_UNIT
+
+    # Fisher information of theta; singular since only differences are identified
+    p = gamma[:, None] / (gamma[:, None] + gamma[None, :])
+    weights = games_matrix * p * p.T
+    information = np.diag(weights.sum(axis=1)) - weights
+    covariance = np.linalg.pinv(information) * ELO_PER_NATURAL_UNIT ** 2
+    return ratings, covariance
+
+
+def likelihood_of_superiority(ratings, covariance):
+    """Matrix of the probability that player i is stronger than player j"""
+    variance = np.diag(covariance)
+    spread = variance[:, None] + variance[None, :] - 2 * covariance
+    difference = ratings[:, None] - ratings[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = difference / np.sqrt(2 * np.maximum(spread, 0))
+    los = 0.5 * (1 + np.vectorize(math.erf, otypes=[float])(np.nan_to_num(z, nan=0.0, posinf=np.inf, neginf=-np.inf)))
+    np.fill_diagonal(los, 0.5)
+    return los
+
+
+def solve(players, games, prior=DEFAULT_PRIOR):
+    """
+    Ratings with 95% error bars and the likelihood-of-superiority table of
+    the given players from (white, black, white_score) games, as a
+    JSON-serializable dict. Players without games are left out.
+    """
+    known = set(players)
+    games = [game for game in games if game[0] in known and game[1] in known]
+    seen = {player for white, black, _ in games for player in (white, black)}
+    players = [player for player in players if player in seen]
+    games_matrix, points = build_matrices(players, games)
+    ratings, covariance = fit(games_matrix, points, prior)
+    errors = CONFIDENCE_Z * np.sqrt(np.maximum(np.diag(covariance), 0))
+    los = likelihood_of_superiority(ratings, covariance)
+
+    order = np.argsort(-ratings, kind='stable')
+    return {
+        'games': len(games),
+        'prior': prior,
+        'ratings': [{
+            'bot': str(players[i]),
+            'rating': round(float(ratings[i]), 1),
+            'error': round(float(errors[i]), 1),
+            'games': int(games_matrix[i].sum()),
+            'score': float(points[i].sum()),
+        } for i in order],
+        'los': {
+            str(players[i]): {str(players[j]): round(float(los[i, j]), 4) for j in order if j != i}
+            for i in order
+        },
+    }
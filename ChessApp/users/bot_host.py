@@ -0,0 +1,510 @@
+"""
+Long-lived bot host processes.
+
+A bot host is a separate Python interpreter running this file as a script. It
+imports one bot module exactly once and then plays any number of games for the
+Celery worker that owns it. The worker talks to the host over the host's
+stdin/stdout using one JSON object per line:
+
+    -> {"cmd": "new_game"}
+    <- {"ok": true, "hash": 5060803636482931868, "rss": 12345678}
+
+Moves are pushed onto the bot's board incrementally and every response
+carries the Zobrist hash of the bot's board, so the worker can verify that
+the bot is in sync without serializing positions.
+
+Hosts are pooled per worker process and keyed by (bot id, bot version), so a
+bot that plays hundreds of games in a tournament is only loaded once per
+worker. Hosts are recycled after a configurable number of games or when their
+memory grows past a configurable limit.
+
+Every host runs under an address space limit (RLIMIT_AS), and each call to
+select_move runs under a CPU time limit (RLIMIT_CPU) plus a sub-second
+wall-clock timer inside the host. The worker additionally enforces its own
+wall-clock deadline on every response and kills hosts that miss it, so a bot
+stuck in native code or allocating without bound only ever loses its own game.
+
+Anything the bot prints, and the tracebacks of hosts that crash, go to the
+host's stderr, which the worker collects for the match's debug log.
+"""
+import atexit
+import importlib.util
+import json
+import math
+import os
+import resource
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from pathlib import Path
+
+import chess
+import chess.polyglot
+
+# Defaults used when the Django settings don't override them
+DEFAULT_MAX_GAMES = 50
+DEFAULT_MAX_RSS_GROWTH = 256 * 1024 * 1024
+DEFAULT_MAX_IDLE = 16
+# Extra time the worker waits for a response beyond the move's own limit
+WATCHDOG_GRACE = 0.5
+# Time allowed for commands other than select_move
+COMMAND_TIMEOUT = 10
+# Bot output kept between two reads by the worker; the rest is dropped
+MAX_OUTPUT = 64 * 1024
+
+
+class BotHostError(Exception):
+    """Raised when a bot host dies or answers with something unreadable"""
+    pass
+
+
+class BotHostTimeout(BotHostError):
+    """Raised when a bot host misses its deadline and had to be killed"""
+    pass
+
+
+class BotTimeoutError(Exception):
+    """Raised inside the host when select_move runs out of time"""
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Host side (runs inside the child process)
+# ---------------------------------------------------------------------------
+
+def _current_rss():
+    """Return the resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _limit_cpu(seconds):
+    """
+    Let this process use at most `seconds` more CPU time, or lift the limit
+    again when seconds is None. The kernel kills the host with SIGXCPU when
+    the soft limit is exceeded, which also stops bots stuck in native code.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds is None:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    limit = math.ceil(usage.ru_utime + usage.ru_stime + seconds)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+
+def _find_bot_class(module):
+    """
+    Find the bot class in a module.
+
+    Classes defined in the bot file itself are tried before imported ones, and
+    only classes exposing select_move are instantiated. Returns the class and
+    the probe instance so the first game doesn't construct the bot twice.
+    """
+    candidates = []
+    for attr_name in dir(module):
+        attr = getattr(module, attr_name)
+        if isinstance(attr, type) and not attr_name.startswith("_") and attr_name not in ["type", "object"]:
+            if not hasattr(attr, 'select_move'):
+                continue
+            local = getattr(attr, '__module__', None) == module.__name__
+            candidates.append((0 if local else 1, attr_name, attr))
+
+    for _, _, attr in sorted(candidates, key=lambda c: (c[0], c[1])):
+        try:
+            instance = attr()
+        except Exception:
+            continue
+        if hasattr(instance, 'board'):
+            return attr, instance
+    return None, None
+
+
+class _BotHostServer:
+    """Command loop executed by the host process"""
+
+    def __init__(self, bot_path, protocol_out):
+        self.bot_path = bot_path
+        self.out = protocol_out
+        self.bot_class = None
+        self.bot_instance = None
+        self.spare_instance = None
+
+    def send(self, payload):
+        self.out.write(json.dumps(payload) + "\n")
+        self.out.flush()
+
+    def load(self):
+        module_name = Path(self.bot_path).stem
+        spec = importlib.util.spec_from_file_location(module_name, self.bot_path)
+        if spec is None:
+            return f"Failed to load bot: {self.bot_path}"
+
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+
+        self.bot_class, self.spare_instance = _find_bot_class(module)
+        if self.bot_class is None:
+            return f"No valid chess bot class found in {self.bot_path}"
+        return None
+
+    def board_state(self):
+        return {"hash": chess.polyglot.zobrist_hash(self.bot_instance.board)}
+
+    def handle_new_game(self, request):
+        # Reuse the probe instance for the first game, fresh instances after
+        if self.spare_instance is not None:
+            self.bot_instance, self.spare_instance = self.spare_instance, None
+        else:
+            self.bot_instance = self.bot_class()
+        self.bot_instance.board = chess.Board()
+        return {"ok": True, "rss": _current_rss(), **self.board_state()}
+
+    def handle_set_position(self, request):
+        # Replay the move history so the bot can detect repetitions
+        board = chess.Board(request["fen"])
+        for uci in request.get("moves", []):
+            board.push(chess.Move.from_uci(uci))
+        self.bot_instance.board = board
+        return {"ok": True, **self.board_state()}
+
+    def handle_push(self, request):
+        move = chess.Move.from_uci(request["move"])
+        board = self.bot_instance.board
+        if not board.is_legal(move):
+            return {"ok": False, "error": f"Move {move.uci()} not legal on bot's board: {board.fen()}",
+                    **self.board_state()}
+        board.push(move)
+        return {"ok": True, **self.board_state()}
+
+    def handle_select_move(self, request):
+        board = self.bot_instance.board
+        ply = len(board.move_stack)
+        log = []
+        if request.get("debug"):
+            log = [
+                f"FEN: {board.fen()}",
+                f"Turn: {'White' if board.turn else 'Black'}",
+                f"Legal moves: {[m.uci() for m in board.legal_moves]}",
+            ]
+
+        # Bots with a debug flag only explain themselves when the match log keeps it
+        if hasattr(self.bot_instance, 'debug'):
+            self.bot_instance.debug = bool(request.get("debug"))
+
+        # Expose the remaining time to the bot as UCI-style go parameters
+        if request.get("clock") is not None:
+            self.bot_instance.time_control = request["clock"]
+
+        time_limit = request.get("time_limit")
+        cpu_limit = request.get("cpu_limit")
+        if time_limit:
+            signal.signal(signal.SIGALRM, self._timeout_handler)
+            signal.setitimer(signal.ITIMER_REAL, time_limit)
+        if cpu_limit:
+            _limit_cpu(cpu_limit)
+        try:
+            move = self.bot_instance.select_move()
+        except BotTimeoutError:
+            return {"ok": False, "timeout": True, "error": "Move timed out", "log": log}
+        finally:
+            if time_limit:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            if cpu_limit:
+                _limit_cpu(None)
+
+        if move is None:
+            return {"ok": True, "move": None, "log": log}
+        if isinstance(move, str):
+            move = chess.Move.from_uci(move)
+
+        # Play the move on the bot's own board unless the bot already did. If
+        # the bot left its board in some other state, the worker notices the
+        # hash mismatch and resyncs it before the bot's next move.
+        board = self.bot_instance.board
+        if not (len(board.move_stack) == ply + 1 and board.peek() == move) and board.is_legal(move):
+            board.push(move)
+        return {"ok": True, "move": move.uci(), "log": log, **self.board_state()}
+
+    @staticmethod
+    def _timeout_handler(signum, frame):
+        raise BotTimeoutError("Move timed out")
+
+    def serve(self, protocol_in):
+        try:
+            error = self.load()
+        except Exception as e:
+            error = f"Error loading bot: {str(e)}\n{traceback.format_exc()}"
+        if error:
+            self.send({"ok": False, "error": error})
+            return
+        self.send({"ok": True, "class": self.bot_class.__name__, "rss": _current_rss()})
+
+        handlers = {
+            "new_game": self.handle_new_game,
+            "set_position": self.handle_set_position,
+            "push": self.handle_push,
+            "select_move": self.handle_select_move,
+        }
+        for line in protocol_in:
+            request = json.loads(line)
+            command = request.get("cmd")
+            if command == "quit":
+                break
+            handler = handlers.get(command)
+            if handler is None:
+                self.send({"ok": False, "error": f"Unknown command: {command}"})
+                continue
+            try:
+                self.send(handler(request))
+            except Exception as e:
+                self.send({"ok": False, "error": f"{str(e)}\n{traceback.format_exc()}"})
+
+
+def serve(bot_path, memory_limit=None):
+    """Entry point of the host process"""
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    # Keep the real stdout for the protocol and send anything the bot prints
+    # to stderr so it can't corrupt the message stream
+    protocol_out = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    _BotHostServer(bot_path, protocol_out).serve(sys.stdin)
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+def _setting(name, default):
+    from django.conf import settings
+    return getattr(settings, name, default)
+
+
+class BotHost:
+    """Handle on a running bot host process"""
+
+    def __init__(self, key, bot_path, memory_limit=None):
+        self.key = key
+        self.bot_path = bot_path
+        self.games_played = 0
+        self.base_rss = None
+        self.rss = None
+        self.buffer = b""
+        self.output = b""
+        self.output_dropped = 0
+        self.output_open = True
+        command = [sys.executable, __file__, bot_path]
+        if memory_limit:
+            command.append(str(memory_limit))
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+        hello = self._read(COMMAND_TIMEOUT)
+        if not hello.get("ok"):
+            self.close()
+            raise BotHostError(hello.get("error", "Bot host failed to start"))
+        self.base_rss = self.rss = hello.get("rss")
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        """Kill the host process without waiting for it to finish its command"""
+        if self.alive:
+            self.process.kill()
+        self.process.wait()
+
+    def _read(self, timeout):
+        """Read one response line, killing the host if it misses the deadline"""
+        deadline = time.monotonic() + timeout
+        fd = self.process.stdout.fileno()
+        output_fd = self.process.stderr.fileno()
+        while b"\n" not in self.buffer:
+            remaining = deadline - time.monotonic()
+            # Keep reading the bot's output too, so a chatty bot can't block on a full pipe
+            fds = [fd, output_fd] if self.output_open else [fd]
+            ready = select.select(fds, [], [], max(remaining, 0))[0] if remaining > 0 else []
+            if not ready:
+                self.kill()
+                raise BotHostTimeout(f"Bot host for {self.bot_path} did not answer within {timeout:.2f}s")
+            if output_fd in ready:
+                self._read_output()
+            if fd not in ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                self.process.wait()
+                self._read_output()
+                raise BotHostError(
+                    f"Bot host for {self.bot_path} exited unexpectedly (exit code {self.process.returncode})"
+                )
+            self.buffer += chunk
+
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise BotHostError(f"Bot host sent an invalid response: {line[:200]!r}")
+
+    def _read_output(self):
+        """Collect whatever the host has written to stderr so far, without blocking"""
+        fd = self.process.stderr.fileno()
+        while self.output_open and select.select([fd], [], [], 0)[0]:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                self.output_open = False
+                break
+            kept = max(MAX_OUTPUT - len(self.output), 0)
+            self.output += chunk[:kept]
+            self.output_dropped += len(chunk) - len(chunk[:kept])
+
+    def take_output(self):
+        """Return the bot's output since the last call and clear it"""
+        self._read_output()
+        output = self.output.decode('utf-8', 'replace')
+        if self.output_dropped:
+            output += f"\n[{self.output_dropped} more bytes of output dropped]"
+        self.output, self.output_dropped = b"", 0
+        return output
+
+    def request(self, command, timeout=COMMAND_TIMEOUT, **params):
+        """Send a command to the host and wait at most `timeout` seconds for its response"""
+        try:
+            self.process.stdin.write((json.dumps({"cmd": command, **params}) + "\n").encode())
+        except (BrokenPipeError, OSError) as e:
+            raise BotHostError(f"Bot host for {self.bot_path} is not running: {e}")
+        response = self._read(timeout)
+        if "rss" in response:
+            self.rss = response["rss"]
+        return response
+
+    def select_move(self, time_limit, cpu_limit=None, clock=None, debug=False):
+        """Ask the bot for a move under wall-clock and CPU time limits"""
+        return self.request(
+            "select_move",
+            timeout=time_limit + WATCHDOG_GRACE,
+            time_limit=time_limit,
+            cpu_limit=cpu_limit or time_limit,
+            clock=clock,
+            debug=debug,
+        )
+
+    def new_game(self):
+        self.games_played += 1
+        return self.request("new_game")
+
+    def close(self):
+        """Stop the host process"""
+        if self.alive:
+            try:
+                self.process.stdin.write((json.dumps({"cmd": "quit"}) + "\n").encode())
+                self.process.wait(timeout=1)
+            except Exception:
+                pass
+        self.kill()
+
+
+class BotHostPool:
+    """
+    Per-worker pool of idle bot hosts keyed by (bot id, version).
+
+    A host is checked out for the duration of one game and returned
+    afterwards. Hosts that played too many games, grew too much, or died are
+    discarded instead of being returned to the pool.
+    """
+
+    def __init__(self, max_games=None, max_rss_growth=None, max_idle=None):
+        self.max_games = max_games or _setting('BOT_HOST_MAX_GAMES', DEFAULT_MAX_GAMES)
+        self.max_rss_growth = max_rss_growth or _setting('BOT_HOST_MAX_RSS_GROWTH', DEFAULT_MAX_RSS_GROWTH)
+        self.max_idle = max_idle or _setting('BOT_HOST_MAX_IDLE', DEFAULT_MAX_IDLE)
+        self.idle = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, bot_id, version, bot_path, memory_limit=None):
+        """Check out a host for the bot, starting one if none is idle"""
+        key = (str(bot_id), version)
+        with self.lock:
+            hosts = self.idle.get(key, [])
+            while hosts:
+                host = hosts.pop()
+                if host.alive:
+                    if not hosts:
+                        del self.idle[key]
+                    return host
+                host.close()
+            self.idle.pop(key, None)
+        return BotHost(key, bot_path, memory_limit=memory_limit)
+
+    def release(self, host):
+        """Return a host to the pool, or stop it if it should be recycled"""
+        if not self._reusable(host):
+            host.close()
+            return
+
+        evicted = []
+        with self.lock:
+            self.idle.setdefault(host.key, []).append(host)
+            self.idle.move_to_end(host.key)
+            while sum(len(hosts) for hosts in self.idle.values()) > self.max_idle:
+                oldest_key = next(iter(self.idle))
+                evicted.append(self.idle[oldest_key].pop(0))
+                if not self.idle[oldest_key]:
+                    del self.idle[oldest_key]
+        for old_host in evicted:
+            old_host.close()
+
+    def _reusable(self, host):
+        if not host.alive:
+            return False
+        if host.games_played >= self.max_games:
+            return False
+        if host.base_rss is not None and host.rss is not None:
+            if host.rss - host.base_rss > self.max_rss_growth:
+                return False
+        return True
+
+    def shutdown(self):
+        """Stop every idle host"""
+        with self.lock:
+            hosts = [host for hosts in self.idle.values() for host in hosts]
+            self.idle.clear()
+        for host in hosts:
+            host.close()
+
+
+_pool = None
+
+
+def get_pool():
+    """Return the bot host pool of the current worker process"""
+    global _pool
+    if _pool is None:
+        _pool = BotHostPool()
+        atexit.register(_pool.shutdown)
+    return _pool
+
+
+if __name__ == '__main__':
+    # Resolve bot imports like the worker did, not relative to this package
+    sys.path[0] = os.getcwd()
+    serve(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None)
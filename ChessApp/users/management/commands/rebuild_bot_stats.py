@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from users.models import BotStats
+
+class Command(BaseCommand):
+    help = 'Rebuild the leaderboard stats of every bot from the completed matches'
+
+    def handle(self, *args, **options):
+        rows = BotStats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} bot stats rows"))
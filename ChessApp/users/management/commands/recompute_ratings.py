@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from users.ratings import recompute_ratings
+
+class Command(BaseCommand):
+    help = 'Recompute the Elo and Glicko-2 ratings of every bot version from the completed matches'
+
+    def handle(self, *args, **options):
+        games = recompute_ratings()
+        self.stdout.write(self.style.SUCCESS(f"Ratings recomputed from {games} games"))
@@ -0,0 +1,107 @@
+"""
+Levelled, lazily formatted match logs.
+
+Each record is kept as a (message, args) pair and only formatted with
+``message % args`` when it is written out, so detailed records cost almost
+nothing unless they are actually kept. A log can either be rendered in one go
+or streamed to an open file as the game is played.
+"""
+from collections import deque
+
+# Log levels, from least to most detailed
+OFF = 0
+SUMMARY = 1
+MOVES = 2
+DEBUG = 3
+
+LOG_LEVELS = {
+    'off': OFF,
+    'summary': SUMMARY,
+    'moves': MOVES,
+    'debug': DEBUG,
+}
+
+# Number of detailed records kept for games that end abnormally
+DEFAULT_RING_SIZE = 200
+
+
+class MatchLog:
+    """
+    Log of a single match.
+
+    Records at or below the configured level are kept and always written.
+    More detailed records go to a bounded ring buffer that is only written
+    when the game ends abnormally (a crash, timeout or illegal move), so the
+    moves leading up to a failure are still available for debugging.
+
+    When a binary stream is given, kept records are written to it as they
+    arrive instead of being held in memory; call finish() at the end.
+    """
+
+    def __init__(self, level='moves', ring_size=DEFAULT_RING_SIZE, stream=None):
+        self.level = LOG_LEVELS.get(level, MOVES) if isinstance(level, str) else level
+        self.stream = stream
+        self.records = []
+        self.ring = deque(maxlen=ring_size)
+        self.dropped = 0
+
+    @property
+    def wants_debug(self):
+        """Whether debug records are kept, so callers can skip gathering them"""
+        return self.level >= DEBUG
+
+    def log(self, level, message, *args):
+        if level <= self.level:
+            if self.stream is not None:
+                self.stream.write((self._format(message, args) + "\n").encode('utf-8'))
+            else:
+                self.records.append((message, args))
+            return
+        if len(self.ring) == self.ring.maxlen:
+            self.dropped += 1
+        self.ring.append((message, args))
+
+    def summary(self, message, *args):
+        self.log(SUMMARY, message, *args)
+
+    def moves(self, message, *args):
+        self.log(MOVES, message, *args)
+
+    def debug(self, message, *args):
+        self.log(DEBUG, message, *args)
+
+    @staticmethod
+    def _format(message, args):
+        if not args:
+            return message
+        try:
+            return message % args
+        except (TypeError, ValueError):
+            return f"{message} {args}"
+
+    def _ring_lines(self):
+        header = f"Last {len(self.ring)} detailed log records"
+        if self.dropped:
+            header += f" ({self.dropped} older records dropped)"
+        lines = ["", header + ":"]
+        lines.extend(self._format(message, args) for message, args in self.ring)
+        return lines
+
+    def render(self, abnormal=False):
+        """Format the log. Pass abnormal=True to include the ring buffer"""
+        lines = [self._format(message, args) for message, args in self.records]
+        if abnormal and self.ring:
+            lines.extend(self._ring_lines())
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
+
+    def finish(self, abnormal=False):
+        """Close a streamed log, appending the ring buffer if abnormal=True"""
+        if self.stream is None or self.stream.closed:
+            return
+        if abnormal and self.ring:
+            self.stream.write(("\n".join(self._ring_lines()) + "\n").encode('utf-8'))
+        self.stream.close()
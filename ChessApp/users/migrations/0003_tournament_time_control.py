@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_chessbot_file_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournament',
+            name='base_time_ms',
+            field=models.PositiveIntegerField(default=60000),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='increment_ms',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='move_time_ms',
+            field=models.PositiveIntegerField(default=5000),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='node_limit',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='time_control',
+            field=models.CharField(choices=[('move_time', 'Fixed time per move'), ('clock', 'Game clock with increment'), ('nodes', 'Node budget per move')], default='move_time', max_length=10),
+        ),
+    ]
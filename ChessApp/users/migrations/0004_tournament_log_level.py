@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_tournament_time_control'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournament',
+            name='log_level',
+            field=models.CharField(choices=[('off', 'Off'), ('summary', 'Summary'), ('moves', 'Per move'), ('debug', 'Debug')], default='moves', max_length=10),
+        ),
+    ]
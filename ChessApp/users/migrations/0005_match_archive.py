@@ -0,0 +1,33 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_tournament_log_level'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='log_length',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='log_offset',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='pgn_length',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='pgn_offset',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_match_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='scored',
+            field=models.BooleanField(default=False),
+        ),
+    ]
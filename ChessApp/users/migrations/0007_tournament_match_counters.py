@@ -0,0 +1,37 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:42
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_existing_matches(apps, schema_editor):
+    Tournament = apps.get_model('users', 'Tournament')
+    counts = Tournament.objects.annotate(
+        total=Count('matches'),
+        completed=Count('matches', filter=Q(matches__status='completed')),
+    )
+    for tournament in counts:
+        Tournament.objects.filter(pk=tournament.pk).update(
+            total_matches=tournament.total, completed_matches=tournament.completed
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_match_scored'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournament',
+            name='completed_matches',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='total_matches',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_matches, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def build_existing_stats(apps, schema_editor):
+    Match = apps.get_model('users', 'Match')
+    BotStats = apps.get_model('users', 'BotStats')
+    totals = {}
+    completed = Match.objects.filter(status='completed')
+    for side, win, loss in (('white_bot', 'white_win', 'black_win'), ('black_bot', 'black_win', 'white_win')):
+        rows = completed.values(side, 'tournament').annotate(
+            games=Count('id'),
+            wins=Count('id', filter=Q(result=win)),
+            draws=Count('id', filter=Q(result='draw')),
+            losses=Count('id', filter=Q(result=loss)),
+        )
+        for row in rows:
+            delta = (row['games'], row['wins'], row['draws'], row['losses'])
+            for key in ((row[side], row['tournament']), (row[side], None)):
+                totals[key] = tuple(a + b for a, b in zip(totals.get(key, (0, 0, 0, 0)), delta))
+    BotStats.objects.bulk_create([
+        BotStats(bot_id=bot_id, tournament_id=tournament_id, games=games, wins=wins, draws=draws, losses=losses,
+                 win_percentage=wins * 100 / games, draw_percentage=draws * 100 / games)
+        for (bot_id, tournament_id), (games, wins, draws, losses) in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_tournament_match_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('wins', models.PositiveIntegerField(default=0)),
+                ('draws', models.PositiveIntegerField(default=0)),
+                ('losses', models.PositiveIntegerField(default=0)),
+                ('win_percentage', models.FloatField(default=0)),
+                ('draw_percentage', models.FloatField(default=0)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='users.chessbot')),
+                ('tournament', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bot_stats', to='users.tournament')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tournament', '-win_percentage'], name='bot_stats_leaderboard')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='botstats',
+            constraint=models.UniqueConstraint(fields=('bot', 'tournament'), name='unique_bot_stats_per_tournament'),
+        ),
+        migrations.AddConstraint(
+            model_name='botstats',
+            constraint=models.UniqueConstraint(condition=models.Q(('tournament__isnull', True)), fields=('bot',), name='unique_bot_stats_overall'),
+        ),
+        migrations.RunPython(build_existing_stats, migrations.RunPython.noop),
+    ]
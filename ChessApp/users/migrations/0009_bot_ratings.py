@@ -0,0 +1,59 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_bot_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='black_version',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='white_version',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='BotRating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('elo', models.FloatField(default=1500.0)),
+                ('glicko_rating', models.FloatField(default=1500.0)),
+                ('glicko_rd', models.FloatField(default=350.0)),
+                ('glicko_volatility', models.FloatField(default=0.06)),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to='users.chessbot')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-elo'], name='bot_rating_elo')],
+                'unique_together': {('bot', 'version')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RatingHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('elo', models.FloatField()),
+                ('glicko_rating', models.FloatField()),
+                ('glicko_rd', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_history', to='users.chessbot')),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_history', to='users.match')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['bot', 'version', 'id'], name='rating_history_bot')],
+            },
+        ),
+    ]
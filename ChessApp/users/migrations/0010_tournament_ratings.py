@@ -0,0 +1,24 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_bot_ratings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TournamentRatings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('result', models.JSONField(default=dict)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('tournament', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='bayes_ratings', to='users.tournament')),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_tournament_ratings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournament',
+            name='format',
+            field=models.CharField(choices=[('round_robin', 'Round robin'), ('sprt', 'Head-to-head SPRT')], default='round_robin', max_length=15),
+        ),
+        migrations.CreateModel(
+            name='SprtTest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('elo0', models.FloatField(default=0.0)),
+                ('elo1', models.FloatField(default=10.0)),
+                ('alpha', models.FloatField(default=0.05)),
+                ('beta', models.FloatField(default=0.05)),
+                ('batch_pairs', models.PositiveIntegerField(default=8)),
+                ('max_pairs', models.PositiveIntegerField(default=500)),
+                ('pairs_scheduled', models.PositiveIntegerField(default=0)),
+                ('pentanomial', models.JSONField(default=list)),
+                ('llr', models.FloatField(default=0.0)),
+                ('result', models.CharField(choices=[('running', 'Running'), ('h1', 'Candidate stronger (H1 accepted)'), ('h0', 'Candidate not stronger (H0 accepted)'), ('inconclusive', 'Inconclusive after the maximum number of pairs')], default='running', max_length=15)),
+                ('baseline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.chessbot')),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.chessbot')),
+                ('tournament', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sprt', to='users.tournament')),
+            ],
+        ),
+    ]
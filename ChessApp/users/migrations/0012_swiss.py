@@ -0,0 +1,28 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_tournament_sprt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournament',
+            name='rounds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tournamentparticipant',
+            name='byes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='tournament',
+            name='format',
+            field=models.CharField(choices=[('round_robin', 'Round robin'), ('sprt', 'Head-to-head SPRT'), ('swiss', 'Swiss system')], default='round_robin', max_length=15),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:54
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_swiss'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournament',
+            name='challenger',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='gauntlets', to='users.chessbot'),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='games_per_pairing',
+            field=models.PositiveIntegerField(default=2, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AlterField(
+            model_name='tournament',
+            name='format',
+            field=models.CharField(choices=[('round_robin', 'Round robin'), ('sprt', 'Head-to-head SPRT'), ('swiss', 'Swiss system'), ('gauntlet', 'Gauntlet'), ('knockout', 'Knockout')], default='round_robin', max_length=15),
+        ),
+    ]
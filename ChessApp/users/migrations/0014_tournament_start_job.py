@@ -0,0 +1,29 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:56
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_gauntlet_knockout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TournamentStartJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('options', models.JSONField(default=dict)),
+                ('matches_created', models.PositiveIntegerField(default=0)),
+                ('matches_dispatched', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('tournament', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='start_jobs', to='users.tournament')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.4 on 2026-10-18 00:07
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_match_queued'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tournament',
+            name='base_time_ms',
+            field=models.PositiveIntegerField(default=60000, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AlterField(
+            model_name='tournament',
+            name='move_time_ms',
+            field=models.PositiveIntegerField(default=5000, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AlterField(
+            model_name='tournament',
+            name='node_limit',
+            field=models.PositiveIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
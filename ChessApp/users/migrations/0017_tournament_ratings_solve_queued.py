@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_time_control_minimums'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournamentratings',
+            name='solve_queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.4 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_tournament_ratings_solve_queued'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='batch',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['tournament', 'status', 'round'], name='match_schedule'),
+        ),
+    ]
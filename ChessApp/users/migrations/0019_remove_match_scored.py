@@ -0,0 +1,17 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0018_match_batch'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='match',
+            name='scored',
+        ),
+    ]
@@ -1,11 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.validators import MinValueValidator
 from django.utils import timezone
 import os
 import uuid
-from django.core.files.base import ContentFile
+from datetime import timedelta
 from .utils import PathAndRename, validate_file_size, validate_file_extension
-from .utils import ensure_directory_exists
 
 class CustomUser(AbstractUser):
     USER_TYPE_CHOICES = (
@@ -85,6 +85,27 @@ class Tournament(models.Model):
         ('cancelled', 'Cancelled'),
     )
     
+    LOG_LEVEL_CHOICES = (
+        ('off', 'Off'),
+        ('summary', 'Summary'),
+        ('moves', 'Per move'),
+        ('debug', 'Debug'),
+    )
+    
+    FORMAT_CHOICES = (
+        ('round_robin', 'Round robin'),
+        ('sprt', 'Head-to-head SPRT'),
+        ('swiss', 'Swiss system'),
+        ('gauntlet', 'Gauntlet'),
+        ('knockout', 'Knockout'),
+    )
+    
+    TIME_CONTROL_CHOICES = (
+        ('move_time', 'Fixed time per move'),
+        ('clock', 'Game clock with increment'),
+        ('nodes', 'Node budget per move'),
+    )
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
@@ -95,6 +116,27 @@ class Tournament(models.Model):
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='scheduled')
     participants = models.ManyToManyField(ChessBot, through='TournamentParticipant')
     
+    # How matches are scheduled; formats other than round robin schedule one round at a time
+    format = models.CharField(max_length=15, choices=FORMAT_CHOICES, default='round_robin')
+    rounds = models.PositiveIntegerField(null=True, blank=True)  # Swiss rounds, ceil(log2(participants)) if not set
+    games_per_pairing = models.PositiveIntegerField(default=2, validators=[MinValueValidator(1)])  # Gauntlet and knockout games per opponent, colours alternating
+    challenger = models.ForeignKey(ChessBot, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='gauntlets')  # Gauntlet bot facing every other participant
+    
+    # Time control used by every match of the tournament
+    time_control = models.CharField(max_length=10, choices=TIME_CONTROL_CHOICES, default='move_time')
+    move_time_ms = models.PositiveIntegerField(default=5000, validators=[MinValueValidator(1)])  # Per move limit, also the safety limit for 'nodes'
+    base_time_ms = models.PositiveIntegerField(default=60000, validators=[MinValueValidator(1)])  # Starting clock per side for 'clock'
+    increment_ms = models.PositiveIntegerField(default=0)  # Added to the clock after each move for 'clock'
+    node_limit = models.PositiveIntegerField(null=True, blank=True, validators=[MinValueValidator(1)])  # Node budget passed to bots for 'nodes'
+    
+    # Detail of the match logs; more detailed records are only kept for games that end abnormally
+    log_level = models.CharField(max_length=10, choices=LOG_LEVEL_CHOICES, default='moves')
+    
+    # Maintained as matches are created and finalized, so completion is detected without counting rows
+    total_matches = models.PositiveIntegerField(default=0)
+    completed_matches = models.PositiveIntegerField(default=0)
+    
     class Meta:
         ordering = ['-created_at']
         
@@ -120,71 +162,81 @@ class Tournament(models.Model):
         self.status = 'cancelled'
         self.save()
     
+    def add_matches(self, count):
+        """Account for newly created matches in total_matches"""
+        from django.db.models import F
+        
+        Tournament.objects.filter(pk=self.pk).update(total_matches=F('total_matches') + count)
+        self.total_matches += count
+    
+    @staticmethod
+    def count_completed(tournament_id, count=1):
+        """
+        Add finished matches to a tournament's completed_matches, within the
+        caller's transaction. Returns True for the one call that brings the
+        counter up to total_matches, when every scheduled match is done and
+        the tournament should either schedule its next round or complete.
+        """
+        from django.db.models import F
+        
+        Tournament.objects.filter(pk=tournament_id).update(completed_matches=F('completed_matches') + count)
+        # The row stays locked by the update until commit, so this reads our own increment
+        completed, total = Tournament.objects.filter(pk=tournament_id).values_list(
+            'completed_matches', 'total_matches').get()
+        return total > 0 and completed - count < total <= completed
+    
+    @staticmethod
+    def remove_matches(matches):
+        """
+        Take a queryset of matches that is about to be deleted out of their
+        tournaments' total_matches and completed_matches, within the caller's
+        transaction.
+        """
+        from django.db.models import Count, F, Q
+        
+        counts = (matches.order_by('tournament').values('tournament')
+                  .annotate(total=Count('id'), completed=Count('id', filter=Q(status='completed'))))
+        # Update tournaments in a fixed order so concurrent deletes can't deadlock
+        for row in counts:
+            Tournament.objects.filter(pk=row['tournament']).update(
+                total_matches=F('total_matches') - row['total'],
+                completed_matches=F('completed_matches') - row['completed'],
+            )
+    
     def recalculate_scores(self):
         """Reset and recalculate scores for all participants"""
         from django.db import transaction
+        from django.db.models import Case, Count, FloatField, Q, Sum, Value, When
         
         with transaction.atomic():
-            # Reset all scores to zero
-            TournamentParticipant.objects.filter(tournament=self).update(score=0.0)
+            completed_matches = Match.objects.filter(tournament=self, status='completed')
             
-            # Get all completed matches and update scores
-            completed_matches = Match.objects.filter(
-                tournament=self,
-                status='completed'
-            )
+            # Sum the points of each bot as white and as black, one grouped query per side
+            scores = {}
+            for side, win in (('white_bot', 'white_win'), ('black_bot', 'black_win')):
+                points = Sum(Case(
+                    When(result=win, then=Value(1.0)),
+                    When(result='draw', then=Value(0.5)),
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                ))
+                for bot_id, total in completed_matches.values(side).annotate(points=points).values_list(side, 'points'):
+                    scores[bot_id] = scores.get(bot_id, 0.0) + (total or 0.0)
             
-            # Process each match
-            for match in completed_matches:
-                if match.result == 'white_win':
-                    try:
-                        participant = TournamentParticipant.objects.get(
-                            tournament=self,
-                            bot=match.white_bot
-                        )
-                        participant.score += 1.0
-                        participant.save()
-                    except TournamentParticipant.DoesNotExist:
-                        pass
-                    
-                elif match.result == 'black_win':
-                    try:
-                        participant = TournamentParticipant.objects.get(
-                            tournament=self,
-                            bot=match.black_bot
-                        )
-                        participant.score += 1.0
-                        participant.save()
-                    except TournamentParticipant.DoesNotExist:
-                        pass
-                    
-                elif match.result == 'draw':
-                    try:
-                        white_participant = TournamentParticipant.objects.get(
-                            tournament=self,
-                            bot=match.white_bot
-                        )
-                        white_participant.score += 0.5
-                        white_participant.save()
-                    except TournamentParticipant.DoesNotExist:
-                        pass
-                        
-                    try:
-                        black_participant = TournamentParticipant.objects.get(
-                            tournament=self,
-                            bot=match.black_bot
-                        )
-                        black_participant.score += 0.5
-                        black_participant.save()
-                    except TournamentParticipant.DoesNotExist:
-                        pass
+            participants = list(TournamentParticipant.objects.filter(tournament=self))
+            for participant in participants:
+                # A Swiss bye is worth a win
+                participant.score = scores.get(participant.bot_id, 0.0) + participant.byes
+            TournamentParticipant.objects.bulk_update(participants, ['score'])
             
-            # Check if tournament should be marked as complete
-            if self.status == 'in_progress':
-                total_matches = Match.objects.filter(tournament=self).count()
-                completed_count = completed_matches.count()
+            # Check if tournament should be marked as complete; other formats may have rounds left to schedule
+            if self.status == 'in_progress' and self.format == 'round_robin':
+                counts = Match.objects.filter(tournament=self).aggregate(
+                    total=Count('id'),
+                    completed=Count('id', filter=Q(status='completed')),
+                )
                 
-                if total_matches > 0 and total_matches == completed_count:
+                if counts['total'] > 0 and counts['total'] == counts['completed']:
                     self.status = 'completed'
                     self.completed_at = timezone.now()
                     self.save()
@@ -197,6 +249,7 @@ class TournamentParticipant(models.Model):
     added_at = models.DateTimeField(auto_now_add=True)
     score = models.FloatField(default=0)  # Using float for half-points in draws
     rank = models.IntegerField(null=True, blank=True)
+    byes = models.PositiveIntegerField(default=0)  # Swiss rounds sat out, one point each
     
     class Meta:
         unique_together = ('tournament', 'bot')
@@ -205,6 +258,7 @@ class TournamentParticipant(models.Model):
 class Match(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
+        ('queued', 'Queued'),  # Released to the workers by the scheduler
         ('in_progress', 'In Progress'),
         ('completed', 'Completed'),
         ('error', 'Error'),
@@ -218,6 +272,13 @@ class Match(models.Model):
         ('error', 'Error'),
     )
     
+    # Points for (white, black) by result
+    RESULT_POINTS = {
+        'white_win': (1.0, 0.0),
+        'black_win': (0.0, 1.0),
+        'draw': (0.5, 0.5),
+    }
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, related_name='matches')
     white_bot = models.ForeignKey(ChessBot, on_delete=models.CASCADE, related_name='white_matches')
@@ -231,8 +292,24 @@ class Match(models.Model):
     log_file = models.FileField(upload_to='match_logs/%Y/%m/%d/', null=True, blank=True)
     round = models.PositiveIntegerField(null=True, blank=True)  # Added round field
     
+    # Location of the game in its tournament's archives (see users/archive.py)
+    pgn_offset = models.BigIntegerField(null=True, blank=True)
+    pgn_length = models.PositiveIntegerField(null=True, blank=True)
+    log_offset = models.BigIntegerField(null=True, blank=True)
+    log_length = models.PositiveIntegerField(null=True, blank=True)
+    
+    # Bot versions that played the match, recorded when it starts
+    white_version = models.PositiveIntegerField(null=True, blank=True)
+    black_version = models.PositiveIntegerField(null=True, blank=True)
+    
+    # run_match_batch task the scheduler released the match in (see users/scheduler.py)
+    batch = models.UUIDField(null=True, blank=True)
+    
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['tournament', 'status', 'round'], name='match_schedule'),
+        ]
     
     def __str__(self):
         return f"Match: {self.white_bot.name} vs {self.black_bot.name}"
@@ -243,170 +320,449 @@ class Match(models.Model):
         self.save()
     
     def complete_match(self, result):
-        self.status = 'completed'
-        self.result = result
-        self.completed_at = timezone.now()
-        self.save()
+        return self.finalize(result)
+    
+    def artifact_name(self, kind):
+        """
+        Storage name of the match's 'pgn' or 'log' file, dated by the start of
+        the match so it is known before the game is played.
+        """
+        day = (self.started_at or timezone.now()).strftime('%Y/%m/%d')
+        if kind == 'pgn':
+            return f"match_records/{day}/match_{self.id}.pgn"
+        return f"match_logs/{day}/match_{self.id}_log.txt"
+
+    def has_artifact(self, kind):
+        """Whether the match has a 'pgn' or 'log', archived or as a loose file"""
+        field = self.pgn_file if kind == 'pgn' else self.log_file
+        return bool(field) or getattr(self, f'{kind}_length') is not None
+    
+    def read_artifact(self, kind):
+        """Contents of the match's 'pgn' or 'log' as bytes, or None if there is none"""
+        from . import archive
         
-        # Update tournament participant scores
-        if result == 'white_win':
-            self._update_score(self.white_bot, 1)
-            self._update_score(self.black_bot, 0)
-        elif result == 'black_win':
-            self._update_score(self.white_bot, 0)
-            self._update_score(self.black_bot, 1)
-        elif result == 'draw':
-            self._update_score(self.white_bot, 0.5)
-            self._update_score(self.black_bot, 0.5)
-    
-    def _update_score(self, bot, points):
-        participant = TournamentParticipant.objects.get(
-            tournament=self.tournament,
-            bot=bot
-        )
-        participant.score += points
-        participant.save()
-    
-    def save_log_file(self, log_content):
-        """Save the log content to the log_file field with enhanced error handling"""
+        length = getattr(self, f'{kind}_length')
+        if length is not None:
+            return archive.read(self.tournament_id, kind, getattr(self, f'{kind}_offset'), length)
+        field = self.pgn_file if kind == 'pgn' else self.log_file
+        if not field:
+            return None
+        with field.open('rb') as f:
+            return f.read()
+    
+    def _save_artifact(self, kind, content, save):
+        """Write an artifact once, straight to its final name"""
         from django.conf import settings
-        import os
-        import datetime
+        from .recording import open_artifact
         
-        # Create date-based path
-        today = datetime.date.today()
-        log_dir = os.path.join(
-            settings.MEDIA_ROOT, 
-            'match_logs',
-            str(today.year),
-            str(today.month).zfill(2),
-            str(today.day).zfill(2)
-        )
+        name = self.artifact_name(kind)
+        field = self.pgn_file if kind == 'pgn' else self.log_file
+        try:
+            with open_artifact(os.path.join(settings.MEDIA_ROOT, name)) as f:
+                f.write(content.encode('utf-8'))
+        except OSError as e:
+            import logging
+            logging.error(f"Failed to save {kind} file for match {self.id}: {e}")
+            return False
         
-        # Ensure directory exists with proper permissions
-        from .utils import ensure_directory_exists
-        ensure_directory_exists(log_dir)
+        field.name = name
+        if save:
+            self.save(update_fields=[field.field.name])
+        return True
+    
+    def append_log(self, text):
+        """
+        Append text, such as an error, to the match's loose log file, keeping
+        whatever was already streamed to it. Leaves saving the model to the caller.
+        """
+        from django.conf import settings
         
-        # Direct file writing approach - more likely to work with permission issues
+        name = self.artifact_name('log')
+        path = os.path.join(settings.MEDIA_ROOT, name)
         try:
-            log_filename = f"match_{self.id}_log.txt"
-            full_path = os.path.join(log_dir, log_filename)
-            
-            # Write directly to file first
-            with open(full_path, 'w') as f:
-                f.write(log_content)
-            
-            # Then update the model field to point to this file
-            from django.core.files import File
-            with open(full_path, 'rb') as f:
-                self.log_file.save(log_filename, File(f), save=False)
-            
-            # Save the model
-            self.save(update_fields=['log_file'])
-            return True
-        except Exception as e:
-            # Fall back to Django's ContentFile approach if direct file writing fails
-            try:
-                from django.core.files.base import ContentFile
-                log_file = ContentFile(log_content.encode('utf-8'))
-                self.log_file.save(f"match_{self.id}_log.txt", log_file, save=True)
-                return True
-            except Exception as e2:
-                import logging
-                logging.error(f"Failed to save log file: {e2}")
-                return False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as f:
+                f.write(text.encode('utf-8'))
+        except OSError as e:
+            import logging
+            logging.error(f"Failed to append to the log file of match {self.id}: {e}")
+            return False
+        
+        self.log_file.name = name
+        return True
+    
+    def save_log_file(self, log_content, save=True):
+        """
+        Save the log content to the log_file field.
+        Pass save=False to leave saving the model to the caller.
+        """
+        return self._save_artifact('log', log_content, save)
 
-    def save_pgn_file(self, pgn_content):
-        """Save PGN content to a file with enhanced error handling"""
-        from django.conf import settings
-        import os
-        import datetime
+    def save_pgn_file(self, pgn_content, save=True):
+        """
+        Save PGN content to the pgn_file field.
+        Pass save=False to leave saving the model to the caller.
+        """
+        return self._save_artifact('pgn', pgn_content, save)
+    
+    def _add_points(self, points):
+        """Increment both participants' scores with a single UPDATE"""
+        from django.db.models import Case, F, Value, When
         
-        # Create date-based path
-        today = datetime.date.today()
-        pgn_dir = os.path.join(
-            settings.MEDIA_ROOT, 
-            'match_records',
-            str(today.year),
-            str(today.month).zfill(2),
-            str(today.day).zfill(2)
-        )
+        TournamentParticipant.objects.filter(
+            tournament_id=self.tournament_id,
+            bot_id__in=[self.white_bot_id, self.black_bot_id],
+        ).update(score=F('score') + Case(
+            When(bot_id=self.white_bot_id, then=Value(points[0])),
+            default=Value(points[1]),
+        ))
+    
+    def finalize(self, result, update_fields=()):
+        """
+        Record the result of the match and add it to the scores, exactly once.
         
-        # Ensure directory exists with proper permissions
-        from .utils import ensure_directory_exists
-        ensure_directory_exists(pgn_dir)
+        The match row is only written if it isn't completed yet, and the
+        score deltas and the tournament's completed_matches counter go in the
+        same transaction, so a retried task or an error path racing a normal
+        finish can never count a game twice. The completion check of the
+        tournament is queued once the match that completes it is committed.
+        update_fields lists other fields set on the instance to write along
+        with the result. Returns False if the match was already finalized.
+        """
+        from django.db import transaction
+        from . import ratings
+        from .tasks import check_tournament_completion, evaluate_sprt, feed_tournament
         
-        # Direct file writing approach - more likely to work with permission issues
-        try:
-            pgn_filename = f"match_{self.id}.pgn"
-            full_path = os.path.join(pgn_dir, pgn_filename)
-            
-            # Write directly to file first
-            with open(full_path, 'w') as f:
-                f.write(pgn_content)
-            
-            # Then update the model field to point to this file
-            from django.core.files import File
-            with open(full_path, 'rb') as f:
-                self.pgn_file.save(pgn_filename, File(f), save=False)
-            
-            # Save the model
-            self.save(update_fields=['pgn_file'])
-            return True
-        except Exception as e:
-            # Fall back to Django's ContentFile approach if direct file writing fails
-            try:
-                from django.core.files.base import ContentFile
-                pgn_file = ContentFile(pgn_content.encode('utf-8'))
-                self.pgn_file.save(f"match_{self.id}.pgn", pgn_file, save=True)
-                return True
-            except Exception as e2:
-                import logging
-                logging.error(f"Failed to save PGN file: {e2}")
+        points = self.RESULT_POINTS.get(result)
+        self.status = 'completed'
+        self.result = result
+        self.completed_at = timezone.now()
+        
+        values = {name: getattr(self, name)
+                  for name in ('status', 'result', 'completed_at', *update_fields)}
+        with transaction.atomic():
+            claimed = Match.objects.filter(pk=self.pk).exclude(status='completed').update(**values)
+            if not claimed:
                 return False
+            if points is not None:
+                self._add_points(points)
+            BotStats.record_matches([self])
+            ratings.record_match(self)
+            tournament_id = str(self.tournament_id)
+            transaction.on_commit(lambda: feed_tournament.delay(tournament_id))
+            if self.tournament.format == 'sprt':
+                transaction.on_commit(lambda: evaluate_sprt.delay(tournament_id))
+            if Tournament.count_completed(self.tournament_id):
+                transaction.on_commit(lambda: check_tournament_completion.delay(tournament_id))
+        return True
+
+class BotStats(models.Model):
+    """
+    Rolled-up results of a bot, overall (tournament is null) or in one
+    tournament. Updated with atomic deltas as matches are finalized and
+    deleted so the leaderboard never has to scan the Match table; rebuild
+    it from scratch with the rebuild_bot_stats management command.
+    """
+    bot = models.ForeignKey(ChessBot, on_delete=models.CASCADE, related_name='stats')
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, null=True, blank=True, related_name='bot_stats')
+    games = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    draws = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    win_percentage = models.FloatField(default=0)
+    draw_percentage = models.FloatField(default=0)
     
-    def update_scores(self):
-        """Update tournament participant scores based on match results"""
-        # Only process if match is completed and part of a tournament
-        if self.status != 'completed' or not self.tournament:
-            return False
-            
-        # Get participants
-        try:
-            white_participant = TournamentParticipant.objects.get(
-                tournament=self.tournament,
-                bot=self.white_bot
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bot', 'tournament'], name='unique_bot_stats_per_tournament'),
+            models.UniqueConstraint(fields=['bot'], condition=models.Q(tournament__isnull=True),
+                                    name='unique_bot_stats_overall'),
+        ]
+        indexes = [
+            models.Index(fields=['tournament', '-win_percentage'], name='bot_stats_leaderboard'),
+        ]
+    
+    def __str__(self):
+        return f"{self.bot.name}: {self.wins}/{self.draws}/{self.losses}"
+    
+    @staticmethod
+    def result_deltas(match):
+        """(games, wins, draws, losses) to add for the white and the black bot of a completed match"""
+        white = black = (1, 0, 0, 0)
+        if match.result == 'white_win':
+            white, black = (1, 1, 0, 0), (1, 0, 0, 1)
+        elif match.result == 'black_win':
+            white, black = (1, 0, 0, 1), (1, 1, 0, 0)
+        elif match.result == 'draw':
+            white = black = (1, 0, 1, 0)
+        return white, black
+    
+    @classmethod
+    def record_matches(cls, matches):
+        """
+        Add completed matches to the stats of their bots, both in their
+        tournament and overall. Meant to run in the transaction that
+        finalizes the matches.
+        """
+        deltas = {}
+        for match in matches:
+            for bot_id, delta in zip((match.white_bot_id, match.black_bot_id), cls.result_deltas(match)):
+                for key in ((bot_id, match.tournament_id), (bot_id, None)):
+                    deltas[key] = tuple(a + b for a, b in zip(deltas.get(key, (0, 0, 0, 0)), delta))
+        cls._apply(deltas)
+    
+    @classmethod
+    def remove_matches(cls, matches):
+        """
+        Take a queryset of matches that is about to be deleted out of the
+        stats of their bots, so the overall rows don't keep counting them.
+        Only completed matches were ever counted.
+        """
+        deltas = {key: tuple(-n for n in delta) for key, delta in cls._totals(matches).items()}
+        cls._apply(deltas, create=False)
+    
+    @classmethod
+    def _totals(cls, matches):
+        """(games, wins, draws, losses) per (bot, tournament) and (bot, None) over the completed matches"""
+        from django.db.models import Count, Q
+        
+        totals = {}
+        completed = matches.filter(status='completed')
+        for side, win, loss in (('white_bot', 'white_win', 'black_win'), ('black_bot', 'black_win', 'white_win')):
+            rows = completed.values(side, 'tournament').annotate(
+                games=Count('id'),
+                wins=Count('id', filter=Q(result=win)),
+                draws=Count('id', filter=Q(result='draw')),
+                losses=Count('id', filter=Q(result=loss)),
             )
-            
-            black_participant = TournamentParticipant.objects.get(
-                tournament=self.tournament,
-                bot=self.black_bot
+            for row in rows:
+                delta = (row['games'], row['wins'], row['draws'], row['losses'])
+                for key in ((row[side], row['tournament']), (row[side], None)):
+                    totals[key] = tuple(a + b for a, b in zip(totals.get(key, (0, 0, 0, 0)), delta))
+        return totals
+    
+    @classmethod
+    def _apply(cls, deltas, create=True):
+        """Add (games, wins, draws, losses) deltas to the (bot, tournament) rows, creating missing ones if create"""
+        from django.db.models import F, FloatField, Q
+        from django.db.models.functions import Cast, Greatest
+        
+        if not deltas:
+            return
+        
+        # Make sure every row exists, then lock them all in (bot, tournament) order so concurrent
+        # finalizations touching the same overall rows can't deadlock
+        if create:
+            cls.objects.bulk_create(
+                [cls(bot_id=bot_id, tournament_id=tournament_id) for bot_id, tournament_id in deltas],
+                ignore_conflicts=True,
+            )
+        rows_by_delta = {}
+        all_rows = Q()
+        for (bot_id, tournament_id), delta in deltas.items():
+            if tournament_id is None:
+                row = Q(bot_id=bot_id, tournament__isnull=True)
+            else:
+                row = Q(bot_id=bot_id, tournament_id=tournament_id)
+            rows_by_delta[delta] = rows_by_delta[delta] | row if delta in rows_by_delta else row
+            all_rows |= row
+        list(cls.objects.select_for_update().filter(all_rows).order_by('bot_id', 'tournament_id').values_list('id'))
+        
+        # Then apply each distinct delta with one UPDATE
+        for (games, wins, draws, losses), rows in rows_by_delta.items():
+            new_games = Cast(Greatest(F('games') + games, 1), FloatField())
+            cls.objects.filter(rows).update(
+                games=F('games') + games,
+                wins=F('wins') + wins,
+                draws=F('draws') + draws,
+                losses=F('losses') + losses,
+                win_percentage=(F('wins') + wins) * 100.0 / new_games,
+                draw_percentage=(F('draws') + draws) * 100.0 / new_games,
             )
+    
+    @classmethod
+    def rebuild(cls):
+        """Recompute every row from the completed matches"""
+        from django.db import transaction
+        
+        stats = [
+            cls(bot_id=bot_id, tournament_id=tournament_id, games=games, wins=wins, draws=draws, losses=losses,
+                win_percentage=wins * 100 / games, draw_percentage=draws * 100 / games)
+            for (bot_id, tournament_id), (games, wins, draws, losses) in cls._totals(Match.objects.all()).items()
+        ]
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(stats, batch_size=1000)
+        return len(stats)
+
+class BotRating(models.Model):
+    """Elo and Glicko-2 ratings of one version of a bot (see users/ratings.py)"""
+    bot = models.ForeignKey(ChessBot, on_delete=models.CASCADE, related_name='ratings')
+    version = models.PositiveIntegerField()
+    elo = models.FloatField(default=1500.0)
+    glicko_rating = models.FloatField(default=1500.0)
+    glicko_rd = models.FloatField(default=350.0)
+    glicko_volatility = models.FloatField(default=0.06)
+    games = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('bot', 'version')
+        indexes = [
+            models.Index(fields=['-elo'], name='bot_rating_elo'),
+        ]
+    
+    def __str__(self):
+        return f"{self.bot.name} v{self.version}: {self.elo:.0f}"
+    
+    def values(self):
+        return (self.elo, self.glicko_rating, self.glicko_rd, self.glicko_volatility)
+
+class RatingHistory(models.Model):
+    """Ratings of a bot version right after one of its matches"""
+    bot = models.ForeignKey(ChessBot, on_delete=models.CASCADE, related_name='rating_history')
+    version = models.PositiveIntegerField()
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name='rating_history')
+    elo = models.FloatField()
+    glicko_rating = models.FloatField()
+    glicko_rd = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['bot', 'version', 'id'], name='rating_history_bot'),
+        ]
+
+class TournamentRatings(models.Model):
+    """Cached BayesElo-style ratings of a tournament's bots (see users/bayeselo.py)"""
+    tournament = models.OneToOneField(Tournament, on_delete=models.CASCADE, related_name='bayes_ratings')
+    games = models.PositiveIntegerField(default=0)  # Completed matches the ratings were computed from
+    result = models.JSONField(default=dict)
+    computed_at = models.DateTimeField(auto_now=True)
+    solve_queued_at = models.DateTimeField(null=True, blank=True)  # Set while a solve is queued or running
+    
+    # A queued solve older than this is assumed lost, e.g. with a crashed worker, and may be queued again
+    SOLVE_TIMEOUT = timedelta(minutes=10)
+    
+    def is_stale(self):
+        return self.games != self.tournament.completed_matches
+    
+    def claim_solve(self):
+        """
+        Mark a solve as queued unless one already is, so requests polling
+        stale ratings queue one solve at a time. Returns whether the caller
+        should queue it.
+        """
+        from django.db.models import Q
+        
+        now = timezone.now()
+        claimed = TournamentRatings.objects.filter(
+            Q(solve_queued_at__isnull=True) | Q(solve_queued_at__lt=now - self.SOLVE_TIMEOUT), pk=self.pk,
+        ).update(solve_queued_at=now)
+        return bool(claimed)
+
+class TournamentStartJob(models.Model):
+    """
+    Background start of a tournament: generating its pairings, creating the
+    matches and dispatching them, with progress the API can poll.
+    """
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, related_name='start_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    options = models.JSONField(default=dict)  # Round robin options: use_rounds, double_round_robin
+    matches_created = models.PositiveIntegerField(default=0)
+    matches_dispatched = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Start of {self.tournament.name}: {self.get_status_display()}"
+
+class SprtTest(models.Model):
+    """
+    Sequential probability ratio test of a head-to-head ('sprt') tournament:
+    is the candidate at least elo1 stronger than the baseline rather than
+    at most elo0? See users/sprt.py.
+    """
+    RESULT_CHOICES = (
+        ('running', 'Running'),
+        ('h1', 'Candidate stronger (H1 accepted)'),
+        ('h0', 'Candidate not stronger (H0 accepted)'),
+        ('inconclusive', 'Inconclusive after the maximum number of pairs'),
+    )
+    
+    tournament = models.OneToOneField(Tournament, on_delete=models.CASCADE, related_name='sprt')
+    candidate = models.ForeignKey(ChessBot, on_delete=models.CASCADE, related_name='+')
+    baseline = models.ForeignKey(ChessBot, on_delete=models.CASCADE, related_name='+')
+    elo0 = models.FloatField(default=0.0)
+    elo1 = models.FloatField(default=10.0)
+    alpha = models.FloatField(default=0.05)
+    beta = models.FloatField(default=0.05)
+    batch_pairs = models.PositiveIntegerField(default=8)  # Pairs of games scheduled at a time
+    max_pairs = models.PositiveIntegerField(default=500)
+    pairs_scheduled = models.PositiveIntegerField(default=0)
+    pentanomial = models.JSONField(default=list)  # Pairs scoring 0, 0.5, 1, 1.5 and 2 for the candidate
+    llr = models.FloatField(default=0.0)
+    result = models.CharField(max_length=15, choices=RESULT_CHOICES, default='running')
+    
+    def __str__(self):
+        return f"{self.candidate.name} vs {self.baseline.name}: {self.get_result_display()}"
+    
+    def evaluate(self):
+        """
+        Update the pentanomial counts and LLR from the completed pairs and
+        stop the test once a hypothesis is accepted or max_pairs pairs are
+        played. Pending matches of a stopped test are cancelled. Returns the
+        test result.
+        """
+        from django.db import transaction
+        from django.db.models import F
+        from . import sprt
+        from .tasks import check_tournament_completion
+        
+        with transaction.atomic():
+            # Lock the tournament before its matches, in the same order as the scheduler, and
+            # the test so concurrent evaluations count each pair once
+            Tournament.objects.select_for_update().filter(pk=self.tournament_id).first()
+            test = SprtTest.objects.select_for_update().get(pk=self.pk)
+            if test.result != 'running':
+                return test.result
             
-            # Update scores based on match result
-            if self.result == 'white_win':
-                white_participant.score += 1.0
-                white_participant.save()
-                return True
-            elif self.result == 'black_win':
-                black_participant.score += 1.0
-                black_participant.save()
-                return True
-            elif self.result == 'draw':
-                white_participant.score += 0.5
-                black_participant.score += 0.5
-                white_participant.save()
-                black_participant.save()
-                return True
-                
-            return False  # Unrecognized result
+            matches = Match.objects.filter(tournament_id=test.tournament_id, status='completed')\
+                .only('round', 'white_bot_id', 'result')
+            test.pentanomial = sprt.pentanomial(matches, test.candidate_id)
+            test.llr = sprt.llr(test.pentanomial, test.elo0, test.elo1)
+            decision = sprt.decide(test.llr, test.alpha, test.beta, sum(test.pentanomial))
+            if decision is None and sum(test.pentanomial) >= test.max_pairs:
+                decision = 'inconclusive'
             
-        except TournamentParticipant.DoesNotExist:
-            return False  # Participant not found
-        except Exception as e:
-            import logging
-            logging.error(f"Error updating scores: {str(e)}")
-            return False
+            if decision:
+                test.result = decision
+                pending = Match.objects.filter(tournament_id=test.tournament_id, status__in=['pending', 'queued'])
+                cancelled = pending.delete()[1].get(Match._meta.label, 0)
+                if cancelled:
+                    Tournament.objects.filter(pk=test.tournament_id).update(
+                        total_matches=F('total_matches') - cancelled)
+                    # No match left to bring the counter up to the new total
+                    completed, total = Tournament.objects.filter(pk=test.tournament_id)\
+                        .values_list('completed_matches', 'total_matches').get()
+                    if completed >= total:
+                        tournament_id = str(test.tournament_id)
+                        transaction.on_commit(lambda: check_tournament_completion.delay(tournament_id))
+            
+            test.save(update_fields=['pentanomial', 'llr', 'result'])
+        
+        self.pentanomial, self.llr, self.result = test.pentanomial, test.llr, test.result
+        return test.result
 
 class ClassGroup(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -0,0 +1,230 @@
+"""
+Elo and Glicko-2 ratings of bots.
+
+Ratings are kept per bot version in BotRating and updated as each match is
+finalized, treating every game as its own Glicko-2 rating period. The whole
+history can be recomputed with recompute_ratings(), which replays the games
+in the same order but vectorized with NumPy: games are split into waves in
+which no bot plays twice, and every wave is rated in one array operation.
+Incremental updates and the recompute share the same functions, so they
+produce the same ratings.
+"""
+import math
+import numpy as np
+
+INITIAL_RATING = 1500.0
+ELO_K = 32.0
+
+INITIAL_RD = 350.0
+INITIAL_VOLATILITY = 0.06
+# System constant constraining volatility changes, 0.3 to 1.2 per Glickman
+GLICKO_TAU = 0.5
+GLICKO_SCALE = 400 / math.log(10)
+CONVERGENCE_EPSILON = 1e-6
+
+# Score of the white bot by result
+WHITE_SCORES = {
+    'white_win': 1.0,
+    'black_win': 0.0,
+    'draw': 0.5,
+}
+
+
+def elo_update(rating, opponent, score, k=ELO_K):
+    """New Elo rating after scoring score (0, 0.5 or 1) against opponent"""
+    expected = 1 / (1 + 10 ** ((opponent - rating) / 400))
+    return rating + k * (score - expected)
+
+
+def glicko2_update(rating, rd, volatility, opp_rating, opp_rd, score, tau=GLICKO_TAU):
+    """
+    New (rating, rd, volatility) after a single game against an opponent,
+    following Glickman's Glicko-2 algorithm. All arguments may be arrays.
+    """
+    rating, rd, volatility, opp_rating, opp_rd, score = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (rating, rd, volatility, opp_rating, opp_rd, score))
+    )
+    mu = (rating - INITIAL_RATING) / GLICKO_SCALE
+    phi = rd / GLICKO_SCALE
+    opp_mu = (opp_rating - INITIAL_RATING) / GLICKO_SCALE
+    opp_phi = opp_rd / GLICKO_SCALE
+
+    g = 1 / np.sqrt(1 + 3 * opp_phi ** 2 / math.pi ** 2)
+    expected = 1 / (1 + np.exp(-g * (mu - opp_mu)))
+    v = 1 / (g ** 2 * expected * (1 - expected))
+    delta = v * g * (score - expected)
+
+    # New volatility, solving for x = ln(sigma'^2) with the Illinois algorithm
+    a = np.log(volatility ** 2)
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau ** 2
+
+    big = delta ** 2 > phi ** 2 + v
+    A = a.copy()
+    B = np.where(big, np.log(np.where(big, delta ** 2 - phi ** 2 - v, 1)), a - tau)
+    low = ~big & (f(B) < 0)
+    while low.any():
+        B = np.where(low, B - tau, B)
+        low = low & (f(B) < 0)
+
+    fA, fB = f(A), f(B)
+    active = np.abs(B - A) > CONVERGENCE_EPSILON
+    while active.any():
+        C = np.where(active, A + (A - B) * fA / np.where(active, fB - fA, 1), A)
+        fC = f(C)
+        swap = active & (fC * fB <= 0)
+        A = np.where(swap, B, A)
+        fA = np.where(swap, fB, np.where(active, fA / 2, fA))
+        B = np.where(active, C, B)
+        fB = np.where(active, fC, fB)
+        active = active & (np.abs(B - A) > CONVERGENCE_EPSILON)
+    new_volatility = np.exp(A / 2)
+
+    phi_star = np.sqrt(phi ** 2 + new_volatility ** 2)
+    new_phi = 1 / np.sqrt(1 / phi_star ** 2 + 1 / v)
+    new_mu = mu + new_phi ** 2 * g * (score - expected)
+    return new_mu * GLICKO_SCALE + INITIAL_RATING, new_phi * GLICKO_SCALE, new_volatility
+
+
+def rate_game(white, black, white_score):
+    """
+    Rate a single game. white and black are (elo, rating, rd, volatility)
+    tuples; returns the updated tuples.
+    """
+    new_white = (
+        elo_update(white[0], black[0], white_score),
+        *(float(x) for x in glicko2_update(*white[1:], black[1], black[2], white_score)),
+    )
+    new_black = (
+        elo_update(black[0], white[0], 1 - white_score),
+        *(float(x) for x in glicko2_update(*black[1:], white[1], white[2], 1 - white_score)),
+    )
+    return new_white, new_black
+
+
+def record_match(match):
+    """
+    Update the ratings of both bot versions of a finalized match and log
+    them to the rating history. Meant to run in the transaction that
+    finalizes the match.
+    """
+    from .models import BotRating, RatingHistory
+
+    white_score = WHITE_SCORES.get(match.result)
+    if white_score is None or match.white_bot_id == match.black_bot_id:
+        return
+
+    keys = [
+        (match.white_bot_id, match.white_version or match.white_bot.version),
+        (match.black_bot_id, match.black_version or match.black_bot.version),
+    ]
+    # Lock both rows in a fixed order so concurrent finalizations can't deadlock
+    ratings = {}
+    for bot_id, version in sorted(keys, key=lambda key: (str(key[0]), key[1])):
+        BotRating.objects.get_or_create(bot_id=bot_id, version=version)
+        ratings[bot_id] = BotRating.objects.select_for_update().get(bot_id=bot_id, version=version)
+    white, black = ratings[match.white_bot_id], ratings[match.black_bot_id]
+
+    new_white, new_black = rate_game(white.values(), black.values(), white_score)
+    history = []
+    for rating, values in ((white, new_white), (black, new_black)):
+        rating.elo, rating.glicko_rating, rating.glicko_rd, rating.glicko_volatility = values
+        rating.games += 1
+        rating.save(update_fields=['elo', 'glicko_rating', 'glicko_rd', 'glicko_volatility', 'games', 'updated_at'])
+        history.append(RatingHistory(
+            bot_id=rating.bot_id, version=rating.version, match=match,
+            elo=rating.elo, glicko_rating=rating.glicko_rating, glicko_rd=rating.glicko_rd,
+        ))
+    RatingHistory.objects.bulk_create(history)
+
+
+def _waves(white, black, players):
+    """
+    Wave number of every game: the first wave in which neither bot has a
+    game left to play, so each bot's games keep their order.
+    """
+    next_wave = np.zeros(players, dtype=np.int64)
+    waves = np.empty(len(white), dtype=np.int64)
+    for i, (w, b) in enumerate(zip(white.tolist(), black.tolist())):
+        wave = max(next_wave[w], next_wave[b])
+        waves[i] = wave
+        next_wave[w] = next_wave[b] = wave + 1
+    return waves
+
+
+def recompute_ratings():
+    """
+    Rebuild every BotRating and the rating history from the completed
+    matches, in the order they were completed. Returns the number of games rated.
+    """
+    from django.db import transaction
+    from django.db.models import F
+    from .models import Match, BotRating, RatingHistory
+
+    games = list(
+        Match.objects.filter(status='completed', result__in=list(WHITE_SCORES))
+        .exclude(white_bot=F('black_bot'))
+        .order_by('completed_at', 'created_at')
+        .values_list('id', 'white_bot_id', 'white_version', 'white_bot__version',
+                     'black_bot_id', 'black_version', 'black_bot__version', 'result')
+    )
+
+    players = {}
+    white = np.empty(len(games), dtype=np.int64)
+    black = np.empty(len(games), dtype=np.int64)
+    score = np.empty(len(games))
+    for i, (_, white_bot, white_version, white_current, black_bot, black_version, black_current, result) in enumerate(games):
+        white[i] = players.setdefault((white_bot, white_version or white_current), len(players))
+        black[i] = players.setdefault((black_bot, black_version or black_current), len(players))
+        score[i] = WHITE_SCORES[result]
+
+    n = len(players)
+    elo = np.full(n, INITIAL_RATING)
+    rating = np.full(n, INITIAL_RATING)
+    rd = np.full(n, INITIAL_RD)
+    volatility = np.full(n, INITIAL_VOLATILITY)
+    played = np.zeros(n, dtype=np.int64)
+
+    # Ratings of both sides after every game, for the history
+    after = np.empty((len(games), 2, 3))
+
+    if games:
+        waves = _waves(white, black, n)
+        order = np.argsort(waves, kind='stable')
+        bounds = np.flatnonzero(np.diff(waves[order])) + 1
+        for wave in np.split(order, bounds):
+            w, b, s = white[wave], black[wave], score[wave]
+            new_elo_w = elo_update(elo[w], elo[b], s)
+            new_elo_b = elo_update(elo[b], elo[w], 1 - s)
+            new_w = glicko2_update(rating[w], rd[w], volatility[w], rating[b], rd[b], s)
+            new_b = glicko2_update(rating[b], rd[b], volatility[b], rating[w], rd[w], 1 - s)
+            elo[w], elo[b] = new_elo_w, new_elo_b
+            (rating[w], rd[w], volatility[w]), (rating[b], rd[b], volatility[b]) = new_w, new_b
+            played[w] += 1
+            played[b] += 1
+            after[wave, 0] = np.column_stack((elo[w], rating[w], rd[w]))
+            after[wave, 1] = np.column_stack((elo[b], rating[b], rd[b]))
+
+    keys = list(players)
+    ratings = [
+        BotRating(bot_id=bot_id, version=version, elo=elo[i], glicko_rating=rating[i],
+                  glicko_rd=rd[i], glicko_volatility=volatility[i], games=played[i])
+        for i, (bot_id, version) in enumerate(keys)
+    ]
+    history = []
+    for i, game in enumerate(games):
+        for side, player in ((0, white[i]), (1, black[i])):
+            bot_id, version = keys[player]
+            history.append(RatingHistory(
+                bot_id=bot_id, version=version, match_id=game[0],
+                elo=after[i, side, 0], glicko_rating=after[i, side, 1], glicko_rd=after[i, side, 2],
+            ))
+
+    with transaction.atomic():
+        RatingHistory.objects.all().delete()
+        BotRating.objects.all().delete()
+        BotRating.objects.bulk_create(ratings, batch_size=1000)
+        RatingHistory.objects.bulk_create(history, batch_size=1000)
+    return len(games)
@@ -0,0 +1,96 @@
+"""
+Streaming writers for match artifacts.
+
+PGN movetext is appended to the match's final storage location while the
+game is played, so a partially played game can be recovered from disk if
+the worker dies. The Result tag is written as "*" and filled in when the game
+ends, by rewriting the file from that tag onwards.
+"""
+import os
+
+RESULT_TOKENS = {
+    'white_win': '1-0',
+    'black_win': '0-1',
+    'draw': '1/2-1/2',
+}
+
+# Movetext lines are wrapped like python-chess' exporter does
+LINE_LENGTH = 80
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def open_artifact(path, mode='wb'):
+    """Open a match artifact for writing, creating its directory if needed"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, mode)
+
+
+class PgnStreamWriter:
+    """Writes a single game as PGN, one move at a time"""
+
+    def __init__(self, path, headers):
+        """
+        headers is a list of (tag, value) pairs in output order and must
+        include the Result tag, which is written as "*" until finish().
+        """
+        self.file = open_artifact(path, 'w+b')
+        self.result_offset = None
+        self.column = 0
+        self.finished = False
+
+        for tag, value in headers:
+            if tag == 'Result':
+                self.result_offset = self.file.tell()
+                self._write('[Result "*"]\n')
+            else:
+                self._write(f'[{tag} "{_escape(value)}"]\n')
+        self._write('\n')
+        self.file.flush()
+
+    def _write(self, text):
+        self.file.write(text.encode('utf-8'))
+
+    def _write_token(self, token):
+        if self.column and self.column + 1 + len(token) > LINE_LENGTH:
+            self._write('\n')
+            self.column = 0
+        elif self.column:
+            self._write(' ')
+            self.column += 1
+        self._write(token)
+        self.column += len(token)
+
+    def add_move(self, board, move):
+        """Append a move, given the board before the move is played"""
+        san = board.san(move)
+        if board.turn:
+            self._write_token(f"{board.fullmove_number}. {san}")
+        else:
+            self._write_token(san)
+        self.file.flush()
+
+    def finish(self, result):
+        """Terminate the movetext and fill in the Result tag"""
+        if self.finished:
+            return
+        token = RESULT_TOKENS.get(result, '*')
+        self._write_token(token)
+        self._write('\n\n')
+        if self.result_offset is not None:
+            # Only the tags after Result and the movetext follow it, so this stays small
+            self.file.seek(self.result_offset)
+            self.file.readline()
+            rest = self.file.read()
+            self.file.seek(self.result_offset)
+            self._write(f'[Result "{token}"]\n')
+            self.file.write(rest)
+            self.file.truncate()
+        self.finished = True
+        self.close()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
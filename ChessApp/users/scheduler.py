@@ -0,0 +1,218 @@
+"""
+Feeding a tournament's matches to the workers at a steady rate.
+
+Rather than queueing every match at once, which lets one bot play dozens
+of games at the same time, matches are released a batch at a time and
+more are released as batches finish. A run_match_batch task plays its
+games one after another, so a batch takes up one slot of every bot that
+plays in it however many of its games that bot plays:
+
+- at most SCHEDULER_MAX_IN_FLIGHT matches of a tournament are queued or
+  running at any time, keeping the workers busy without flooding them;
+- a bot is in at most SCHEDULER_BOT_CONCURRENCY of those batches, except
+  for bots in every game (a gauntlet's challenger, both bots of an SPRT),
+  which would otherwise hold the whole tournament to that many batches;
+- the matches of the bots with the most games left go first, since the
+  tournament can't finish before its busiest bot has played all of its
+  games, then earlier rounds before later ones;
+- a batch is filled with games between the bots already in it before
+  bringing in new bots, so full batches take as few slots as possible.
+
+Each release only reads the matches in flight and the earliest
+SCHEDULER_CANDIDATES pending matches of the bots with a free slot, so
+feeding a large tournament doesn't rescan all of its matches.
+"""
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+# Pending matches considered per release, earliest rounds first
+SCHEDULER_CANDIDATES = 1000
+
+
+def _priority(remaining):
+    """Sort key of a pending (id, white, black, round) match: critical path first, then round order"""
+    def key(match):
+        _, white, black, round_num = match
+        return (-max(remaining[white], remaining[black]), -(remaining[white] + remaining[black]), round_num or 0)
+    return key
+
+
+def _busy(in_flight):
+    """Number of in-flight (batch, white, black) batches each bot plays in"""
+    batch_bots = {}
+    for batch, white, black in in_flight:
+        batch_bots.setdefault(batch, set()).update((white, black))
+    return Counter(bot for bots in batch_bots.values() for bot in bots)
+
+
+def select_matches(pending, in_flight, bot_concurrency, budget, batch_size=1, unlimited=()):
+    """
+    Batch up to budget of the pending (id, white, black, round) matches for
+    release, given the (batch, white, black) matches already in flight,
+    without putting any bot but the unlimited ones in more than
+    bot_concurrency batches. Returns lists of match ids, one per batch of
+    at most batch_size games.
+    """
+    busy = _busy(in_flight)
+    remaining = Counter()
+    for _, white, black, *_ in (*in_flight, *pending):
+        remaining[white] += 1
+        remaining[black] += 1
+
+    def free(bot, limit):
+        return bot in unlimited or busy[bot] < limit
+
+    candidates = sorted(pending, key=_priority(remaining))
+    taken = set()
+
+    def next_game(bots, limit):
+        """The most urgent game that brings the fewest bots without a free slot into a batch of bots"""
+        best = None
+        for match in candidates:
+            if match[0] in taken:
+                continue
+            new = {match[1], match[2]} - bots
+            if not all(free(bot, limit) for bot in new):
+                continue
+            if not new:
+                return match
+            if best is None or len(new) < len(best[1]):
+                best = match, new
+        return best and best[0]
+
+    # Give every bot one batch first, then a second and so on, so games spread over as many bots as possible
+    batches = []
+    for limit in range(1, bot_concurrency + 1):
+        while budget > 0:
+            batch, bots = [], set()
+            while len(batch) < min(batch_size, budget):
+                match = next_game(bots, limit)
+                if match is None:
+                    break
+                busy.update({match[1], match[2]} - bots)
+                bots.update(match[1:3])
+                batch.append(match[0])
+                taken.add(match[0])
+            if not batch:
+                break
+            batches.append(batch)
+            budget -= len(batch)
+    return batches
+
+
+def _unlimited_bots(tournament):
+    """Bots that play every game of the tournament, which the per-bot limit doesn't apply to"""
+    if tournament.format == 'gauntlet':
+        return {tournament.challenger_id}
+    if tournament.format == 'sprt':
+        from .models import SprtTest
+        bots = SprtTest.objects.filter(tournament=tournament).values_list('candidate_id', 'baseline_id').first()
+        return set(bots or ())
+    return set()
+
+
+def _dispatch(batches, progress=None):
+    """
+    Dispatch released batches as dispatch_batches does, putting the matches
+    of any batch that wasn't published back to pending before re-raising,
+    so a later release can pick them up again.
+    """
+    from .models import Match
+    from .tasks import dispatch_batches
+
+    published = 0
+
+    def track(dispatched):
+        nonlocal published
+        published = dispatched
+        if progress:
+            progress(dispatched)
+
+    try:
+        dispatch_batches(batches, track)
+    except Exception:
+        # Left queued, they would count as in flight forever and stall the tournament
+        unpublished, count = [], 0
+        for batch in batches:
+            if count >= published:
+                unpublished += batch
+            count += len(batch)
+        Match.objects.filter(id__in=unpublished, status='queued').update(status='pending', batch=None)
+        raise
+
+
+def release_match(match_id):
+    """
+    Queue a single pending or failed match to be played on its own, outside
+    the tournament's limits. It is marked queued with a batch of its own like
+    the matches of a release, so no release hands it to another worker as
+    well. Returns False if the match was in neither state.
+    """
+    from .models import Match
+    from .tasks import run_chess_match
+
+    def dispatch():
+        try:
+            run_chess_match.delay(str(match_id))
+        except Exception:
+            Match.objects.filter(pk=match_id, status='queued').update(status='pending', batch=None)
+            raise
+
+    with transaction.atomic():
+        claimed = Match.objects.filter(pk=match_id, status__in=['pending', 'error'])\
+            .update(status='queued', batch=uuid.uuid4())
+        if claimed:
+            transaction.on_commit(dispatch)
+    return bool(claimed)
+
+
+def release_matches(tournament_id, progress=None):
+    """
+    Queue as many of a tournament's pending matches as its limits allow and
+    dispatch them once the transaction commits, reporting to progress as
+    dispatch_batches does. Matches that fail to dispatch go back to pending.
+    Returns the number released.
+    """
+    from .models import Match, Tournament
+    from .tasks import batch_size_for
+
+    with transaction.atomic():
+        # One release at a time per tournament, so limits aren't exceeded by concurrent calls
+        tournament = Tournament.objects.select_for_update().get(pk=tournament_id)
+        if tournament.status != 'in_progress':
+            return 0
+
+        matches = Match.objects.filter(tournament=tournament)
+        # Matches dispatched one by one, without a batch, count as a batch each
+        in_flight = [
+            (batch or match_id, white, black)
+            for batch, match_id, white, black in matches.filter(status__in=['queued', 'in_progress'])
+            .values_list('batch', 'id', 'white_bot_id', 'black_bot_id')
+        ]
+        budget = settings.SCHEDULER_MAX_IN_FLIGHT - len(in_flight)
+        if budget <= 0:
+            return 0
+
+        # Only the bots with a slot left can be given more games
+        unlimited = _unlimited_bots(tournament)
+        full = [bot for bot, count in _busy(in_flight).items()
+                if count >= settings.SCHEDULER_BOT_CONCURRENCY and bot not in unlimited]
+        pending = list(
+            matches.filter(status='pending').exclude(white_bot_id__in=full).exclude(black_bot_id__in=full)
+            .order_by('round', 'created_at').values_list('id', 'white_bot_id', 'black_bot_id', 'round')
+            [:SCHEDULER_CANDIDATES]
+        )
+
+        batches = select_matches(pending, in_flight, settings.SCHEDULER_BOT_CONCURRENCY, budget,
+                                 batch_size_for(tournament), unlimited)
+        if not batches:
+            return 0
+        for batch in batches:
+            Match.objects.filter(id__in=batch, status='pending').update(status='queued', batch=uuid.uuid4())
+
+        batches = [[str(match_id) for match_id in batch] for batch in batches]
+        transaction.on_commit(lambda: _dispatch(batches, progress))
+    return sum(len(batch) for batch in batches)
@@ -112,9 +112,13 @@ class TournamentSerializer(serializers.ModelSerializer):
         model = Tournament
         fields = [
             'id', 'name', 'description', 'created_at', 'scheduled_at',
-            'completed_at', 'status', 'created_by', 'created_by_email'
+            'completed_at', 'status', 'created_by', 'created_by_email',
+            'time_control', 'move_time_ms', 'base_time_ms', 'increment_ms', 'node_limit',
+            'format', 'rounds', 'games_per_pairing', 'challenger', 'log_level',
+            'total_matches', 'completed_matches'
         ]
-        read_only_fields = ['id', 'created_at', 'created_by', 'created_by_email']
+        read_only_fields = ['id', 'created_at', 'created_by', 'created_by_email',
+                            'total_matches', 'completed_matches']
     
     def get_created_by_email(self, obj):
         return obj.created_by.email if obj.created_by else None
@@ -128,8 +132,11 @@ class TournamentDetailSerializer(serializers.ModelSerializer):
         model = Tournament
         fields = ['id', 'name', 'description', 'created_by', 'created_by_email',
                  'created_at', 'scheduled_at', 'completed_at', 'status',
-                 'participants', 'matches']
-        read_only_fields = ['id', 'created_at', 'completed_at', 'created_by_email']
+                 'time_control', 'move_time_ms', 'base_time_ms', 'increment_ms', 'node_limit',
+                 'format', 'rounds', 'games_per_pairing', 'challenger', 'log_level',
+                 'total_matches', 'completed_matches', 'participants', 'matches']
+        read_only_fields = ['id', 'created_at', 'completed_at', 'created_by_email',
+                            'total_matches', 'completed_matches']
     
     def get_created_by_email(self, obj):
         return obj.created_by.email
@@ -157,6 +164,8 @@ class TournamentDetailSerializer(serializers.ModelSerializer):
 class MatchSerializer(serializers.ModelSerializer):
     white_bot_name = serializers.SerializerMethodField()
     black_bot_name = serializers.SerializerMethodField()
+    has_pgn = serializers.SerializerMethodField()
+    has_log = serializers.SerializerMethodField()
     
     class Meta:
         model = Match
@@ -164,7 +173,8 @@ class MatchSerializer(serializers.ModelSerializer):
             'id', 'tournament', 'white_bot', 'white_bot_name',
             'black_bot', 'black_bot_name', 'status', 'result',
             'created_at', 'started_at', 'completed_at', 
-            'pgn_file', 'log_file', 'round'  # Added round field
+            'pgn_file', 'log_file', 'round',  # Added round field
+            'has_pgn', 'has_log'
         ]
         read_only_fields = ['id', 'created_at', 'white_bot_name', 'black_bot_name']
     
@@ -172,4 +182,10 @@ class MatchSerializer(serializers.ModelSerializer):
         return obj.white_bot.name
     
     def get_black_bot_name(self, obj):
-        return obj.black_bot.name
\ No newline at end of file
+        return obj.black_bot.name
+    
+    def get_has_pgn(self, obj):
+        return obj.has_artifact('pgn')
+    
+    def get_has_log(self, obj):
+        return obj.has_artifact('log')
\ No newline at end of file
@@ -1,6 +1,7 @@
 import itertools
-from typing import Dict, List, Tuple
-from .models import Tournament, ChessBot
+import math
+from typing import Dict, List, Optional, Set, Tuple
+from .models import Tournament, ChessBot, Match
 
 def generate_round_robin_matches(tournament: Tournament) -> List[Tuple[ChessBot, ChessBot]]:
     """
@@ -55,4 +56,271 @@ def generate_round_robin_matches_with_rounds(tournament: Tournament) -> Dict[int
         # Keep first player fixed, rotate others
         participants = [participants[0]] + [participants[-1]] + participants[1:-1]
     
-    return rounds
\ No newline at end of file
+    return rounds
+
+def round_robin_pairings(tournament: Tournament, use_rounds: bool = False,
+                         double_round_robin: bool = False) -> List[Tuple[ChessBot, ChessBot, Optional[int]]]:
+    """
+    (white_bot, black_bot, round) pairings of a round robin, organized by
+    rounds if use_rounds. A double round robin adds the reverse of each
+    pairing (black/white switched) right after it, in the same round.
+    """
+    if use_rounds:
+        rounds = generate_round_robin_matches_with_rounds(tournament)
+        pairings = [(white_bot, black_bot, round_num)
+                    for round_num, round_pairings in rounds.items()
+                    for white_bot, black_bot in round_pairings]
+    else:
+        pairings = [(white_bot, black_bot, None)
+                    for white_bot, black_bot in generate_round_robin_matches(tournament)]
+    
+    if double_round_robin:
+        pairings = [pairing for white_bot, black_bot, round_num in pairings
+                    for pairing in ((white_bot, black_bot, round_num), (black_bot, white_bot, round_num))]
+    return pairings
+
+# Rows per INSERT when creating matches
+MATCH_CREATE_CHUNK = 500
+
+def create_matches(tournament: Tournament, pairings: List[Tuple[ChessBot, ChessBot, int]]) -> List[str]:
+    """
+    Create the matches of (white_bot, black_bot, round) pairings in bulk and
+    add them to the tournament's total. Returns the new match ids.
+    """
+    matches = Match.objects.bulk_create([
+        Match(tournament=tournament, white_bot=white_bot, black_bot=black_bot, round=round_num)
+        for white_bot, black_bot, round_num in pairings
+    ], batch_size=MATCH_CREATE_CHUNK)
+    tournament.add_matches(len(matches))
+    return [str(match.id) for match in matches]
+
+def schedule_sprt_pairs(tournament: Tournament) -> List[str]:
+    """
+    Schedule the next batch of game pairs of an SPRT head-to-head, unless
+    the test has stopped. Both games of a pair share a round number, with
+    the candidate playing white in the first and black in the second.
+    """
+    test = tournament.sprt
+    if test.evaluate() != 'running':
+        return []
+    
+    pairs = min(test.batch_pairs, test.max_pairs - test.pairs_scheduled)
+    pairings = []
+    for round_num in range(test.pairs_scheduled + 1, test.pairs_scheduled + pairs + 1):
+        pairings.append((test.candidate, test.baseline, round_num))
+        pairings.append((test.baseline, test.candidate, round_num))
+    
+    test.pairs_scheduled += pairs
+    test.save(update_fields=['pairs_scheduled'])
+    return create_matches(tournament, pairings)
+
+def swiss_rounds(players: int) -> int:
+    """Default number of Swiss rounds: enough to separate a single winner"""
+    return max(1, math.ceil(math.log2(players))) if players > 1 else 0
+
+def _colour_pairing(a, b, colours: Dict, higher_ranked_white: bool):
+    """
+    Order a pair as (white, black): the bot that has had black more often
+    gets white, then the one that had black last, then the higher ranked
+    bot alternately from round to round.
+    """
+    history_a, history_b = colours.get(a, []), colours.get(b, [])
+    balance_a = history_a.count('w') - history_a.count('b')
+    balance_b = history_b.count('w') - history_b.count('b')
+    if balance_a != balance_b:
+        return (a, b) if balance_a < balance_b else (b, a)
+    last_a = history_a[-1] if history_a else None
+    last_b = history_b[-1] if history_b else None
+    if last_a != last_b and last_a and last_b:
+        return (a, b) if last_a == 'b' else (b, a)
+    return (a, b) if higher_ranked_white else (b, a)
+
+# Bound on the pairing search, which is exponential when few pairings avoid rematches
+SWISS_SEARCH_LIMIT = 100000
+
+def _pair_ranked(ranked: List, scores: Dict, opponents: Dict[object, Set], budget: List[int]) -> Optional[List[Tuple]]:
+    """
+    Pair bots ranked by score without rematches, backtracking when a choice
+    leaves the rest unpairable. Like the Dutch system, the top bot of a
+    score group first meets the bot halfway down the group, so the top
+    half plays the bottom half; bots left over float down to the next group.
+    Returns None if there is no such pairing or the search budget runs out.
+    """
+    if not ranked:
+        return []
+    budget[0] -= 1
+    if budget[0] < 0:
+        return None
+    top, rest = ranked[0], ranked[1:]
+    group = [bot for bot in rest if scores[bot] == scores[top]]
+    half = (len(group) + 1) // 2 - 1 if group else 0
+    # Middle of the group, then the rest of its bottom half, the top half upwards, and lower groups
+    candidates = group[half:] + group[:half][::-1] + rest[len(group):]
+    for opponent in candidates:
+        if opponent in opponents.get(top, set()):
+            continue
+        remainder = _pair_ranked([bot for bot in rest if bot != opponent], scores, opponents, budget)
+        if remainder is not None:
+            return [(top, opponent)] + remainder
+    return None
+
+def pair_swiss_round(ranked: List, scores: Dict, opponents: Dict[object, Set], colours: Dict,
+                     had_bye: Set, round_num: int) -> Tuple[List[Tuple], Optional[object]]:
+    """
+    Pair one Swiss round. ranked lists the bots by seed, scores maps them to
+    their points, opponents to the bots they already played and colours to
+    the colours they had ('w' or 'b') in order. With an odd number of bots
+    the lowest ranked one without a bye sits out. Returns the (white, black)
+    pairings and the bot with the bye, if any.
+    
+    Rematches are avoided when possible; if no pairing without them exists,
+    as in a long Swiss with few bots, rematches are allowed.
+    """
+    ranked = sorted(ranked, key=lambda bot: -scores[bot])  # Stable, so seeds order each score group
+    
+    bye_candidates = [None]
+    if len(ranked) % 2:
+        bye_candidates = [bot for bot in reversed(ranked) if bot not in had_bye] or list(reversed(ranked))
+    
+    for avoid_rematches in (True, False):
+        for bye in bye_candidates:
+            players = [bot for bot in ranked if bot != bye]
+            pairs = _pair_ranked(players, scores, opponents if avoid_rematches else {}, [SWISS_SEARCH_LIMIT])
+            if pairs is not None:
+                return [_colour_pairing(a, b, colours, round_num % 2 == 1) for a, b in pairs], bye
+    return [], None
+
+def schedule_swiss_round(tournament: Tournament) -> List[str]:
+    """
+    Pair and create the next round of a Swiss tournament from the standings
+    after the previous one, or nothing once all its rounds are played. A bye
+    is worth a win.
+    """
+    from django.db.models import F, Max
+    from .models import TournamentParticipant
+    
+    participants = list(
+        TournamentParticipant.objects.filter(tournament=tournament, bot__status='active')
+        .select_related('bot').order_by('added_at', 'id')
+    )
+    rounds = tournament.rounds or swiss_rounds(len(participants))
+    played = Match.objects.filter(tournament=tournament).aggregate(last=Max('round'))['last'] or 0
+    if played >= rounds or len(participants) < 2:
+        return []
+    
+    bots = {participant.bot_id: participant.bot for participant in participants}
+    scores = {participant.bot_id: participant.score for participant in participants}
+    had_bye = {participant.bot_id for participant in participants if participant.byes}
+    opponents, colours = {}, {}
+    for white_id, black_id in Match.objects.filter(tournament=tournament).order_by('round', 'created_at')\
+            .values_list('white_bot_id', 'black_bot_id'):
+        opponents.setdefault(white_id, set()).add(black_id)
+        opponents.setdefault(black_id, set()).add(white_id)
+        colours.setdefault(white_id, []).append('w')
+        colours.setdefault(black_id, []).append('b')
+    
+    round_num = played + 1
+    pairings, bye = pair_swiss_round(list(bots), scores, opponents, colours, had_bye, round_num)
+    if bye is not None:
+        TournamentParticipant.objects.filter(tournament=tournament, bot_id=bye).update(
+            score=F('score') + 1.0, byes=F('byes') + 1)
+    return create_matches(tournament, [(bots[white], bots[black], round_num) for white, black in pairings])
+
+def _alternating_colours(first: ChessBot, second: ChessBot, games: int) -> List[Tuple[ChessBot, ChessBot]]:
+    """games (white, black) pairings of two bots, first taking white in the first game"""
+    return [(first, second) if i % 2 == 0 else (second, first) for i in range(games)]
+
+def schedule_gauntlet(tournament: Tournament) -> List[str]:
+    """
+    Create every game of a gauntlet at once: the challenger plays each other
+    participant games_per_pairing times with alternating colours.
+    """
+    if tournament.matches.exists():
+        return []
+    
+    challenger = tournament.challenger
+    opponents = tournament.participants.filter(status='active').exclude(pk=challenger.pk)
+    return create_matches(tournament, [
+        (white, black, 1)
+        for opponent in opponents
+        for white, black in _alternating_colours(challenger, opponent, tournament.games_per_pairing)
+    ])
+
+# Extra pairs of games played when a knockout pairing is tied, before the better seed goes through
+KNOCKOUT_TIEBREAK_PAIRS = 2
+
+def knockout_bracket(seeds: List) -> List:
+    """
+    First round slots of a single-elimination bracket of bots in seed order,
+    padded with None byes to a power of two. Adjacent slots meet, the top
+    seeds get the byes, and seeds 1 and 2 can only meet in the final.
+    """
+    size = 1
+    while size < len(seeds):
+        size *= 2
+    order = [0]
+    while len(order) < size:
+        order = [seed for position in order for seed in (position, 2 * len(order) - 1 - position)]
+    return [seeds[position] if position < len(seeds) else None for position in order]
+
+def schedule_knockout_round(tournament: Tournament) -> List[str]:
+    """
+    Schedule whatever a single-elimination tournament needs next. The
+    bracket is replayed from the completed games: each pairing plays
+    games_per_pairing games, and tied pairings play up to
+    KNOCKOUT_TIEBREAK_PAIRS extra pairs within the same round. Returns no
+    matches once a single bot is left.
+    """
+    seeds = list(tournament.participants.filter(status='active').order_by('tournamentparticipant__added_at', 'id'))
+    seed_rank = {bot.id: rank for rank, bot in enumerate(seeds)}
+    
+    games = {}
+    for round_num, white_id, black_id, result in Match.objects.filter(tournament=tournament)\
+            .values_list('round', 'white_bot_id', 'black_bot_id', 'result'):
+        white_points, black_points = Match.RESULT_POINTS.get(result, (0.0, 0.0))
+        games.setdefault((round_num, frozenset((white_id, black_id))), []).append(
+            {white_id: white_points, black_id: black_points})
+    
+    slots = knockout_bracket(seeds)
+    round_num = 1
+    while len(slots) > 1:
+        pairings, winners = [], []
+        for first, second in zip(slots[::2], slots[1::2]):
+            if first is None or second is None:
+                winners.append(first or second)
+                continue
+            played = games.get((round_num, frozenset((first.id, second.id))), [])
+            if not played:
+                pairings += _alternating_colours(first, second, tournament.games_per_pairing)
+                continue
+            first_score = sum(game[first.id] for game in played)
+            second_score = sum(game[second.id] for game in played)
+            if first_score == second_score:
+                if len(played) < tournament.games_per_pairing + 2 * KNOCKOUT_TIEBREAK_PAIRS:
+                    pairings += _alternating_colours(first, second, 2)
+                    continue
+                winners.append(min(first, second, key=lambda bot: seed_rank[bot.id]))
+            else:
+                winners.append(first if first_score > second_score else second)
+        
+        if pairings:
+            return create_matches(tournament, [(white, black, round_num) for white, black in pairings])
+        slots = winners
+        round_num += 1
+    return []
+
+def schedule_next_round(tournament: Tournament) -> List[str]:
+    """
+    Schedule the next round of a tournament whose scheduled matches are all
+    completed. Returns the new match ids, or an empty list if the
+    tournament is over. Round robins are scheduled in full at the start.
+    """
+    if tournament.format == 'sprt':
+        return schedule_sprt_pairs(tournament)
+    if tournament.format == 'swiss':
+        return schedule_swiss_round(tournament)
+    if tournament.format == 'gauntlet':
+        return schedule_gauntlet(tournament)
+    if tournament.format == 'knockout':
+        return schedule_knockout_round(tournament)
+    return []
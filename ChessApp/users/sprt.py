@@ -0,0 +1,86 @@
+"""
+Sequential probability ratio test for head-to-head matches.
+
+Games are played in pairs with colours swapped, and each pair's result
+(0, 0.5, 1, 1.5 or 2 points for the candidate) is counted in a pentanomial
+distribution, which accounts for the correlation between the two games of
+a pair. The log-likelihood ratio of H1 (the candidate is elo1 stronger)
+against H0 (elo0 stronger) uses the normal approximation of the GSPRT:
+
+    LLR = N * (s1 - s0) * (2 * mean - s0 - s1) / (2 * variance)
+
+where s0 and s1 are the expected pair scores under H0 and H1 and mean and
+variance are those of the observed pair scores.
+"""
+import math
+
+# Pair scores, as a fraction of the two games, of the five pentanomial cells
+PAIR_SCORES = (0.0, 0.25, 0.5, 0.75, 1.0)
+
+# Added to every cell so the variance never collapses to zero
+REGULARIZATION = 1e-3
+
+# The variance estimate of a handful of pairs is too noisy to stop on
+MIN_PAIRS = 10
+
+# Candidate points by (candidate is white, result)
+CANDIDATE_POINTS = {
+    (True, 'white_win'): 1.0,
+    (True, 'black_win'): 0.0,
+    (False, 'white_win'): 0.0,
+    (False, 'black_win'): 1.0,
+}
+
+
+def expected_score(elo):
+    """Expected score of a side elo points stronger than its opponent"""
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def bounds(alpha, beta):
+    """(lower, upper) LLR bounds, accepting H0 below lower and H1 above upper"""
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def llr(pentanomial, elo0, elo1):
+    """Log-likelihood ratio of H1 against H0 from pentanomial pair counts"""
+    pairs = sum(pentanomial)
+    if pairs == 0:
+        return 0.0
+    counts = [count + REGULARIZATION for count in pentanomial]
+    total = sum(counts)
+    mean = sum(count * score for count, score in zip(counts, PAIR_SCORES)) / total
+    variance = sum(count * (score - mean) ** 2 for count, score in zip(counts, PAIR_SCORES)) / total
+    s0, s1 = expected_score(elo0), expected_score(elo1)
+    return pairs * (s1 - s0) * (2 * mean - s0 - s1) / (2 * variance)
+
+
+def candidate_points(match, candidate_id):
+    """Points of the candidate bot in a completed match"""
+    if match.result == 'draw':
+        return 0.5
+    return CANDIDATE_POINTS.get((match.white_bot_id == candidate_id, match.result), 0.5)
+
+
+def pentanomial(matches, candidate_id):
+    """Pentanomial counts of the complete pairs among matches, paired by round"""
+    pairs = {}
+    for match in matches:
+        pairs.setdefault(match.round, []).append(candidate_points(match, candidate_id))
+    counts = [0] * 5
+    for points in pairs.values():
+        if len(points) == 2:
+            counts[int(sum(points) * 2)] += 1
+    return counts
+
+
+def decide(llr_value, alpha, beta, pairs):
+    """'h0', 'h1' or None while the test should go on"""
+    if pairs < MIN_PAIRS:
+        return None
+    lower, upper = bounds(alpha, beta)
+    if llr_value <= lower:
+        return 'h0'
+    if llr_value >= upper:
+        return 'h1'
+    return None
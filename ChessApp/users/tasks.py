@@ -1,555 +1,435 @@
 import os
-import sys
 import time
 import uuid
 import chess
-import chess.pgn
-import importlib.util
-import signal
-import resource
+import chess.polyglot
 import traceback
 import logging
-import io
-from datetime import datetime
 from django.utils import timezone  # This is the correct import for timezone.now()
-from pathlib import Path
-from celery import shared_task
+from celery import group, shared_task
 from django.conf import settings
-from django.core.files.base import ContentFile
 from .models import Match, Tournament
+from .bot_host import BotHostError, BotHostTimeout, get_pool
+from .match_log import MatchLog
+from .recording import PgnStreamWriter, open_artifact
+from . import archive, ratings
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Define resource limits for subprocesses
-# 1GB memory limit
+# Define resource limits for bot host processes
+# 1GB address space limit
 MEMORY_LIMIT = 1024 * 1024 * 1024
-# 5 seconds per move
-MOVE_TIME_LIMIT = 5
+# 5 seconds per move (fractions of a second are allowed)
+MOVE_TIME_LIMIT = 5.0
 # Maximum 200 moves per game
 MAX_MOVES = 200
 
-class TimeoutException(Exception):
-    """Exception raised when a move takes too long"""
-    pass
-
-def timeout_handler(signum, frame):
-    """Handler for SIGALRM to enforce time limits"""
-    raise TimeoutException("Move timed out")
+class GameClock:
+    """Tracks the time budget of both sides under a tournament's time control"""
+    
+    def __init__(self, tournament=None):
+        self.mode = tournament.time_control if tournament else 'move_time'
+        self.move_time = tournament.move_time_ms / 1000 if tournament else MOVE_TIME_LIMIT
+        self.increment = tournament.increment_ms / 1000 if tournament else 0
+        self.node_limit = tournament.node_limit if tournament else None
+        self.base_time = tournament.base_time_ms / 1000 if tournament else 0
+        self.remaining = {chess.WHITE: self.base_time, chess.BLACK: self.base_time}
+        self.flagged = None
+    
+    def move_limit(self, color):
+        """Return the number of seconds the side to move may think"""
+        if self.mode == 'clock':
+            return max(self.remaining[color], 0.001)
+        return self.move_time
+    
+    def bot_info(self, color):
+        """Return the time budget exposed to the bot, in milliseconds like UCI's go command"""
+        info = {'time_left': int(self.move_limit(color) * 1000)}
+        if self.mode == 'clock':
+            info.update({
+                'wtime': int(self.remaining[chess.WHITE] * 1000),
+                'btime': int(self.remaining[chess.BLACK] * 1000),
+                'winc': int(self.increment * 1000),
+                'binc': int(self.increment * 1000),
+            })
+        else:
+            info['movetime'] = int(self.move_time * 1000)
+        if self.mode == 'nodes' and self.node_limit:
+            info['nodes'] = self.node_limit
+        return info
+    
+    def record(self, color, elapsed):
+        """Charge a move to the clock. Returns False if the side ran out of time"""
+        if self.mode != 'clock':
+            # Per move limits are enforced by the bot host's own timer
+            return True
+        self.remaining[color] -= elapsed
+        if self.remaining[color] < 0:
+            self.flagged = color
+            return False
+        self.remaining[color] += self.increment
+        return True
+    
+    def pgn_header(self):
+        """Return the PGN TimeControl tag value, or None if PGN can't express it"""
+        if self.mode == 'clock':
+            return f"{self.base_time:g}+{self.increment:g}"
+        return None
 
 class ChessBotRunner:
-    """Manages loading and running chess bots in a safe environment"""
+    """Plays one side of a match through a pooled bot host process"""
     
-    def __init__(self, bot_path, name, is_white=True):
+    def __init__(self, bot_path, name, is_white=True, bot_id=None, version=None, log=None):
         self.bot_path = bot_path
         self.name = name
         self.is_white = is_white
-        self.bot_instance = None
-        self.error_log = []
+        self.bot_id = bot_id or bot_path
+        self.version = version
+        self.host = None
+        self.hash = None
+        self.log = log if log is not None else MatchLog()
     
     def load_bot(self):
-        """Load the chess bot module and create an instance"""
+        """Check out a host process for the bot and start a new game on it"""
         try:
-            # Extract the filename without extension to use as the module name
-            module_name = Path(self.bot_path).stem
-            
-            # Import the module from file
-            spec = importlib.util.spec_from_file_location(module_name, self.bot_path)
-            if spec is None:
-                self.error_log.append(f"Failed to load bot: {self.bot_path}")
-                return False
-                
-            module = importlib.util.module_from_spec(spec)
-            sys.modules[module_name] = module
-            spec.loader.exec_module(module)
-            
-            # Find the chess module first
-            global chess
-            if "chess" not in sys.modules:
-                self.error_log.append("Python-chess module not found in imports")
-                for key in sys.modules.keys():
-                    if "chess" in key and not key.startswith("_"):
-                        self.error_log.append(f"Found possible chess module: {key}")
-                
-                # Try to import it directly
-                try:
-                    import chess
-                except ImportError:
-                    self.error_log.append("Failed to import chess module")
-                    return False
-            
-            # Find the bot class in the module
-            bot_class = None
-            for attr_name in dir(module):
-                attr = getattr(module, attr_name)
-                if isinstance(attr, type) and not attr_name.startswith("_") and attr_name not in ["type", "object"]:
-                    # Try to create an instance to check if it's compatible
-                    try:
-                        test_instance = attr()
-                        if hasattr(test_instance, 'board'):
-                            bot_class = attr
-                            break
-                    except Exception:
-                        continue
-            
-            if bot_class is None:
-                self.error_log.append(f"No valid chess bot class found in {self.bot_path}")
-                return False
-                
-            # Create an instance of the bot
-            self.bot_instance = bot_class()
-            
-            # Ensure it has a board attribute
-            if not hasattr(self.bot_instance, 'board'):
-                self.error_log.append(f"Bot {self.name} is missing required board attribute")
-                return False
-                
-            # Force-initialize the board to standard starting position
-            self.bot_instance.board = chess.Board()
-            
-            # Add missing methods if needed
-            if not hasattr(self.bot_instance, 'select_move'):
-                self.error_log.append(f"Bot {self.name} is missing required method: select_move")
-                return False
-            
-            if not hasattr(self.bot_instance, 'make_move'):
-                # Add a default make_move method if it's missing
-                self.bot_instance.make_move = self._default_make_move.__get__(self.bot_instance)
-                self.error_log.append(f"Added default make_move method to {self.name}")
-                
-            # Set debug flag if it exists
-            if hasattr(self.bot_instance, 'debug'):
-                self.bot_instance.debug = True
-                
-            return True
-            
-        except Exception as e:
-            error_msg = f"Error loading bot {self.name}: {str(e)}\n{traceback.format_exc()}"
-            self.error_log.append(error_msg)
+            self.host = get_pool().acquire(self.bot_id, self.version, self.bot_path,
+                                           memory_limit=MEMORY_LIMIT)
+            response = self.host.new_game()
+        except BotHostError as e:
+            self.log.summary("Error loading bot %s: %s", self.name, e)
+            return False
+        finally:
+            self._log_output()
+        
+        if not response.get('ok'):
+            self.log.summary("Error loading bot %s: %s", self.name, response.get('error'))
             return False
+        
+        self.hash = response['hash']
+        return True
+    
+    def _log_output(self):
+        """Add what the bot printed, or the traceback of a crashed host, to the debug log"""
+        if self.host is None:
+            return
+        for line in self.host.take_output().splitlines():
+            self.log.debug("%s output: %s", self.name, line)
     
-    def _default_make_move(self, move_uci):
-        """Default make_move method for bots that don't have one"""
+    def _request(self, command, **params):
+        """Send a command to the bot host, logging host failures"""
         try:
-            move = chess.Move.from_uci(move_uci)
-            if move in self.board.legal_moves:
-                self.board.push(move)
-                return True
+            if command == 'select_move':
+                response = self.host.select_move(**params)
             else:
-                return False
-        except (ValueError, AttributeError) as e:
+                response = self.host.request(command, **params)
+        except BotHostTimeout:
+            self.log.summary("Bot host for %s killed by watchdog", self.name)
+            return {'ok': False, 'timeout': True}
+        except BotHostError as e:
+            self.log.summary("Bot host for %s failed: %s", self.name, e)
+            return None
+        finally:
+            self._log_output()
+        
+        if 'hash' in response:
+            self.hash = response['hash']
+        for line in response.get('log', []):
+            self.log.debug(line)
+        if not response.get('ok') and not response.get('timeout'):
+            self.log.summary("%s: %s", self.name, response.get('error', 'Unknown bot host error'))
+        return response
+    
+    def set_position(self, fen, moves=()):
+        """Replace the bot's board with the given position and move history"""
+        if not self.host:
+            self.log.summary("Cannot set position: Bot %s not loaded", self.name)
             return False
+        
+        response = self._request('set_position', fen=fen, moves=[move.uci() for move in moves])
+        return bool(response and response.get('ok'))
+    
+    def sync(self, board):
+        """Resynchronize the bot's board with the given board, keeping its history"""
+        return self.set_position(board.root().fen(), board.move_stack)
     
-    def make_move(self):
-        """Get the next move from the bot with resource limits"""
-        if not self.bot_instance:
-            self.error_log.append(f"Cannot make move: Bot {self.name} not loaded")
+    def make_move(self, clock=None):
+        """Get the next move from the bot within the time control"""
+        if not self.host:
+            self.log.summary("Cannot make move: Bot %s not loaded", self.name)
             return None
-            
-        try:
-            # Debug the current board state
-            self.error_log.append(f"Board state for {self.name} before move:")
-            self.error_log.append(f"FEN: {self.bot_instance.board.fen()}")
-            self.error_log.append(f"Turn: {'White' if self.bot_instance.board.turn else 'Black'}")
-            self.error_log.append(f"Legal moves: {[m.uci() for m in self.bot_instance.board.legal_moves]}")
-            
-            # Check if turn matches bot color
-            correct_turn = (self.bot_instance.board.turn == chess.WHITE) == self.is_white
-            if not correct_turn:
-                self.error_log.append(f"ERROR: Turn mismatch for {self.name}. Board shows {'white' if self.bot_instance.board.turn else 'black'}'s turn but bot is {'white' if self.is_white else 'black'}")
-            
-            # Set CPU time limit
-            signal.signal(signal.SIGALRM, timeout_handler)
-            signal.alarm(MOVE_TIME_LIMIT)
-            
-            # Get move from the bot
-            move = self.bot_instance.select_move()
-            
-            # Reset alarm
-            signal.alarm(0)
-            
-            # Check if move is valid
-            if move is None:
-                self.error_log.append(f"Bot {self.name} returned None for move")
-                return None
-                
-            # Validate the move 
-            if move not in self.bot_instance.board.legal_moves:
-                self.error_log.append(f"Bot {self.name} returned illegal move: {move}")
-                return None
-                
-            # Log the move
-            self.error_log.append(f"Bot {self.name} selected move: {move.uci()}")
-            return move
-            
-        except TimeoutException:
-            signal.alarm(0)  # Reset alarm
-            self.error_log.append(f"Bot {self.name} timed out when making a move")
+        
+        color = chess.WHITE if self.is_white else chess.BLACK
+        clock = clock or GameClock()
+        
+        # Only ask the host for board dumps when they will be written
+        self.log.debug("Board state for %s before move:", self.name)
+        
+        started = time.monotonic()
+        response = self._request('select_move', time_limit=clock.move_limit(color),
+                                 clock=clock.bot_info(color), debug=self.log.wants_debug)
+        in_time = clock.record(color, time.monotonic() - started)
+        if response is None:
             return None
-            
-        except Exception as e:
-            signal.alarm(0)  # Reset alarm
-            error_msg = f"Error while {self.name} was making a move: {str(e)}\n{traceback.format_exc()}"
-            self.error_log.append(error_msg)
+        
+        if response.get('timeout') or not in_time:
+            self.log.summary("Bot %s timed out when making a move", self.name)
+            return None
+        
+        if not response.get('ok'):
+            self.log.summary("Error while %s was making a move", self.name)
+            return None
+        
+        # Check if move is valid
+        if response.get('move') is None:
+            self.log.summary("Bot %s returned None for move", self.name)
             return None
+        
+        # Legality is checked against the master board by the caller
+        move = chess.Move.from_uci(response['move'])
+        
+        # Log the move
+        self.log.debug("Bot %s selected move: %s", self.name, move)
+        return move
             
     def send_opponent_move(self, move):
         """Send the opponent's move to the bot"""
-        if not self.bot_instance:
-            self.error_log.append(f"Cannot send move: Bot {self.name} not loaded")
-            return False
-            
-        try:
-            # First check if the board is in the correct state
-            self.error_log.append(f"Sending move {move.uci()} to {self.name}")
-            self.error_log.append(f"Current board state: {self.bot_instance.board.fen()}")
-            
-            # THE KEY FIX: Make sure the board is in the correct state to receive this move
-            # If bot is black, and it's white's turn on its internal board, we need to sync
-            if (self.is_white and not self.bot_instance.board.turn) or (not self.is_white and self.bot_instance.board.turn):
-                self.error_log.append(f"Turn mismatch for {self.name}. Attempting to fix...")
-                
-            # Apply opponent's move directly to the board state
-            if move in self.bot_instance.board.legal_moves:
-                # Apply directly to board first (guaranteed to work)
-                try:
-                    self.bot_instance.board.push(move)
-                    self.error_log.append(f"Direct board update successful for {self.name}")
-                    return True
-                except Exception as e:
-                    self.error_log.append(f"Error directly updating board: {str(e)}")
-                    return False
-            else:
-                self.error_log.append(f"Move {move.uci()} not legal on bot's board: {self.bot_instance.board.fen()}")
-                self.error_log.append(f"Legal moves are: {[m.uci() for m in self.bot_instance.board.legal_moves]}")
-                
-                # Desperate measure: reset the bot's board and catch up
-                try:
-                    self.error_log.append("Attempting full board reset and sync...")
-                    # Get the move history from the move's board
-                    if hasattr(move, 'board') and hasattr(move.board, 'move_stack'):
-                        self.bot_instance.board = chess.Board()
-                        for m in move.board.move_stack[:-1]:  # All moves except the last one
-                            if m in self.bot_instance.board.legal_moves:
-                                self.bot_instance.board.push(m)
-                        
-                        # Now add the current move
-                        if move in self.bot_instance.board.legal_moves:
-                            self.bot_instance.board.push(move)
-                            self.error_log.append("Board sync successful")
-                            return True
-                except Exception as e:
-                    self.error_log.append(f"Board reset failed: {str(e)}")
-                
-                # If all else fails, create a new board with the FEN from the move's board
-                try:
-                    if hasattr(move, 'board'):
-                        self.bot_instance.board = chess.Board(move.board.fen())
-                        self.error_log.append("Board reset using FEN")
-                        return True
-                except Exception as e:
-                    self.error_log.append(f"FEN reset failed: {str(e)}")
-                
-                return False
-            
-        except Exception as e:
-            error_msg = f"Error while sending opponent move to {self.name}: {str(e)}\n{traceback.format_exc()}"
-            self.error_log.append(error_msg)
+        if not self.host:
+            self.log.summary("Cannot send move: Bot %s not loaded", self.name)
             return False
+        
+        self.log.debug("Sending move %s to %s", move, self.name)
+        response = self._request('push', move=move.uci())
+        return bool(response and response.get('ok'))
     
-    def get_error_log(self):
-        """Return the error log as a string"""
-        return "\n".join(self.error_log)
+    def close(self):
+        """Return the bot host to the pool"""
+        if self.host:
+            get_pool().release(self.host)
+            self.host = None
 
-@shared_task
-def run_chess_match(match_id):
-    """Run a chess match between two bots"""
-    from .models import Match, Tournament
-    import time
+def _log_final_position(log, board):
+    """Log the position a game ended abnormally in"""
+    log.summary("Final position: %s", board.fen())
+    log.summary("Legal moves: %s", " ".join(move.uci() for move in board.legal_moves))
+
+def _pgn_headers(match, clock):
+    """PGN tag pairs for a match, Seven Tag Roster first"""
+    headers = [
+        ("Event", f"Tournament {match.tournament.name}"),
+        ("Site", "?"),
+        ("Date", timezone.now().strftime("%Y.%m.%d")),
+        ("Round", match.round or "?"),
+        ("White", match.white_bot.name),
+        ("Black", match.black_bot.name),
+        ("Result", "*"),
+    ]
+    if clock.pgn_header():
+        headers.append(("TimeControl", clock.pgn_header()))
+    return headers
+
+def play_match(match):
+    """
+    Play a match between its two bots.
+    
+    The log and PGN are streamed to their final storage location as the game
+    is played, named by Match.artifact_name. Doesn't write to the database, so
+    the caller decides how the outcome is persisted. Returns a
+    (result, pgn_name, log_name) tuple where pgn_name is None if the game
+    never started.
+    """
+    log_name = match.artifact_name('log')
+    pgn_name = None
+    log = MatchLog(match.tournament.log_level, stream=open_artifact(os.path.join(settings.MEDIA_ROOT, log_name)))
+    pgn = None
+    abnormal = True
+    result = "draw"
+    white_runner = black_runner = None
+    master_board = None
     
     try:
-        match = Match.objects.get(id=match_id)
+        log.summary("Chess match started at %s", match.started_at)
+        log.summary("White: %s (v%s)", match.white_bot.name, match.white_bot.version)
+        log.summary("Black: %s (v%s)", match.black_bot.name, match.black_bot.version)
+        log.summary("")
         
-        # Skip if match is already completed
-        if match.status == 'completed':
-            return f"Match {match_id} already completed"
-            
-        # Update match status
-        match.status = 'in_progress'
-        match.started_at = timezone.now()
-        match.save()
+        # Create bot runners
+        white_runner = ChessBotRunner(match.white_bot.file_path.path, match.white_bot.name, is_white=True,
+                                      bot_id=match.white_bot.id, version=match.white_bot.version, log=log)
+        black_runner = ChessBotRunner(match.black_bot.file_path.path, match.black_bot.name, is_white=False,
+                                      bot_id=match.black_bot.id, version=match.black_bot.version, log=log)
         
-        # Run the match (your existing code here)
-        match = None
-        log_buffer = io.StringIO()
+        # When a bot fails to load, its opponent wins
+        if not white_runner.load_bot():
+            log.summary("Failed to load white bot")
+            result = 'black_win'
+            return result, None, log_name
+            
+        if not black_runner.load_bot():
+            log.summary("Failed to load black bot")
+            result = 'white_win'
+            return result, None, log_name
         
-        try:
-            # Get the match from the database
-            match = Match.objects.get(id=match_id)
-            
-            # Update match status
-            match.status = 'in_progress'
-            match.started_at = timezone.now()
-            match.save()
-            
-            # Create log buffer
-            log_buffer.write(f"Chess match started at {match.started_at}\n")
-            log_buffer.write(f"White: {match.white_bot.name} (v{match.white_bot.version})\n")
-            log_buffer.write(f"Black: {match.black_bot.name} (v{match.black_bot.version})\n\n")
-            
-            # Get the file paths for both bots
-            white_bot_path = match.white_bot.file_path.path
-            black_bot_path = match.black_bot.file_path.path
-            
-            # Create bot runners
-            white_runner = ChessBotRunner(white_bot_path, match.white_bot.name, is_white=True)
-            black_runner = ChessBotRunner(black_bot_path, match.black_bot.name, is_white=False)
-            
-            # Load bots
-            white_loaded = white_runner.load_bot()
-            black_loaded = black_runner.load_bot()
-            
-            # When a bot fails to load, properly mark it as completed with an error result
-            if not white_loaded:
-                log_buffer.write(f"Failed to load white bot: {white_runner.get_error_log()}\n")
-                match.status = 'completed'  # Changed from 'error' to 'completed'
-                match.result = 'black_win'  # White bot failed to load, black wins
-                match.completed_at = timezone.now()
-                match.save_log_file(log_buffer.getvalue())
-                match.save()
-                
-                # Update scores since the match is considered completed
-                match.update_scores()
-                
-                # Check tournament completion after this match
-                if match.tournament:
-                    check_tournament_completion.delay(match.tournament.id)
-                return f"Match {match_id} completed with white bot error"
-                
-            if not black_loaded:
-                log_buffer.write(f"Failed to load black bot: {black_runner.get_error_log()}\n")
-                match.status = 'completed'  # Changed from 'error' to 'completed'
-                match.result = 'white_win'  # Black bot failed to load, white wins
-                match.completed_at = timezone.now()
-                match.save_log_file(log_buffer.getvalue())
-                match.save()
-                
-                # Update scores since the match is considered completed
-                match.update_scores()
-                
-                # Check tournament completion after this match
-                if match.tournament:
-                    check_tournament_completion.delay(match.tournament.id)
-                return f"Match {match_id} completed with black bot error"
+        # Create a shared master board for tracking the game state
+        master_board = chess.Board()
+        master_hash = chess.polyglot.zobrist_hash(master_board)
+        
+        # Track both sides' time under the tournament's time control
+        clock = GameClock(match.tournament)
+        
+        # Start recording the game, moves are appended as they are played
+        pgn = PgnStreamWriter(os.path.join(settings.MEDIA_ROOT, match.artifact_name('pgn')),
+                              _pgn_headers(match, clock))
+        pgn_name = match.artifact_name('pgn')
+        
+        move_count = 0
+        
+        # Game loop
+        while move_count < MAX_MOVES and not master_board.is_game_over():
+            move_count += 1
+            current_turn = "White" if master_board.turn == chess.WHITE else "Black"
             
-            # Create a shared master board for tracking the game state
-            master_board = chess.Board()
+            # Get the runner for the current player
+            current_runner = white_runner if master_board.turn == chess.WHITE else black_runner
             
-            # Create new game and pgn for recording
-            game = chess.pgn.Game()
-            game.headers["Event"] = f"Tournament {match.tournament.name}"
-            game.headers["White"] = match.white_bot.name
-            game.headers["Black"] = match.black_bot.name
-            game.headers["Date"] = timezone.now().strftime("%Y.%m.%d")
+            # Make sure the current player's board is correct, resyncing only if the hashes differ
+            if current_runner.hash != master_hash:
+                log.moves("Synchronizing %s's board state...", current_turn)
+                current_runner.sync(master_board)
             
-            # Keep track of move number and current node in the pgn
-            move_count = 0
-            node = game
+            # Make move
+            move = current_runner.make_move(clock)
             
-            # Game loop
-            while not master_board.is_game_over() and move_count < MAX_MOVES:
-                move_count += 1
-                current_turn = "White" if master_board.turn == chess.WHITE else "Black"
-                log_buffer.write(f"Move {move_count} ({current_turn}): ")
-                
-                # Get the runner for the current player
-                current_runner = white_runner if master_board.turn == chess.WHITE else black_runner
-                
-                # Make sure the current player's board is correct
-                if current_runner.bot_instance.board.fen() != master_board.fen():
-                    log_buffer.write(f"\nSynchronizing {current_turn}'s board state...\n")
-                    current_runner.bot_instance.board = chess.Board(master_board.fen())
-                
-                # Make move
-                move = current_runner.make_move()
-                
-                # Handle invalid moves - mark as completed rather than error
-                if move is None:
-                    # Invalid move - opponent wins
-                    result = "black_win" if master_board.turn == chess.WHITE else "white_win"
-                    log_buffer.write(f"Invalid move by {current_turn}. None\n")
-                    match.status = 'completed'
-                    match.result = result
-                    match.completed_at = timezone.now()
-                    match.save_log_file(log_buffer.getvalue() + "\n" + current_runner.get_error_log())
-                    match.save()
-                    
-                    # Update scores since the match is considered completed
-                    match.update_scores()
-                    
-                    # Check tournament completion after this match
-                    if match.tournament:
-                        check_tournament_completion.delay(match.tournament.id)
-                    return f"Match {match_id} completed with invalid move"
-                
-                if move not in master_board.legal_moves:
-                    # Illegal move - opponent wins
-                    result = "black_win" if master_board.turn == chess.WHITE else "white_win"
-                    log_buffer.write(f"Illegal move by {current_turn}: {move.uci()}\n")
-                    match.status = 'completed'
-                    match.result = result
-                    match.completed_at = timezone.now()
-                    match.save_log_file(log_buffer.getvalue() + "\n" + current_runner.get_error_log())
-                    match.save()
-                    
-                    # Update scores since the match is considered completed
-                    match.update_scores()
-                    
-                    # Check tournament completion after this match
-                    if match.tournament:
-                        check_tournament_completion.delay(match.tournament.id)
-                    return f"Match {match_id} completed with illegal move"
-                    
-                # Make the move on the master board
-                master_board.push(move)
-                
-                # Record in PGN
-                node = node.add_variation(move)
-                
-                # Log the move
-                log_buffer.write(f"{move.uci()}\n")
-                
-                # Game over check - don't need to update opponent if game is over
-                if master_board.is_game_over():
-                    break
-                
-                # Synchronize the opponent's board with the master board
-                opponent_runner = black_runner if master_board.turn == chess.WHITE else white_runner
-                opponent_runner.bot_instance.board = chess.Board(master_board.fen())
-            
-            # Game finished - determine result
-            log_buffer.write(f"\nGame finished after {move_count} moves.\n")
-            log_buffer.write(f"Result: {master_board.result()}\n")
-            
-            if master_board.is_checkmate():
-                # The side that was checkmated lost
+            # Invalid or illegal move - opponent wins
+            if move is None or not master_board.is_legal(move):
                 result = "black_win" if master_board.turn == chess.WHITE else "white_win"
-                log_buffer.write(f"{'White' if master_board.turn == chess.BLACK else 'Black'} won by checkmate\n")
-            elif master_board.is_stalemate():
-                result = "draw"
-                log_buffer.write("Game ended in stalemate\n")
-            elif master_board.is_insufficient_material():
-                result = "draw"
-                log_buffer.write("Game ended due to insufficient material\n")
-            elif move_count >= MAX_MOVES:
-                result = "draw"
-                log_buffer.write(f"Game ended after maximum number of moves ({MAX_MOVES})\n")
-            else:
-                # Other draw conditions (50-move rule, threefold repetition)
-                result = "draw"
-                log_buffer.write("Game ended in a draw\n")
-            
-            # Update match with results
-            match.status = 'completed'
-            match.result = result
-            match.completed_at = timezone.now()
-            
-            # Add errors to log if any
-            white_errors = white_runner.get_error_log()
-            black_errors = black_runner.get_error_log()
-            
-            if white_errors:
-                log_buffer.write(f"\nWhite bot errors:\n{white_errors}\n")
-            if black_errors:
-                log_buffer.write(f"\nBlack bot errors:\n{black_errors}\n")
-            
-            # Save PGN
-            pgn_string = str(game)
-            pgn_file = ContentFile(pgn_string.encode('utf-8'))
-            match.save_pgn_file(pgn_string)
-            
-            # Save log
-            match.save_log_file(log_buffer.getvalue())
+                if clock.flagged is not None:
+                    log.summary("%s lost on time", current_turn)
+                if move is None:
+                    log.summary("Move %d (%s): Invalid move by %s. None", move_count, current_turn, current_turn)
+                else:
+                    log.summary("Move %d (%s): Illegal move by %s: %s", move_count, current_turn, current_turn, move)
+                _log_final_position(log, master_board)
+                return result, pgn_name, log_name
             
-            # Save match
-            match.save()
+            # Record in PGN before the move is played, SAN depends on the position
+            pgn.add_move(master_board, move)
             
-            # Check if tournament is complete
-            check_tournament_completion.delay(match.tournament.id)
+            # Make the move on the master board, the bot already played it on its own board
+            master_board.push(move)
+            master_hash = chess.polyglot.zobrist_hash(master_board)
             
-        except Exception as e:
-            error_message = f"Error executing match: {str(e)}\n{traceback.format_exc()}"
-            logger.error(error_message)
+            # Log the move
+            log.moves("Move %d (%s): %s", move_count, current_turn, move)
+            log.flush()
             
-            if match:
-                # Save the error to the match log
-                log_buffer.write(f"Chess match error at {timezone.now()}\n")
-                log_buffer.write(error_message)
-                
-                # Determine which bot was moving when the error occurred
-                try:
-                    if 'master_board' in locals() and master_board is not None:
-                        current_turn = "white" if master_board.turn == chess.WHITE else "black"
-                        
-                        # Assign result based on which bot failed
-                        if current_turn == "white":
-                            result = "black_win"  # White's error means black wins
-                        else:
-                            result = "white_win"  # Black's error means black wins
-                    else:
-                        # Default if we can't determine
-                        result = "draw"
-                except Exception as e:
-                    logger.error(f"Error determining turn: {str(e)}")
-                    result = "draw"  # Default to draw
-                
-                match.status = 'completed'  # Changed from 'error' to 'completed'
-                match.result = result
-                match.completed_at = timezone.now()
-                match.save_log_file(log_buffer.getvalue())
-                match.save()
-                
-                # Update scores since the match is considered completed
-                if hasattr(match, 'update_scores'):
-                    match.update_scores()
-                
-                # Check tournament completion after this match
-                if match.tournament:
-                    check_tournament_completion.delay(match.tournament.id)
+            # Send the move to the opponent, its hash is checked before its next move
+            opponent_runner = white_runner if master_board.turn == chess.WHITE else black_runner
+            opponent_runner.send_opponent_move(move)
         
-        # Update the match and scores using a transaction
-        from django.db import transaction
+        # Game finished - determine result
+        log.summary("")
+        log.summary("Game finished after %d moves.", move_count)
+        log.summary("Result: %s", master_board.result())
         
-        with transaction.atomic():
-            # Set match as completed with final status
-            match = Match.objects.get(id=match_id)
-            match.status = 'completed'
-            match.completed_at = timezone.now()
-            match.save()
-            
-            # Update scores for this match if the method exists
-            if hasattr(match, 'update_scores'):
-                match.update_scores()
-            
-            # Check if tournament is complete and update scores
-            if match.tournament and match.tournament.status == 'in_progress':
-                # Count total and completed matches
-                total_matches = Match.objects.filter(tournament=match.tournament).count()
-                completed_matches = Match.objects.filter(
-                    tournament=match.tournament,
-                    status='completed'
-                ).count()
-                
-                # If all matches are completed, recalculate all scores
-                if total_matches == completed_matches:
-                    if hasattr(match.tournament, 'recalculate_scores'):
-                        match.tournament.recalculate_scores()
-            
-            # Explicitly trigger tournament completion check to update scores
-            if match.tournament:
-                logger.info(f"Triggering tournament completion check for tournament {match.tournament.id}")
-                # Immediately call check_tournament_completion rather than using delay
-                check_tournament_completion(str(match.tournament.id))
+        if master_board.is_checkmate():
+            # The side that was checkmated lost
+            result = "black_win" if master_board.turn == chess.WHITE else "white_win"
+            log.summary("%s won by checkmate", 'White' if master_board.turn == chess.BLACK else 'Black')
+        elif master_board.is_stalemate():
+            result = "draw"
+            log.summary("Game ended in stalemate")
+        elif master_board.is_insufficient_material():
+            result = "draw"
+            log.summary("Game ended due to insufficient material")
+        elif move_count >= MAX_MOVES:
+            result = "draw"
+            log.summary("Game ended after maximum number of moves (%d)", MAX_MOVES)
+        else:
+            # Other draw conditions (50-move rule, threefold repetition)
+            result = "draw"
+            log.summary("Game ended in a draw")
+        
+        abnormal = False
+        return result, pgn_name, log_name
+        
+    except Exception as e:
+        error_message = f"Error executing match: {str(e)}\n{traceback.format_exc()}"
+        logger.error(error_message)
+        log.summary("Chess match error at %s", timezone.now())
+        log.summary(error_message)
+        
+        # The bot that was to move when the error occurred loses
+        if master_board is not None:
+            _log_final_position(log, master_board)
+            result = "black_win" if master_board.turn == chess.WHITE else "white_win"
+        else:
+            result = "draw"
+        return result, pgn_name, log_name
+    
+    finally:
+        # Hand the bot hosts back to the pool for the next game
+        for runner in (white_runner, black_runner):
+            if runner is not None:
+                runner.close()
+        
+        # Fill in the PGN result and close both files
+        if pgn is not None:
+            pgn.finish(result)
+        log.finish(abnormal=abnormal)
+
+# Match fields describing where the PGN and log ended up
+ARTIFACT_FIELDS = ['pgn_file', 'log_file', 'pgn_offset', 'pgn_length', 'log_offset', 'log_length']
+
+# Attempts at writing results when the database fails transiently, e.g. on a deadlock
+DB_ATTEMPTS = 3
+
+def _retry_on_db_error(func, *args):
+    """Call func, retrying with a short backoff when it raises a DatabaseError"""
+    from django.db import DatabaseError
+    
+    for attempt in range(DB_ATTEMPTS):
+        try:
+            return func(*args)
+        except DatabaseError as e:
+            if attempt == DB_ATTEMPTS - 1:
+                raise
+            logger.warning(f"Database error, retrying: {str(e)}")
+            time.sleep(0.1 * 2 ** attempt)
+
+@shared_task
+def run_chess_match(match_id):
+    """Run a chess match between two bots"""
+    from .models import Match, Tournament
+    
+    # Set once the game has been played, so a failure while recording it keeps the real result
+    result = None
+    try:
+        match = Match.objects.select_related('tournament', 'white_bot', 'black_bot').get(id=match_id)
+        
+        # Claim the match, so one released twice is only played once
+        match.status = 'in_progress'
+        match.started_at = timezone.now()
+        claimed = Match.objects.filter(pk=match.pk, status__in=['pending', 'queued', 'error'])\
+            .update(status=match.status, started_at=match.started_at)
+        if not claimed:
+            return f"Match {match_id} already started or completed"
+        
+        match.white_version = match.white_bot.version
+        match.black_version = match.black_bot.version
+        # Point at the streamed files up front so a partial game can be found after a crash
+        match.pgn_file.name = match.artifact_name('pgn')
+        match.log_file.name = match.artifact_name('log')
+        match.save()
+        
+        result, pgn_name, log_name = play_match(match)
+        
+        # Record the result, scores included, in a single transaction
+        match.pgn_file.name = pgn_name
+        match.log_file.name = log_name
+        loose_files = archive.archive_match(match) if archive.archive_enabled() else []
+        match.finalize(result, ARTIFACT_FIELDS)
+        archive.remove_files(loose_files)
         
         return f"Match {match_id} completed successfully"
         
@@ -560,80 +440,323 @@ def run_chess_match(match_id):
         try:
             match = Match.objects.get(id=match_id)
             
-            # Set a default result rather than leaving it as error
-            # If we can determine which bot was to move, that bot loses
-            # Otherwise default to white_win (arbitrary choice)
-            result = "white_win"  # Default
-            
-            try:
-                # Try to determine which bot's turn it was
-                if 'master_board' in locals() and master_board is not None:
-                    result = "white_win" if master_board.turn == chess.BLACK else "black_win"
+            if match.status != 'completed':
+                if result is not None:
+                    # The game was played and only recording it failed, e.g. on a deadlock: keep its
+                    # result and point at the loose files, which are only removed once archived
+                    match.pgn_file.name = pgn_name
+                    match.log_file.name = log_name
+                    _retry_on_db_error(match.finalize, result, ARTIFACT_FIELDS)
                 else:
-                    result = "draw"  # Default to draw if we can't determine
-            except Exception as e:
-                logger.error(f"Error determining result: {str(e)}")
-                result = "draw"  # Default to draw
-            
-            match.status = 'completed'  # Mark as completed with a result
-            match.result = result
-            match.log_file = f"Error: {str(e)}"
-            match.completed_at = timezone.now()
-            match.save()
-            
-            # Update scores
-            if hasattr(match, 'update_scores'):
-                match.update_scores()
-            
-            # Check tournament completion after this match
-            if hasattr(match, 'tournament') and match.tournament:
-                check_tournament_completion.delay(str(match.tournament.id))
+                    # A draw since the game state is unknown here; the error goes after the streamed log
+                    match.append_log(f"Error: {str(e)}\n")
+                    match.finalize('draw', ['log_file'])
                 
-        except:
-            pass
+        except Exception:
+            logger.exception(f"Failed to finalize match {match_id}")
         return f"Error running match {match_id}: {str(e)}"
 
+@shared_task
+def run_match_batch(match_ids):
+    """
+    Run several matches back to back in a single task.
+    
+    Every bot is loaded at most once per worker thanks to the bot host pool,
+    the matches are fetched in one query, and all results are written in one
+    transaction: a single bulk update followed by one score update per
+    participant.
+    """
+    from .models import Match
+    
+    matches = list(
+        Match.objects.select_related('tournament', 'white_bot', 'black_bot')
+        .filter(id__in=match_ids)
+        .exclude(status='completed')
+    )
+    if not matches:
+        return "No matches to run"
+    
+    # Point at the streamed files up front so partial games can be found after a crash
+    started_at = timezone.now()
+    for match in matches:
+        match.status = 'in_progress'
+        match.started_at = started_at
+        match.white_version = match.white_bot.version
+        match.black_version = match.black_bot.version
+        match.pgn_file.name = match.artifact_name('pgn')
+        match.log_file.name = match.artifact_name('log')
+    Match.objects.bulk_update(
+        matches, ['status', 'started_at', 'white_version', 'black_version', 'pgn_file', 'log_file']
+    )
+    
+    loose_files = {}
+    for match in matches:
+        try:
+            result, pgn_name, log_name = play_match(match)
+        except Exception as e:
+            # The game couldn't even be set up, e.g. its log couldn't be created: a draw, like run_chess_match
+            logger.exception(f"Error running match {match.id}")
+            log_name = match.artifact_name('log') if match.append_log(f"Error: {str(e)}\n") else None
+            result, pgn_name = 'draw', None
+        
+        match.status = 'completed'
+        match.result = result
+        match.completed_at = timezone.now()
+        match.pgn_file.name = pgn_name
+        match.log_file.name = log_name
+        if archive.archive_enabled():
+            try:
+                loose_files[match.id] = archive.archive_match(match)
+            except Exception:
+                # Keep the loose files, which the match still points at
+                logger.exception(f"Error archiving match {match.id}")
+                match.pgn_offset = match.pgn_length = match.log_offset = match.log_length = None
+    
+    try:
+        finished = _retry_on_db_error(_record_batch, matches)
+    except Exception:
+        logger.exception("Error recording match batch, finalizing its matches one by one")
+        finished = _finalize_each(matches)
+    
+    archive.remove_files([path for match in finished for path in loose_files.get(match.id, [])])
+    
+    return f"Batch of {len(finished)} matches completed"
+
+def _record_batch(matches):
+    """
+    Write the results of played matches in one transaction, leaving out any
+    finalized elsewhere in the meantime, e.g. by a redelivered task. Returns
+    the matches written.
+    """
+    from django.db import transaction
+    from django.db.models import F
+    from .models import BotStats, Match, TournamentParticipant
+    
+    with transaction.atomic():
+        open_ids = set(
+            Match.objects.select_for_update()
+            .filter(id__in=[match.id for match in matches])
+            .exclude(status='completed')
+            .values_list('id', flat=True)
+        )
+        finished = [match for match in matches if match.id in open_ids]
+        
+        # Collect score changes so each participant is updated once
+        score_deltas = {}
+        for match in finished:
+            points = Match.RESULT_POINTS.get(match.result)
+            if points:
+                for bot_id, delta in ((match.white_bot_id, points[0]), (match.black_bot_id, points[1])):
+                    key = (match.tournament_id, bot_id)
+                    score_deltas[key] = score_deltas.get(key, 0.0) + delta
+        
+        Match.objects.bulk_update(
+            finished, ['status', 'result', 'started_at', 'completed_at'] + ARTIFACT_FIELDS
+        )
+        # Update participants in a fixed order so concurrent batches can't deadlock
+        for (tournament_id, bot_id), delta in sorted(score_deltas.items()):
+            if delta:
+                TournamentParticipant.objects.filter(
+                    tournament_id=tournament_id, bot_id=bot_id
+                ).update(score=F('score') + delta)
+        
+        BotStats.record_matches(finished)
+        for match in finished:
+            ratings.record_match(match)
+        
+        # Count the finished matches once per tournament, checking completion only if that completed it
+        finished_per_tournament = {}
+        for match in finished:
+            finished_per_tournament[match.tournament_id] = finished_per_tournament.get(match.tournament_id, 0) + 1
+        sprt_tournaments = {match.tournament_id for match in finished if match.tournament.format == 'sprt'}
+        for tournament_id in sprt_tournaments:
+            transaction.on_commit(lambda tournament_id=str(tournament_id): evaluate_sprt.delay(tournament_id))
+        for tournament_id, count in sorted(finished_per_tournament.items()):
+            # Release more matches of the tournament now that these bots are free
+            transaction.on_commit(lambda tournament_id=str(tournament_id): feed_tournament.delay(tournament_id))
+            if Tournament.count_completed(tournament_id, count):
+                transaction.on_commit(lambda tournament_id=str(tournament_id): check_tournament_completion.delay(tournament_id))
+    return finished
+
+def _finalize_each(matches):
+    """
+    Finalize played matches one at a time, after the batch transaction
+    failed. A match that can't be written either goes back to pending so it
+    is played again rather than left in progress. Returns the matches written.
+    """
+    from .models import Match
+    
+    finished = []
+    for match in matches:
+        try:
+            if _retry_on_db_error(match.finalize, match.result, ARTIFACT_FIELDS):
+                finished.append(match)
+        except Exception:
+            logger.exception(f"Failed to finalize match {match.id}, returning it to pending")
+            try:
+                Match.objects.filter(pk=match.pk, status='in_progress').update(status='pending')
+            except Exception:
+                logger.exception(f"Failed to return match {match.id} to pending")
+    return finished
+
+# run_match_batch tasks published per Celery group
+DISPATCH_GROUP_SIZE = 100
+
+def batch_size_for(tournament):
+    """Matches per run_match_batch task; SPRT pairs go one per task so a stopped test cancels every pair not yet started"""
+    return 2 if tournament.format == 'sprt' else settings.MATCH_BATCH_SIZE
+
+def dispatch_batches(batches, progress=None):
+    """
+    Queue a run_match_batch task per list of match ids, published as Celery
+    groups of DISPATCH_GROUP_SIZE tasks over a single broker connection.
+    progress, if given, is called with the number of matches dispatched so
+    far after each group.
+    """
+    dispatched = 0
+    for i in range(0, len(batches), DISPATCH_GROUP_SIZE):
+        chunk = batches[i:i + DISPATCH_GROUP_SIZE]
+        group(run_match_batch.s(batch) for batch in chunk).apply_async()
+        dispatched += sum(len(batch) for batch in chunk)
+        if progress:
+            progress(dispatched)
+
+@shared_task
+def start_tournament_job(job_id):
+    """
+    Start a tournament in the background: generate its pairings, create the
+    matches of its first round (every match of a round robin) and release
+    the first of them to the workers, recording progress on the
+    TournamentStartJob as each group is dispatched. The scheduler releases
+    the rest as games finish.
+    
+    Args:
+        job_id: UUID of the TournamentStartJob object
+    """
+    from django.db import transaction
+    from .models import TournamentStartJob
+    from .scheduler import release_matches
+    from .services import create_matches, round_robin_pairings, schedule_next_round
+    
+    job = TournamentStartJob.objects.select_related('tournament').get(id=job_id)
+    if job.status != 'queued':
+        return f"Start job {job_id} already {job.status}"
+    tournament = job.tournament
+    job.status = 'running'
+    job.save(update_fields=['status'])
+    
+    try:
+        # Start the tournament and create its matches in bulk, all or nothing
+        with transaction.atomic():
+            tournament = Tournament.objects.select_for_update().get(pk=tournament.pk)
+            if tournament.status != 'scheduled':
+                raise ValueError("Tournament can only be started from scheduled state")
+            tournament.start_tournament()
+            if tournament.format == 'round_robin':
+                match_ids = create_matches(tournament, round_robin_pairings(tournament, **job.options))
+            else:
+                match_ids = schedule_next_round(tournament)
+        job.matches_created = len(match_ids)
+        job.save(update_fields=['matches_created'])
+        
+        def progress(dispatched):
+            TournamentStartJob.objects.filter(pk=job.pk).update(matches_dispatched=dispatched)
+        
+        job.matches_dispatched = release_matches(tournament.id, progress)
+        job.status = 'done'
+    except Exception as e:
+        logger.error(f"Error starting tournament {tournament.id}: {str(e)}")
+        job.status = 'failed'
+        job.error = str(e)
+    
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'matches_dispatched', 'finished_at'])
+    return f"Start job {job_id} {job.status}: {job.matches_created} matches created"
+
 @shared_task
 def check_tournament_completion(tournament_id):
     """
-    Check if all matches in a tournament are completed and recalculate scores
+    Schedule the next round of a tournament whose matches are all completed,
+    or finish it, recalculating its scores, when there is none
+    
+    Queued once by the match that brings the tournament's completed_matches
+    counter up to total_matches, so no matches need to be counted here.
     
     Args:
         tournament_id: UUID of the Tournament object
     """
     try:
-        from django.db import transaction
-        from .models import Tournament, Match, TournamentParticipant
+        from .models import Tournament
+        from .scheduler import release_matches
+        from .services import schedule_next_round
         
-        with transaction.atomic():
-            tournament = Tournament.objects.get(id=tournament_id)
-            
-            # Count total matches
-            total_matches = Match.objects.filter(tournament=tournament).count()
-            
-            # Only count completed matches (error matches should now be marked as completed)
-            completed_matches = Match.objects.filter(
-                tournament=tournament,
-                status='completed'
-            ).count()
-            
-            # If all matches are completed, mark the tournament as completed
-            if total_matches > 0 and total_matches == completed_matches:
-                # First recalculate all scores
-                if hasattr(tournament, 'recalculate_scores'):
-                    tournament.recalculate_scores()
-                elif hasattr(tournament, 'complete_tournament'):
-                    tournament.complete_tournament()
-                else:
-                    # Fallback if neither method exists
-                    tournament.status = 'completed'
-                    tournament.completed_at = timezone.now()
-                    tournament.save()
-                
-                logger.info(f"Tournament {tournament_id} completed with all scores recalculated")
+        tournament = Tournament.objects.get(id=tournament_id)
+        if (tournament.status == 'in_progress' and tournament.total_matches > 0
+                and tournament.completed_matches >= tournament.total_matches):
+            match_ids = schedule_next_round(tournament)
+            if match_ids:
+                release_matches(tournament.id)
+                logger.info(f"Tournament {tournament_id}: next round of {len(match_ids)} matches scheduled")
+                return f"Next round of tournament {tournament_id} scheduled"
+            
+            # Recalculate all scores once as a final consistency pass
+            tournament.complete_tournament()
+            logger.info(f"Tournament {tournament_id} completed with all scores recalculated")
+            solve_tournament_ratings.delay(str(tournament_id))
                 
     except Exception as e:
         logger.error(f"Error checking tournament completion: {str(e)}")
         return f"Error checking tournament completion: {str(e)}"
     
-    return f"Tournament completion check executed for {tournament_id}"
\ No newline at end of file
+    return f"Tournament completion check executed for {tournament_id}"
+
+@shared_task
+def feed_tournament(tournament_id):
+    """Release the tournament's next pending matches to the workers, within its scheduling limits"""
+    from .scheduler import release_matches
+    
+    released = release_matches(tournament_id)
+    return f"Released {released} matches of tournament {tournament_id}"
+
+@shared_task
+def evaluate_sprt(tournament_id):
+    """Re-evaluate the SPRT of a head-to-head tournament after matches finished, stopping it early if decided"""
+    from .models import SprtTest
+    
+    test = SprtTest.objects.filter(tournament_id=tournament_id).first()
+    if test is None:
+        return f"Tournament {tournament_id} has no SPRT"
+    result = test.evaluate()
+    return f"SPRT of tournament {tournament_id}: LLR {test.llr:.3f}, {result}"
+
+@shared_task
+def recompute_ratings():
+    """Rebuild all Elo and Glicko-2 ratings from the full match history"""
+    games = ratings.recompute_ratings()
+    return f"Ratings recomputed from {games} games"
+
+@shared_task
+def solve_tournament_ratings(tournament_id):
+    """Fit BayesElo-style ratings to every completed game of a tournament and cache them"""
+    from .bayeselo import solve
+    from .models import Tournament, TournamentRatings
+    from .ratings import WHITE_SCORES
+    
+    tournament = Tournament.objects.get(id=tournament_id)
+    completed = tournament.completed_matches
+    games = (
+        Match.objects.filter(tournament=tournament, status='completed', result__in=list(WHITE_SCORES))
+        .values_list('white_bot_id', 'black_bot_id', 'result')
+    )
+    players = list(tournament.participants.values_list('id', flat=True))
+    result = solve(players, ((white, black, WHITE_SCORES[r]) for white, black, r in games))
+    
+    # Names are resolved here so the API can serve the cached result as is
+    names = dict(tournament.participants.values_list('id', 'name'))
+    for row in result['ratings']:
+        row['name'] = names.get(uuid.UUID(row['bot']), '')
+    
+    TournamentRatings.objects.update_or_create(
+        tournament=tournament, defaults={'games': completed, 'result': result, 'solve_queued_at': None}
+    )
+    return f"Ratings of tournament {tournament_id} solved from {result['games']} games"
@@ -1,3 +1,871 @@
-from django.test import TestCase
+import os
+import signal
+from contextlib import contextmanager
 
-# Create your tests here.
+from celery import current_app
+from django.test import SimpleTestCase, TestCase
+
+from .models import CustomUser, ChessBot, Tournament, TournamentParticipant, Match
+
+
+@contextmanager
+def eager_tasks():
+    """Run the tasks queued inside the block in process, as there is no broker under test"""
+    eager = current_app.conf.task_always_eager
+    current_app.conf.task_always_eager = True
+    try:
+        yield
+    finally:
+        current_app.conf.task_always_eager = eager
+
+
+class TournamentScoreTests(TestCase):
+    def setUp(self):
+        self.teacher = CustomUser.objects.create(email="teacher@example.com", username="teacher", role="teacher")
+        self.bots = [
+            ChessBot.objects.create(owner=self.teacher, name=name, file_path=f"chess_bots/{name}.py")
+            for name in ("alpha", "beta", "gamma")
+        ]
+        self.tournament = Tournament.objects.create(name="Test", created_by=self.teacher, status='in_progress')
+        for bot in self.bots:
+            TournamentParticipant.objects.create(tournament=self.tournament, bot=bot)
+
+    def play(self, white, black, result, status='completed'):
+        return Match.objects.create(tournament=self.tournament, white_bot=white, black_bot=black,
+                                    status=status, result=result)
+
+    def scores(self):
+        return {p.bot.name: p.score for p in TournamentParticipant.objects.filter(tournament=self.tournament)}
+
+    def test_recalculate_scores(self):
+        alpha, beta, gamma = self.bots
+        self.play(alpha, beta, 'white_win')
+        self.play(beta, gamma, 'draw')
+        self.play(gamma, alpha, 'black_win')
+        self.play(beta, alpha, 'black_win', status='pending')
+
+        self.tournament.recalculate_scores()
+
+        self.assertEqual(self.scores(), {'alpha': 2.0, 'beta': 0.5, 'gamma': 0.5})
+        self.assertEqual(self.tournament.status, 'in_progress')
+
+    def test_finalize_counts_each_match_once(self):
+        alpha, beta, _ = self.bots
+        match = self.play(alpha, beta, None, status='pending')
+
+        self.assertTrue(match.finalize('draw'))
+        self.assertFalse(match.finalize('white_win'))
+        self.assertFalse(Match.objects.get(pk=match.pk).finalize('black_win'))
+
+        self.assertEqual(Match.objects.get(pk=match.pk).result, 'draw')
+        self.assertEqual(self.scores(), {'alpha': 0.5, 'beta': 0.5, 'gamma': 0.0})
+
+        # A full recalculation agrees with the incremental scores
+        self.tournament.recalculate_scores()
+        self.assertEqual(self.scores(), {'alpha': 0.5, 'beta': 0.5, 'gamma': 0.0})
+
+    def test_completion_fires_once(self):
+        alpha, beta, _ = self.bots
+        matches = [self.play(alpha, beta, None, status='pending') for _ in range(2)]
+        self.tournament.add_matches(len(matches))
+
+        self.assertTrue(matches[0].finalize('white_win'))
+        self.assertFalse(matches[0].finalize('black_win'))
+        self.tournament.refresh_from_db()
+        self.assertEqual((self.tournament.completed_matches, self.tournament.status), (1, 'in_progress'))
+
+        with eager_tasks(), self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(matches[1].finalize('draw'))
+        self.tournament.refresh_from_db()
+        self.assertEqual((self.tournament.completed_matches, self.tournament.status), (2, 'completed'))
+        self.assertEqual(self.scores(), {'alpha': 1.5, 'beta': 0.5, 'gamma': 0.0})
+
+    def run_batch_failing_commit(self, matches, play):
+        """Run a batch whose transaction keeps failing, as on repeated deadlocks; returns the MEDIA_ROOT used"""
+        import tempfile
+        from unittest import mock
+        from django.db import OperationalError
+        from .tasks import run_match_batch
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with self.settings(MATCH_ARCHIVE=False, MEDIA_ROOT=media.name), \
+                mock.patch('users.tasks.play_match', side_effect=play), mock.patch('users.tasks.time.sleep'), \
+                mock.patch('users.tasks._record_batch', side_effect=OperationalError("deadlock")):
+            run_match_batch([str(match.id) for match in matches])
+        return media.name
+
+    def test_batch_survives_failed_games_and_commit(self):
+        alpha, beta, gamma = self.bots
+        broken, played = self.play(alpha, beta, None, status='pending'), self.play(beta, gamma, None, status='pending')
+        self.tournament.add_matches(2)
+
+        def play(match):
+            if match.pk == broken.pk:
+                raise OSError("disk full")
+            return 'white_win', None, match.artifact_name('log')
+
+        # The matches are finalized one by one instead
+        media = self.run_batch_failing_commit([broken, played], play)
+
+        broken.refresh_from_db()
+        self.assertEqual((broken.status, broken.result), ('completed', 'draw'))
+        with open(os.path.join(media, broken.log_file.name)) as f:
+            self.assertIn("disk full", f.read())
+        self.assertEqual(Match.objects.get(pk=played.pk).result, 'white_win')
+        self.assertEqual(self.scores(), {'alpha': 0.5, 'beta': 1.5, 'gamma': 0.0})
+
+    def test_batch_returns_unwritable_matches_to_pending(self):
+        from django.db import OperationalError
+        from unittest import mock
+
+        alpha, beta, _ = self.bots
+        match = self.play(alpha, beta, None, status='pending')
+
+        with mock.patch.object(Match, 'finalize', side_effect=OperationalError("gone")):
+            self.run_batch_failing_commit([match], lambda m: ('draw', None, None))
+
+        self.assertEqual(Match.objects.get(pk=match.pk).status, 'pending')
+
+    def run_match(self, match, play, finalize=Match.finalize):
+        """Run a single match task with play_match and finalize replaced; returns the MEDIA_ROOT used"""
+        import tempfile
+        from unittest import mock
+        from .tasks import run_chess_match
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with self.settings(MATCH_ARCHIVE=False, MEDIA_ROOT=media.name), \
+                mock.patch('users.tasks.play_match', side_effect=play), mock.patch('users.tasks.time.sleep'), \
+                mock.patch.object(Match, 'finalize', autospec=True, side_effect=finalize):
+            run_chess_match(str(match.id))
+        return media.name
+
+    def test_match_keeps_result_when_recording_fails(self):
+        from django.db import OperationalError
+
+        alpha, beta, _ = self.bots
+        match = self.play(alpha, beta, None, status='pending')
+        attempts, real_finalize = [], Match.finalize
+
+        def finalize(match, *args):
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise OperationalError("deadlock")
+            return real_finalize(match, *args)
+
+        self.run_match(match, lambda m: ('black_win', m.artifact_name('pgn'), m.artifact_name('log')), finalize)
+
+        match.refresh_from_db()
+        self.assertEqual((match.status, match.result), ('completed', 'black_win'))
+        self.assertEqual(match.pgn_file.name, match.artifact_name('pgn'))
+        self.assertEqual(self.scores(), {'alpha': 0.0, 'beta': 1.0, 'gamma': 0.0})
+
+    def test_failed_match_appends_error_to_log(self):
+        from django.conf import settings
+
+        alpha, beta, _ = self.bots
+        match = self.play(alpha, beta, None, status='pending')
+
+        def play(match):
+            path = os.path.join(settings.MEDIA_ROOT, match.artifact_name('log'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write("1. e4\n")
+            raise RuntimeError("host crashed")
+
+        media = self.run_match(match, play)
+
+        match.refresh_from_db()
+        self.assertEqual((match.status, match.result), ('completed', 'draw'))
+        with open(os.path.join(media, match.log_file.name)) as f:
+            log = f.read()
+        self.assertTrue(log.startswith("1. e4\n"))
+        self.assertIn("host crashed", log)
+
+    def test_run_match_queues_the_match_once(self):
+        from unittest import mock
+        from rest_framework.test import APIClient
+
+        alpha, beta, _ = self.bots
+        match = self.play(alpha, beta, None, status='pending')
+        client = APIClient()
+        client.force_authenticate(self.teacher)
+        url = f'/users/api/matches/{match.id}/run_match/'
+
+        with mock.patch('users.tasks.run_chess_match.delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post(url).status_code, 200)
+            self.assertEqual(client.post(url).status_code, 400)
+        delay.assert_called_once_with(str(match.id))
+        match.refresh_from_db()
+        self.assertEqual(match.status, 'queued')
+        self.assertIsNotNone(match.batch)
+
+        # A task for a match another worker has claimed doesn't play it again
+        Match.objects.filter(pk=match.pk).update(status='in_progress')
+        self.run_match(match, lambda m: self.fail("played twice"))
+        self.assertEqual(Match.objects.get(pk=match.pk).status, 'in_progress')
+
+    def test_ratings_recompute_matches_incremental_updates(self):
+        from . import ratings
+        from .models import BotRating
+
+        alpha, beta, gamma = self.bots
+        for white, black, result in ((alpha, beta, 'white_win'), (beta, gamma, 'draw'),
+                                     (gamma, alpha, 'white_win'), (alpha, beta, 'black_win')):
+            self.play(white, black, None, status='pending').finalize(result)
+        incremental = {r.bot_id: r.values() for r in BotRating.objects.all()}
+
+        self.assertEqual(ratings.recompute_ratings(), 4)
+        for rating in BotRating.objects.all():
+            for a, b in zip(rating.values(), incremental[rating.bot_id]):
+                self.assertAlmostEqual(a, b)
+
+    def test_bot_stats_follow_deleted_matches(self):
+        from .models import BotStats
+
+        def stats():
+            return {(r.bot_id, r.tournament_id): (r.games, r.wins, r.draws, r.losses, r.win_percentage)
+                    for r in BotStats.objects.filter(games__gt=0)}
+
+        alpha, beta, gamma = self.bots
+        other = Tournament.objects.create(name="Other", created_by=self.teacher, status='in_progress')
+        matches = [self.play(white, black, None, status='pending')
+                   for white, black in ((alpha, beta), (beta, gamma), (gamma, alpha))]
+        matches.append(Match.objects.create(tournament=other, white_bot=alpha, black_bot=gamma))
+        for match, result in zip(matches, ('white_win', 'draw', 'white_win', 'black_win')):
+            match.finalize(result)
+
+        BotStats.remove_matches(Match.objects.filter(pk=matches[0].pk))
+        matches[0].delete()
+        BotStats.remove_matches(Match.objects.filter(tournament=other))
+        other.delete()
+        incremental = stats()
+
+        BotStats.rebuild()
+        self.assertEqual(incremental, stats())
+        self.assertEqual(incremental[(alpha.id, None)], (1, 0, 0, 1, 0.0))
+
+    def test_deletes_keep_match_counters_and_bot_stats(self):
+        from rest_framework.test import APIClient
+        from .models import BotStats
+
+        def enrol(name):
+            student = CustomUser.objects.create(email=f"{name}@example.com", username=name, role="student")
+            bot = ChessBot.objects.create(owner=student, name=name, file_path=f"chess_bots/{name}.py")
+            TournamentParticipant.objects.create(tournament=self.tournament, bot=bot)
+            return student, bot
+
+        def counters():
+            self.tournament.refresh_from_db()
+            return self.tournament.total_matches, self.tournament.completed_matches
+
+        alpha, beta, gamma = self.bots
+        (delta_owner, delta), (epsilon_owner, epsilon) = enrol("delta"), enrol("epsilon")
+        games = ((alpha, beta, 'white_win'), (alpha, gamma, 'draw'), (alpha, delta, 'black_win'),
+                 (delta, beta, None), (epsilon, alpha, 'draw'), (beta, epsilon, None))
+        for white, black, result in games:
+            match = self.play(white, black, None, status='pending')
+            if result:
+                match.finalize(result)
+        self.tournament.add_matches(len(games))
+        self.assertEqual(counters(), (6, 4))
+
+        client = APIClient()
+        client.force_authenticate(self.teacher)
+        self.assertEqual(client.delete(f'/users/api/students/{delta_owner.id}/').status_code, 204)
+        self.assertEqual(counters(), (4, 3))
+
+        self.teacher.is_staff = True
+        self.teacher.save()
+        self.client.force_login(self.teacher)
+        self.client.post(f'/users/student/{epsilon_owner.id}/remove/')
+        self.assertFalse(CustomUser.objects.filter(pk=epsilon_owner.pk).exists())
+        self.assertEqual(counters(), (2, 2))
+
+        self.assertEqual(client.delete(f'/users/api/bots/{gamma.id}/').status_code, 204)
+        self.assertEqual(counters(), (1, 1))
+
+        # Only alpha's win over beta is left in the stats
+        incremental = {(r.bot_id, r.tournament_id): (r.games, r.wins) for r in BotStats.objects.all()}
+        BotStats.rebuild()
+        self.assertEqual(incremental, {(r.bot_id, r.tournament_id): (r.games, r.wins) for r in BotStats.objects.all()})
+        self.assertEqual(incremental[(alpha.id, None)], (1, 1))
+
+    def test_leaderboard_ranks_by_win_percentage_or_rating(self):
+        from rest_framework.test import APIClient
+        from .models import BotRating
+
+        alpha, beta, gamma = self.bots
+        ChessBot.objects.update(status='active')
+        other = Tournament.objects.create(name="Other", created_by=self.teacher, status='in_progress')
+        for bot in (alpha, gamma):
+            TournamentParticipant.objects.create(tournament=other, bot=bot)
+        for white, black, result in ((alpha, beta, 'white_win'), (alpha, gamma, 'white_win'),
+                                     (beta, gamma, 'draw'), (gamma, beta, 'white_win')):
+            self.play(white, black, None, status='pending').finalize(result)
+        Match.objects.create(tournament=other, white_bot=gamma, black_bot=alpha).finalize('white_win')
+
+        client = APIClient()
+        client.force_authenticate(self.teacher)
+
+        def leaderboard(query=""):
+            response = client.get(f'/users/api/leaderboard/{query}')
+            self.assertEqual(response.status_code, 200)
+            return [(row['name'], row['total_games'], row['wins'], row['draws'], row['losses'],
+                     row['win_percentage'], row['tournament_participations']) for row in response.json()['leaderboard']]
+
+        self.assertEqual(leaderboard(), [
+            ('alpha', 3, 2, 0, 1, 66.67, 2),
+            ('gamma', 4, 2, 1, 1, 50.0, 2),
+            ('beta', 3, 0, 1, 2, 0.0, 1),
+        ])
+        self.assertEqual(leaderboard(f"?tournament={self.tournament.id}"), [
+            ('alpha', 2, 2, 0, 0, 100.0, 1),
+            ('gamma', 3, 1, 1, 1, 33.33, 1),
+            ('beta', 3, 0, 1, 2, 0.0, 1),
+        ])
+
+        # Unrated bots go last when ranking by rating
+        BotRating.objects.filter(bot=alpha).update(elo=1550)
+        BotRating.objects.filter(bot=beta).update(elo=1600)
+        BotRating.objects.filter(bot=gamma).delete()
+        response = client.get('/users/api/leaderboard/?sort=elo')
+        self.assertEqual([(row['name'], row['elo']) for row in response.json()['leaderboard']],
+                         [('beta', 1600.0), ('alpha', 1550.0), ('gamma', None)])
+
+    def test_stale_ratings_queue_one_solve_at_a_time(self):
+        from unittest import mock
+        from rest_framework.test import APIClient
+        from .tasks import solve_tournament_ratings
+
+        alpha, beta, _ = self.bots
+        client = APIClient()
+        client.force_authenticate(self.teacher)
+        url = f'/users/api/tournaments/{self.tournament.id}/ratings/'
+
+        with mock.patch('users.views.solve_tournament_ratings.delay') as delay:
+            self.assertEqual(client.get(url).status_code, 202)
+            self.assertEqual(client.get(url).status_code, 202)
+            self.assertEqual(delay.call_count, 1)
+
+            # Once solved, the ratings are served and go stale with the next game
+            solve_tournament_ratings(str(self.tournament.id))
+            self.assertFalse(client.get(url).json()['stale'])
+            self.play(alpha, beta, None, status='pending').finalize('draw')
+            for _ in range(2):
+                self.assertTrue(client.get(url).json()['stale'])
+            self.assertEqual(delay.call_count, 2)
+
+
+class GameClockTests(SimpleTestCase):
+    def clock(self, **fields):
+        from .tasks import GameClock
+
+        return GameClock(Tournament(**fields))
+
+    def test_clock_flags_and_applies_increment(self):
+        import chess
+
+        clock = self.clock(time_control='clock', base_time_ms=1000, increment_ms=200)
+        self.assertEqual(clock.pgn_header(), "1+0.2")
+
+        # The increment is added once the move is made in time
+        self.assertTrue(clock.record(chess.WHITE, 0.5))
+        self.assertAlmostEqual(clock.remaining[chess.WHITE], 0.7)
+        self.assertAlmostEqual(clock.move_limit(chess.WHITE), 0.7)
+        self.assertEqual(clock.bot_info(chess.BLACK),
+                         {'time_left': 1000, 'wtime': 700, 'btime': 1000, 'winc': 200, 'binc': 200})
+
+        # Running over flags the side, without adding the increment
+        self.assertFalse(clock.record(chess.BLACK, 1.5))
+        self.assertEqual(clock.flagged, chess.BLACK)
+        self.assertAlmostEqual(clock.remaining[chess.BLACK], -0.5)
+        self.assertEqual(clock.move_limit(chess.BLACK), 0.001)
+
+    def test_fixed_move_time_leaves_timing_to_the_host(self):
+        import chess
+
+        clock = self.clock(time_control='move_time', move_time_ms=250)
+        self.assertEqual(clock.move_limit(chess.WHITE), 0.25)
+        self.assertEqual(clock.bot_info(chess.WHITE), {'time_left': 250, 'movetime': 250})
+        self.assertTrue(clock.record(chess.WHITE, 10))
+        self.assertIsNone(clock.flagged)
+        self.assertIsNone(clock.pgn_header())
+
+        clock = self.clock(time_control='nodes', move_time_ms=250, node_limit=5000)
+        self.assertEqual(clock.bot_info(chess.BLACK), {'time_left': 250, 'movetime': 250, 'nodes': 5000})
+
+
+class MatchLogTests(SimpleTestCase):
+    def write_all(self, log):
+        log.summary("summary %d", 1)
+        log.moves("moves %d", 2)
+        log.debug("debug %d", 3)
+
+    def test_levels_filter_records(self):
+        from .match_log import MatchLog
+
+        expected = {
+            'off': [],
+            'summary': ["summary 1"],
+            'moves': ["summary 1", "moves 2"],
+            'debug': ["summary 1", "moves 2", "debug 3"],
+        }
+        for level, lines in expected.items():
+            with self.subTest(level=level):
+                log = MatchLog(level)
+                self.write_all(log)
+                self.assertEqual(log.render(), "\n".join(lines) + "\n")
+                self.assertEqual(log.wants_debug, level == 'debug')
+
+    def test_records_below_the_level_are_not_formatted(self):
+        from .match_log import MatchLog
+
+        class Counted:
+            formatted = 0
+
+            def __str__(self):
+                Counted.formatted += 1
+                return "counted"
+
+        log = MatchLog('summary')
+        log.moves("move %s", Counted())
+        log.debug("debug %s", Counted())
+        self.assertEqual(Counted.formatted, 0)
+
+        # Only an abnormal ending writes out the detailed records
+        self.assertEqual(log.render(), "\n")
+        self.assertEqual(Counted.formatted, 0)
+        self.assertIn("move counted", log.render(abnormal=True))
+        self.assertEqual(Counted.formatted, 2)
+
+    def test_ring_buffer_keeps_the_last_records(self):
+        from .match_log import DEFAULT_RING_SIZE, MatchLog
+
+        log = MatchLog('summary')
+        for i in range(DEFAULT_RING_SIZE + 50):
+            log.moves("move %d", i)
+        self.assertEqual(DEFAULT_RING_SIZE, 200)
+        self.assertEqual(len(log.ring), 200)
+        self.assertEqual(log.dropped, 50)
+
+        lines = log.render(abnormal=True).splitlines()
+        self.assertEqual(lines[1], "Last 200 detailed log records (50 older records dropped):")
+        self.assertEqual(lines[2], "move 50")
+        self.assertEqual(lines[-1], "move 249")
+
+
+class PgnStreamWriterTests(SimpleTestCase):
+    def test_streamed_game_reads_back(self):
+        import io
+        import tempfile
+
+        import chess
+        import chess.pgn
+
+        from .recording import PgnStreamWriter
+
+        board = chess.Board()
+        with tempfile.TemporaryDirectory() as media:
+            path = os.path.join(media, "pgn", "game.pgn")
+            pgn = PgnStreamWriter(path, [("Event", "Tournament Test"), ("White", "alpha"), ("Black", "beta"),
+                                         ("Result", "*"), ("TimeControl", "1+0.2")])
+            for san in ("f3", "e5", "g4", "Qh4#"):
+                move = board.parse_san(san)
+                pgn.add_move(board, move)
+                board.push(move)
+            pgn.finish('black_win')
+
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+
+        self.assertNotIn("*", text)
+        for line in text.splitlines():
+            self.assertEqual(line, line.rstrip())
+        self.assertIn('[Result "0-1"]\n[TimeControl "1+0.2"]\n', text)
+
+        game = chess.pgn.read_game(io.StringIO(text))
+        self.assertEqual(game.headers["Event"], "Tournament Test")
+        self.assertEqual(game.headers["Result"], "0-1")
+        self.assertEqual(game.headers["TimeControl"], "1+0.2")
+        self.assertEqual(game.end().board(), board)
+        self.assertEqual(game.errors, [])
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        import tempfile
+
+        from django.test import override_settings
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, MATCH_ARCHIVE=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.teacher = CustomUser.objects.create(email="teacher@example.com", username="teacher", role="teacher")
+        self.bots = [
+            ChessBot.objects.create(owner=self.teacher, name=name, file_path=f"chess_bots/{name}.py")
+            for name in ("alpha", "beta")
+        ]
+        self.tournament = Tournament.objects.create(name="Test", created_by=self.teacher, status='in_progress')
+
+    def play(self, number, archived=True):
+        """A completed match with a one-move PGN, moved into the archive if archived"""
+        from . import archive
+
+        match = Match.objects.create(tournament=self.tournament, white_bot=self.bots[0], black_bot=self.bots[1],
+                                     status='completed', result='draw')
+        match._save_artifact('pgn', f'[Event "Game {number}"]\n\n1. e4 1/2-1/2\n\n', save=True)
+        if archived:
+            archive.remove_files(archive.archive_match(match))
+            match.save()
+        return match
+
+    def export(self, query=""):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(self.teacher)
+        response = client.get(f"/users/api/tournaments/{self.tournament.id}/export_pgn/{query}")
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_append_and_read_round_trip(self):
+        import gzip
+
+        from . import archive
+
+        games = [f"game {i}\n".encode() * (i + 1) for i in range(3)]
+        members = [archive.append(self.tournament.id, 'pgn', data) for data in games]
+
+        # Members are laid end to end and each one reads back on its own
+        self.assertEqual(members[0][0], 0)
+        for (offset, length), (next_offset, _) in zip(members, members[1:]):
+            self.assertEqual(offset + length, next_offset)
+        for data, (offset, length) in zip(games, members):
+            self.assertEqual(archive.read(self.tournament.id, 'pgn', offset, length), data)
+
+        with open(archive.archive_path(self.tournament.id, 'pgn'), 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), b"".join(games))
+
+    def test_archived_match_keeps_its_offsets(self):
+        first, second = self.play(1), self.play(2)
+        self.assertFalse(second.pgn_file)
+        self.assertEqual(second.pgn_offset, first.pgn_offset + first.pgn_length)
+
+        second.refresh_from_db()
+        self.assertTrue(second.has_artifact('pgn'))
+        self.assertEqual(second.read_artifact('pgn'), b'[Event "Game 2"]\n\n1. e4 1/2-1/2\n\n')
+
+    def test_export_pgn_streams_every_game(self):
+        import gzip
+
+        for number in (1, 2):
+            self.play(number)
+        self.play(3, archived=False)
+
+        plain = self.export()
+        self.assertEqual([line for line in plain.decode().splitlines() if line.startswith("[Event")],
+                         ['[Event "Game 1"]', '[Event "Game 2"]', '[Event "Game 3"]'])
+        self.assertEqual(gzip.decompress(self.export("?gzip=1")), plain)
+
+    def test_export_pgn_skips_missing_games(self):
+        from . import archive
+
+        self.play(1)
+        self.play(2, archived=False).pgn_file.delete(save=False)
+        self.play(3, archived=False)
+        archive.delete_archives(self.tournament.id)
+
+        with self.assertLogs('users.archive', 'ERROR') as logs:
+            plain = self.export()
+        self.assertEqual(plain.decode().splitlines()[0], '[Event "Game 3"]')
+        self.assertEqual(len(logs.records), 2)
+
+
+class BayesEloTests(TestCase):
+    def test_solve_uses_virtual_draw_prior(self):
+        from .bayeselo import solve
+
+        # 7/10 plus two virtual draws is 8/12, a strength ratio of 2 (about 120 Elo)
+        games = [('a', 'b', 1.0)] * 6 + [('a', 'b', 0.5)] * 2 + [('b', 'a', 1.0)] * 2
+        result = solve(['a', 'b', 'idle'], games)
+
+        a, b = result['ratings']
+        self.assertEqual((a['bot'], b['bot']), ('a', 'b'))
+        self.assertAlmostEqual(a['rating'] - b['rating'], 120.4, places=1)
+        self.assertEqual(a['error'], b['error'])
+        self.assertGreater(result['los']['a']['b'], 0.5)
+        self.assertAlmostEqual(result['los']['a']['b'] + result['los']['b']['a'], 1.0, places=3)
+
+
+class SprtTests(TestCase):
+    def test_llr_follows_pair_results(self):
+        from .sprt import llr, decide
+
+        # Candidate scores 1.5 or 2 out of 2 in most pairs
+        strong = [2, 5, 20, 30, 25]
+        self.assertEqual(decide(llr(strong, 0, 10), 0.05, 0.05, sum(strong)), 'h1')
+        self.assertEqual(decide(llr(strong[::-1], 0, 10), 0.05, 0.05, sum(strong)), 'h0')
+        self.assertIsNone(decide(llr([0, 0, 5, 0, 0], 0, 10), 0.05, 0.05, 5))
+
+
+class SwissPairingTests(TestCase):
+    def test_pairs_score_groups_without_rematches(self):
+        from .services import pair_swiss_round
+
+        bots = ['a', 'b', 'c', 'd', 'e']
+        scores = {'a': 1.0, 'b': 1.0, 'c': 0.0, 'd': 0.0, 'e': 1.0}
+        opponents = {'a': {'c'}, 'c': {'a'}, 'b': {'d'}, 'd': {'b'}}
+        colours = {'a': ['w'], 'c': ['b'], 'b': ['w'], 'd': ['b'], 'e': []}
+
+        pairings, bye = pair_swiss_round(bots, scores, opponents, colours, had_bye={'e'}, round_num=2)
+
+        self.assertEqual(bye, 'd')
+        self.assertEqual({frozenset(pair) for pair in pairings}, {frozenset('ab'), frozenset('ec')})
+        # c had black in the first round and e no game, so c gets white
+        self.assertEqual(dict((black, white) for white, black in pairings)['e'], 'c')
+
+    def test_knockout_bracket_gives_top_seeds_the_byes(self):
+        from .services import knockout_bracket
+
+        slots = knockout_bracket(['s1', 's2', 's3', 's4', 's5', 's6'])
+
+        self.assertEqual(list(zip(slots[::2], slots[1::2])),
+                         [('s1', None), ('s4', 's5'), ('s2', None), ('s3', 's6')])
+
+
+class TournamentStartTests(TestCase):
+    def test_start_runs_in_background_job(self):
+        from unittest import mock
+        from rest_framework.test import APIClient
+
+        teacher = CustomUser.objects.create(email="teacher@example.com", username="teacher", role="teacher")
+        tournament = Tournament.objects.create(name="Start", created_by=teacher)
+        for name in ("alpha", "beta", "gamma", "delta"):
+            bot = ChessBot.objects.create(owner=teacher, name=name, file_path=f"chess_bots/{name}.py", status="active")
+            TournamentParticipant.objects.create(tournament=tournament, bot=bot)
+        client = APIClient()
+        client.force_authenticate(teacher)
+
+        with mock.patch('users.tasks.group') as group, eager_tasks(), self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'/users/api/tournaments/{tournament.id}/start_tournament/',
+                                   {'double_round_robin': True}, format='json')
+        self.assertEqual(response.status_code, 202)
+
+        progress = client.get(f'/users/api/tournaments/{tournament.id}/start_progress/').json()
+        self.assertEqual(progress['job_id'], response.json()['job_id'])
+        # Batches are filled up to MATCH_BATCH_SIZE games, so every game goes out in two batches
+        self.assertEqual((progress['status'], progress['matches_created'], progress['matches_dispatched']),
+                         ('done', 12, 12))
+        self.assertEqual(progress['tournament_status'], 'in_progress')
+        self.assertEqual(len(list(group.call_args.args[0])), 2)
+        self.assertEqual(Match.objects.filter(status='queued').values('batch').distinct().count(), 2)
+
+    def test_unpublished_batches_return_to_pending(self):
+        from unittest import mock
+        from .scheduler import release_matches
+
+        teacher = CustomUser.objects.create(email="teacher@example.com", username="teacher", role="teacher")
+        tournament = Tournament.objects.create(name="Feed", created_by=teacher, status='in_progress')
+        bots = [ChessBot.objects.create(owner=teacher, name=name, file_path=f"chess_bots/{name}.py")
+                for name in ("alpha", "beta", "gamma", "delta")]
+        for white in bots:
+            for black in bots:
+                if white != black:
+                    Match.objects.create(tournament=tournament, white_bot=white, black_bot=black)
+
+        # The broker goes away after the first batch is published
+        with mock.patch('users.tasks.DISPATCH_GROUP_SIZE', 1), mock.patch('users.tasks.group') as group:
+            group.return_value.apply_async.side_effect = [None, ConnectionError("broker down")]
+            with self.assertRaises(ConnectionError), self.captureOnCommitCallbacks(execute=True):
+                release_matches(tournament.id)
+
+        self.assertEqual(Match.objects.filter(status='queued').values('batch').distinct().count(), 1)
+        self.assertEqual(Match.objects.filter(status='queued').count(), 8)
+        self.assertEqual(Match.objects.filter(status='pending', batch__isnull=True).count(), 4)
+
+
+class SchedulerTests(SimpleTestCase):
+    def round_robin(self, bots):
+        """Pending (id, white, black, round) matches of a double round robin, both games of a pairing together"""
+        from itertools import combinations
+
+        pending = []
+        for white, black in combinations(range(bots), 2):
+            pending += [(len(pending), white, black, None), (len(pending) + 1, black, white, None)]
+        return pending
+
+    def bots_per_batch(self, pending, batches):
+        bots = {match_id: {white, black} for match_id, white, black, _ in pending}
+        return [set().union(*(bots[match_id] for match_id in batch)) for batch in batches]
+
+    def test_round_robin_fills_batches(self):
+        from collections import Counter
+        from .scheduler import select_matches
+
+        pending = self.round_robin(10)
+        batches = select_matches(pending, [], bot_concurrency=2, budget=64, batch_size=8)
+
+        # Batches fill up with the games among four or five bots, and no bot is in more than two batches.
+        # The third batch is all that is left once every bot has one batch.
+        batch_bots = self.bots_per_batch(pending, batches)
+        self.assertEqual([len(batch) for batch in batches], [8, 8, 2, 8, 8])
+        self.assertEqual([len(bots) for bots in batch_bots], [4, 4, 2, 5, 4])
+        self.assertLessEqual(max(Counter(bot for bots in batch_bots for bot in bots).values()), 2)
+
+    def test_in_flight_batches_take_bot_slots(self):
+        from .scheduler import select_matches
+
+        pending = [match for match in self.round_robin(4) if 0 not in match[1:3]]
+        # Bot 0 is in two batches already and bots 1 and 2 in one each, however many games they hold,
+        # so all the games of bots 1, 2 and 3 go in one batch
+        in_flight = [('x', 0, 1), ('x', 1, 0), ('y', 0, 2)]
+        batches = select_matches(pending, in_flight, bot_concurrency=2, budget=64, batch_size=8)
+        self.assertEqual(self.bots_per_batch(pending, batches), [{1, 2, 3}])
+        self.assertEqual([len(batch) for batch in batches], [6])
+
+        # The budget counts games, cutting a batch short if need be
+        batches = select_matches(pending, in_flight, bot_concurrency=2, budget=1, batch_size=8)
+        self.assertEqual([len(batch) for batch in batches], [1])
+
+    def test_bots_in_every_game_are_not_limited(self):
+        from .scheduler import select_matches
+
+        # A gauntlet: bot 0 plays four games against each of nine opponents
+        pending = [(i, 0, 1 + i // 4, 1) for i in range(36)]
+        batches = select_matches(pending, [], bot_concurrency=2, budget=64, batch_size=8, unlimited={0})
+
+        # Each batch holds the games of two opponents, every one of which is in a single batch
+        self.assertEqual([len(batch) for batch in batches], [8, 8, 8, 8, 4])
+        self.assertEqual(sorted(len(bots - {0}) for bots in self.bots_per_batch(pending, batches)), [1, 2, 2, 2, 2])
+        self.assertEqual(sorted(match_id for batch in batches for match_id in batch), list(range(36)))
+
+
+BOT_TEMPLATE = '''
+import chess
+import signal
+import time
+
+class TestBot:
+    debug = False
+
+    def __init__(self):
+        self.board = chess.Board()
+
+    def select_move(self):
+%s
+'''
+
+BOT_MOVES = {
+    'first_move': "        return next(iter(self.board.legal_moves))",
+    'chatty': "        print('thinking, debug', self.debug)\n        return next(iter(self.board.legal_moves))",
+    'busy_loop': "        while True:\n            pass",
+    'native_loop': "        return sum(range(10 ** 12))",
+    'memory_bomb': "        return bytearray(2 * 1024 ** 3)",
+    'ignore_timer': "        signal.signal(signal.SIGALRM, signal.SIG_IGN)\n        time.sleep(60)",
+}
+
+
+class BotHostTests(SimpleTestCase):
+    """Bot hosts run real subprocesses with the bots in BOT_MOVES"""
+
+    def setUp(self):
+        import tempfile
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.paths = {}
+        for name, body in BOT_MOVES.items():
+            self.paths[name] = os.path.join(directory.name, f"{name}.py")
+            with open(self.paths[name], 'w') as f:
+                f.write(BOT_TEMPLATE % body)
+
+    def host(self, name, **kwargs):
+        from .bot_host import BotHost
+
+        host = BotHost((name, 1), self.paths[name], **kwargs)
+        self.addCleanup(host.close)
+        host.new_game()
+        return host
+
+    def test_host_plays_in_sync(self):
+        import chess
+        import chess.polyglot
+
+        host = self.host('first_move')
+        response = host.select_move(time_limit=2)
+        self.assertTrue(response['ok'])
+
+        board = chess.Board()
+        board.push_uci(response['move'])
+        self.assertEqual(response['hash'], chess.polyglot.zobrist_hash(board))
+        board.push_uci('e7e5')
+        self.assertEqual(host.request('push', move='e7e5')['hash'], chess.polyglot.zobrist_hash(board))
+        self.assertFalse(host.request('push', move='e7e5')['ok'])
+
+    def test_bot_output_reaches_debug_log(self):
+        from .match_log import MatchLog
+        from .tasks import ChessBotRunner
+
+        log = MatchLog(level='debug')
+        runner = ChessBotRunner(self.paths['chatty'], 'chatty', bot_id='chatty', version=1, log=log)
+        self.addCleanup(runner.close)
+        self.assertTrue(runner.load_bot())
+        self.assertIsNotNone(runner.make_move())
+
+        self.assertIn("chatty output: thinking, debug True", log.render())
+
+    def test_timer_interrupts_python_loop(self):
+        host = self.host('busy_loop')
+        response = host.select_move(time_limit=0.2)
+        self.assertTrue(response['timeout'])
+        # The host survives and keeps serving
+        self.assertTrue(host.alive)
+        self.assertTrue(host.new_game()['ok'])
+
+    def test_cpu_limit_kills_native_loop(self):
+        from .bot_host import BotHostError, BotHostTimeout
+
+        # The timer can't interrupt C code, so RLIMIT_CPU kills the host before the watchdog does
+        host = self.host('native_loop')
+        with self.assertRaises(BotHostError) as raised:
+            host.select_move(time_limit=4, cpu_limit=1)
+        self.assertNotIsInstance(raised.exception, BotHostTimeout)
+        self.assertEqual(host.process.returncode, -signal.SIGXCPU)
+
+    def test_watchdog_kills_unresponsive_host(self):
+        from .bot_host import BotHostTimeout
+
+        host = self.host('ignore_timer')
+        with self.assertRaises(BotHostTimeout):
+            host.select_move(time_limit=0.2)
+        self.assertFalse(host.alive)
+
+    def test_memory_limit_fails_the_move_only(self):
+        host = self.host('memory_bomb', memory_limit=512 * 1024 ** 2)
+        response = host.select_move(time_limit=5)
+        self.assertFalse(response['ok'])
+        self.assertIn('MemoryError', response['error'])
+        self.assertTrue(host.alive)
+
+    def test_pool_reuses_and_recycles_hosts(self):
+        from .bot_host import BotHostPool
+
+        pool = BotHostPool(max_games=2, max_idle=4)
+        self.addCleanup(pool.shutdown)
+
+        host = pool.acquire('bot', 1, self.paths['first_move'])
+        host.new_game()
+        pool.release(host)
+        self.assertIs(pool.acquire('bot', 1, self.paths['first_move']), host)
+
+        # A second game reaches max_games, so the host is stopped instead of pooled
+        host.new_game()
+        pool.release(host)
+        self.assertFalse(host.alive)
+        new_host = pool.acquire('bot', 1, self.paths['first_move'])
+        self.addCleanup(new_host.close)
+        self.assertIsNot(new_host, host)
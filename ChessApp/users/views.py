@@ -1,7 +1,7 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -10,14 +10,17 @@ from django.urls import reverse
 from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from .models import CustomUser, ChessBot, Tournament, TournamentParticipant, Match, ClassGroup
+from .models import (CustomUser, ChessBot, Tournament, TournamentParticipant, Match, ClassGroup, BotStats,
+                     BotRating, RatingHistory, TournamentRatings, SprtTest, TournamentStartJob)
 from .serializers import (ChessBotSerializer, ChessBotUploadSerializer, StudentSerializer, StudentDetailSerializer,
                          ClassGroupSerializer, ClassGroupDetailSerializer,
                          TournamentSerializer, TournamentDetailSerializer, MatchSerializer)
-from django.db.models import Q
-from django.db import models
-from .services import generate_round_robin_matches, generate_round_robin_matches_with_rounds  # Add this import
-from .tasks import run_chess_match
+from django.db.models import Q, Count, F
+from django.db import models, transaction
+from django.core.exceptions import ValidationError
+from .tasks import solve_tournament_ratings, start_tournament_job
+from .scheduler import release_match
+from . import archive
 
 def login(request):
     """Render the login page with direct Google OAuth option"""
@@ -109,6 +112,17 @@ class TokenObtainView(APIView):
             }
         })
 
+def _delete_with_matches(instance, matches):
+    """
+    Delete a bot, student or match along with the matches the delete
+    cascades to, keeping their tournaments' match counters and the bot
+    stats in step.
+    """
+    with transaction.atomic():
+        BotStats.remove_matches(matches)
+        Tournament.remove_matches(matches)
+        instance.delete()
+
 class ChessBotViewSet(viewsets.ModelViewSet):
     """API endpoint for chess bots"""
     serializer_class = ChessBotSerializer
@@ -212,7 +226,8 @@ class ChessBotViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        bot.delete()
+        # Its matches go with it, so its opponents' stats mustn't keep counting them
+        _delete_with_matches(bot, Match.objects.filter(Q(white_bot=bot) | Q(black_bot=bot)))
         return Response(status=status.HTTP_204_NO_CONTENT)
         
     @action(detail=True, methods=['post'])
@@ -264,6 +279,28 @@ class ChessBotViewSet(viewsets.ModelViewSet):
         bot.save()
         
         return Response({"message": "Bot archived successfully"})
+    
+    @action(detail=True, methods=['get'])
+    def rating_history(self, request, pk=None):
+        """Ratings of the bot after each of its matches, optionally for one ?version="""
+        bot = self.get_object()
+        
+        history = RatingHistory.objects.filter(bot=bot)
+        version = request.query_params.get('version')
+        if version:
+            history = history.filter(version=version)
+        
+        return Response({
+            'bot': str(bot.id),
+            'ratings': [{
+                'version': row.version,
+                'elo': round(row.elo, 1),
+                'glicko_rating': round(row.glicko_rating, 1),
+                'glicko_rd': round(row.glicko_rd, 1),
+                'match': str(row.match_id),
+                'created_at': row.created_at,
+            } for row in history]
+        })
 
 class IsTeacher(permissions.BasePermission):
     """Permission to only allow teachers to access view"""
@@ -310,7 +347,7 @@ class StudentViewSet(viewsets.ModelViewSet):
             )
             
         student = self.get_object()
-        student.delete()
+        _delete_with_matches(student, Match.objects.filter(Q(white_bot__owner=student) | Q(black_bot__owner=student)))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 class ClassGroupViewSet(viewsets.ModelViewSet):
@@ -376,6 +413,12 @@ class TournamentViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """Set created_by to current user when creating"""
         serializer.save(created_by=self.request.user)
+    
+    def perform_destroy(self, instance):
+        """Take the tournament's games out of the overall bot stats"""
+        with transaction.atomic():
+            BotStats.remove_matches(Match.objects.filter(tournament=instance))
+            instance.delete()
 
     def create(self, request, *args, **kwargs):
         """Debug tournament creation"""
@@ -406,72 +449,107 @@ class TournamentViewSet(viewsets.ModelViewSet):
             return Response({"error": "Need at least 2 active bots to start tournament"}, 
                             status=status.HTTP_400_BAD_REQUEST)
         
-        # Start the tournament
-        tournament.start_tournament()
+        if tournament.format == 'sprt':
+            error = self._setup_sprt(request, tournament, participants)
+        elif tournament.format == 'gauntlet':
+            error = self._setup_gauntlet(request, tournament, participants)
+        else:
+            error = None
+        if error:
+            return error
+        
+        # Matches are generated and dispatched by a background job, so the request returns right away
+        with transaction.atomic():
+            Tournament.objects.select_for_update().filter(pk=tournament.pk).first()
+            if TournamentStartJob.objects.filter(tournament=tournament, status__in=['queued', 'running']).exists():
+                return Response({"error": "Tournament is already being started"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            job = TournamentStartJob.objects.create(tournament=tournament, options={
+                # Choose matchmaking method based on presence of 'use_rounds' parameter
+                'use_rounds': bool(request.data.get('use_rounds', False)),
+                'double_round_robin': bool(request.data.get('double_round_robin', False)),
+            })
+            job_id = str(job.id)
+            transaction.on_commit(lambda: start_tournament_job.delay(job_id))
         
-        # Choose matchmaking method based on presence of 'use_rounds' parameter
-        use_rounds = request.data.get('use_rounds', False)
-        matches_created = 0
-        match_ids = []
+        return Response({
+            "message": "Tournament is being started",
+            "job_id": job_id
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    def _setup_sprt(self, request, tournament, participants):
+        """Set up the head-to-head SPRT between two bots, returning an error response if the request is invalid"""
+        if len(participants) != 2:
+            return Response({"error": "An SPRT tournament needs exactly 2 active bots"},
+                            status=status.HTTP_400_BAD_REQUEST)
         
-        if use_rounds:
-            # Generate round-robin tournament matches organized by rounds
-            rounds = generate_round_robin_matches_with_rounds(tournament)
-            
-            # Create match objects in the database with round information
-            for round_num, pairings in rounds.items():
-                for white_bot, black_bot in pairings:
-                    match = Match.objects.create(
-                        tournament=tournament,
-                        white_bot=white_bot,
-                        black_bot=black_bot,
-                        round=round_num
-                    )
-                    matches_created += 1
-                    match_ids.append(str(match.id))
-                    
-                    # Optionally create reverse matches (black/white switched) in the same round
-                    if request.data.get('double_round_robin', False):
-                        match = Match.objects.create(
-                            tournament=tournament,
-                            white_bot=black_bot,
-                            black_bot=white_bot,
-                            round=round_num
-                        )
-                        matches_created += 1
-                        match_ids.append(str(match.id))
-        else:
-            # Generate standard round-robin tournament matches
-            match_pairings = generate_round_robin_matches(tournament)
-            
-            # Create match objects in the database
-            for white_bot, black_bot in match_pairings:
-                match = Match.objects.create(
-                    tournament=tournament,
-                    white_bot=white_bot,
-                    black_bot=black_bot
-                )
-                matches_created += 1
-                match_ids.append(str(match.id))
-                
-                # Optionally create reverse matches (black/white switched)
-                if request.data.get('double_round_robin', False):
-                    match = Match.objects.create(
-                        tournament=tournament,
-                        white_bot=black_bot,
-                        black_bot=white_bot
-                    )
-                    matches_created += 1
-                    match_ids.append(str(match.id))
-        
-        # Start a background tasks to run the matches
-        # Dispatch Celery tasks for each match
-        for match_id in match_ids:
-            run_chess_match.delay(match_id)
+        # The candidate defaults to the bot added last, typically the new version
+        candidate_id = request.data.get('candidate_id') or TournamentParticipant.objects.filter(
+            tournament=tournament, bot__in=participants).latest('added_at').bot_id
+        candidate = next((bot for bot in participants if str(bot.id) == str(candidate_id)), None)
+        if candidate is None:
+            return Response({"error": "The candidate must be one of the tournament's bots"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        baseline = next(bot for bot in participants if bot.id != candidate.id)
         
+        params = {}
+        try:
+            for field in ('elo0', 'elo1', 'alpha', 'beta'):
+                if field in request.data:
+                    params[field] = float(request.data[field])
+            for field in ('batch_pairs', 'max_pairs'):
+                if field in request.data:
+                    params[field] = int(request.data[field])
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid SPRT parameters"}, status=status.HTTP_400_BAD_REQUEST)
+        if (params.get('elo1', 10.0) <= params.get('elo0', 0.0)
+                or not all(0 < params.get(p, 0.05) < 0.5 for p in ('alpha', 'beta'))
+                or params.get('batch_pairs', 1) < 1 or params.get('max_pairs', 1) < 1):
+            return Response({"error": "Invalid SPRT parameters"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        SprtTest.objects.update_or_create(
+            tournament=tournament, defaults={'candidate': candidate, 'baseline': baseline, **params}
+        )
+        return None
+    
+    def _setup_gauntlet(self, request, tournament, participants):
+        """Pick the gauntlet's challenger, by default the bot added last, returning an error response if invalid"""
+        challenger_id = request.data.get('challenger_id') or tournament.challenger_id or TournamentParticipant.objects.filter(
+            tournament=tournament, bot__in=participants).latest('added_at').bot_id
+        challenger = next((bot for bot in participants if str(bot.id) == str(challenger_id)), None)
+        if challenger is None:
+            return Response({"error": "The challenger must be one of the tournament's active bots"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        tournament.challenger = challenger
+        tournament.save(update_fields=['challenger'])
+        return None
+    
+    @action(detail=True, methods=['get'])
+    def start_progress(self, request, pk=None):
+        """Progress of the tournament's start job (?job=<id>, the latest by default) and of its matches"""
+        tournament = self.get_object()
+        jobs = TournamentStartJob.objects.filter(tournament=tournament)
+        job_id = request.query_params.get('job')
+        try:
+            job = jobs.filter(id=job_id).first() if job_id else jobs.order_by('-created_at').first()
+        except ValidationError:
+            job = None
+        if job is None:
+            return Response({"error": "Start job not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        tournament.refresh_from_db(fields=['status', 'total_matches', 'completed_matches'])
         return Response({
-            "message": "Tournament started successfully", 
-            "matches_created": matches_created
+            'job_id': str(job.id),
+            'status': job.status,
+            'error': job.error,
+            'matches_created': job.matches_created,
+            'matches_dispatched': job.matches_dispatched,
+            'matches_completed': tournament.completed_matches,
+            'total_matches': tournament.total_matches,
+            'tournament_status': tournament.status,
+            'created_at': job.created_at,
+            'finished_at': job.finished_at,
         })
 
     @action(detail=True, methods=['post'])
@@ -556,6 +634,71 @@ class TournamentViewSet(viewsets.ModelViewSet):
         response['Content-Disposition'] = f'attachment; filename=tournament_{tournament.id}_results.csv'
         return response
     
+    @action(detail=True, methods=['get'])
+    def export_pgn(self, request, pk=None):
+        """Stream all games of the tournament as one PGN, gzip-compressed with ?gzip=1"""
+        tournament = self.get_object()
+        compress = request.query_params.get('gzip') in ('1', 'true', 'yes')
+        
+        games = archive.iter_tournament_pgn(tournament.id, compress=compress)
+        if compress:
+            response = StreamingHttpResponse(games, content_type='application/gzip')
+            response['Content-Disposition'] = f'attachment; filename=tournament_{tournament.id}.pgn.gz'
+        else:
+            response = StreamingHttpResponse(games, content_type='application/x-chess-pgn')
+            response['Content-Disposition'] = f'attachment; filename=tournament_{tournament.id}.pgn'
+        return response
+    
+    @action(detail=True, methods=['get'])
+    def ratings(self, request, pk=None):
+        """
+        Maximum-likelihood ratings with 95% error bars and likelihood of
+        superiority, solved in the background and cached per tournament.
+        """
+        tournament = self.get_object()
+        cached, _ = TournamentRatings.objects.get_or_create(tournament=tournament)
+        
+        # While a tournament runs its ratings are always stale, so only one solve is queued at a time
+        stale = not cached.result or cached.is_stale()
+        if stale and cached.claim_solve():
+            solve_tournament_ratings.delay(str(tournament.id))
+        
+        if not cached.result:
+            return Response({"message": "Ratings are being computed"}, status=status.HTTP_202_ACCEPTED)
+        
+        return Response({
+            **cached.result,
+            'computed_at': cached.computed_at,
+            'stale': stale,
+        })
+    
+    @action(detail=True, methods=['get'])
+    def sprt(self, request, pk=None):
+        """State of the tournament's SPRT: pentanomial counts, LLR against its bounds, and result"""
+        from .sprt import bounds
+        
+        tournament = self.get_object()
+        test = SprtTest.objects.filter(tournament=tournament).select_related('candidate', 'baseline').first()
+        if test is None:
+            return Response({"error": "Tournament has no SPRT"}, status=status.HTTP_404_NOT_FOUND)
+        
+        lower, upper = bounds(test.alpha, test.beta)
+        return Response({
+            'candidate': {'id': str(test.candidate_id), 'name': test.candidate.name},
+            'baseline': {'id': str(test.baseline_id), 'name': test.baseline.name},
+            'elo0': test.elo0,
+            'elo1': test.elo1,
+            'alpha': test.alpha,
+            'beta': test.beta,
+            'pentanomial': test.pentanomial,
+            'pairs': sum(test.pentanomial),
+            'pairs_scheduled': test.pairs_scheduled,
+            'max_pairs': test.max_pairs,
+            'llr': round(test.llr, 3),
+            'bounds': [round(lower, 3), round(upper, 3)],
+            'result': test.result,
+        })
+    
     @action(detail=True, methods=['post'])
     def cancel_tournament(self, request, pk=None):
         """Cancel the tournament"""
@@ -670,11 +813,15 @@ class TournamentViewSet(viewsets.ModelViewSet):
             
             print(f"Found {match_count} matches and {participant_count} participants to delete")
             
-            Match.objects.filter(tournament=tournament).delete()
-            TournamentParticipant.objects.filter(tournament=tournament).delete()
-            
-            # Delete the tournament itself
-            tournament.delete()
+            tournament_id = tournament.id
+            with transaction.atomic():
+                BotStats.remove_matches(Match.objects.filter(tournament=tournament))
+                Match.objects.filter(tournament=tournament).delete()
+                TournamentParticipant.objects.filter(tournament=tournament).delete()
+                
+                # Delete the tournament itself
+                tournament.delete()
+            archive.delete_archives(tournament_id)
             print(f"Tournament {tournament_name} successfully deleted")
             
             return Response({"message": f"Tournament '{tournament_name}' deleted successfully"})
@@ -715,16 +862,25 @@ class MatchViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(tournament_id=tournament_id)
         return queryset
     
+    def perform_create(self, serializer):
+        """Keep the tournament's match counter in step"""
+        match = serializer.save()
+        match.tournament.add_matches(1)
+    
+    def perform_destroy(self, instance):
+        """Keep the tournament's match counters and the bot stats in step"""
+        _delete_with_matches(instance, Match.objects.filter(pk=instance.pk))
+    
     @action(detail=True, methods=['get'])
     def download_pgn(self, request, pk=None):
         """Download PGN file of the match"""
         match = self.get_object()
         
-        if not match.pgn_file:
+        if not match.has_artifact('pgn'):
             return Response({"error": "No PGN file available"}, 
                             status=status.HTTP_404_NOT_FOUND)
         
-        response = HttpResponse(match.pgn_file, content_type='application/x-chess-pgn')
+        response = HttpResponse(match.read_artifact('pgn'), content_type='application/x-chess-pgn')
         response['Content-Disposition'] = f'attachment; filename=match_{match.id}.pgn'
         return response
     
@@ -733,11 +889,11 @@ class MatchViewSet(viewsets.ModelViewSet):
         """Download log file of the match"""
         match = self.get_object()
         
-        if not match.log_file:
+        if not match.has_artifact('log'):
             return Response({"error": "No log file available"}, 
                             status=status.HTTP_404_NOT_FOUND)
         
-        response = HttpResponse(match.log_file, content_type='text/plain')
+        response = HttpResponse(match.read_artifact('log'), content_type='text/plain')
         response['Content-Disposition'] = f'attachment; filename=match_{match.id}_log.txt'
         return response
 
@@ -746,131 +902,76 @@ class MatchViewSet(viewsets.ModelViewSet):
         """Run a specific match"""
         match = self.get_object()
         
-        if match.status not in ['pending', 'error']:
+        # Queue it through the scheduler, so it isn't released to another worker as well
+        if not release_match(match.id):
             return Response({
                 "error": "Match can only be run from pending or error state"
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Dispatch Celery task to run the match
-        run_chess_match.delay(str(match.id))
-        
         return Response({"message": "Match execution started"})
 
 class LeaderboardView(APIView):
     """API endpoint for retrieving leaderboard data"""
     permission_classes = [IsTeacher]
     
+    @staticmethod
+    def _rating_fields(rating):
+        if rating is None:
+            return {'elo': None, 'glicko_rating': None, 'glicko_rd': None}
+        return {
+            'elo': round(rating.elo, 1),
+            'glicko_rating': round(rating.glicko_rating, 1),
+            'glicko_rd': round(rating.glicko_rd, 1),
+        }
+    
     def get(self, request):
         """Get leaderboard data for active bots"""
         # Get query parameters
         tournament_id = request.query_params.get('tournament', 'all')
         
-        # Get all active bots
-        active_bots = ChessBot.objects.filter(
-            status='active'
-        ).select_related('owner')
-        
-        # Calculate stats for each bot from tournament matches
-        bot_stats = []
+        # Read the rolled-up stats of active bots, already sorted by win percentage (descending)
+        stats = BotStats.objects.filter(
+            bot__status='active',
+            games__gt=0,
+        ).select_related('bot__owner').order_by('-win_percentage', '-bot__created_at')
         
-        for bot in active_bots:
-            # Base match query filters
-            match_filters = {'status': 'completed'}
-            
-            # If tournament specified, add tournament filter
-            if tournament_id != 'all':
-                match_filters['tournament__id'] = tournament_id
-            
-            # Calculate wins as white
-            white_wins = Match.objects.filter(
-                white_bot=bot,
-                result='white_win',
-                **match_filters
-            ).count()
-            
-            # Calculate wins as black
-            black_wins = Match.objects.filter(
-                black_bot=bot,
-                result='black_win',
-                **match_filters
-            ).count()
-            
-            # Calculate draws as white
-            white_draws = Match.objects.filter(
-                white_bot=bot,
-                result='draw',
-                **match_filters
-            ).count()
-            
-            # Calculate draws as black
-            black_draws = Match.objects.filter(
-                black_bot=bot,
-                result='draw',
-                **match_filters
-            ).count()
-            
-            # Calculate losses as white
-            white_losses = Match.objects.filter(
-                white_bot=bot,
-                result='black_win',
-                **match_filters
-            ).count()
-            
-            # Calculate losses as black
-            black_losses = Match.objects.filter(
-                black_bot=bot,
-                result='white_win', 
-                **match_filters
-            ).count()
-            
-            # Calculate total games
-            total_games = Match.objects.filter(
-                Q(white_bot=bot) | Q(black_bot=bot),
-                **match_filters
-            ).count()
-            
-            # Skip bots that haven't played any games
-            if total_games == 0:
-                continue
-                
-            # Calculate total stats
-            total_wins = white_wins + black_wins
-            total_draws = white_draws + black_draws
-            total_losses = white_losses + black_losses
-            
-            # Calculate win percentage (draws counted as losses)
-            win_percentage = (total_wins / total_games) * 100 if total_games > 0 else 0
-            
-            # Calculate draw percentage (wins counted as losses)
-            draw_percentage = (total_draws / total_games) * 100 if total_games > 0 else 0
-            
-            # Calculate tournament participations (still show total participations even when filtering)
-            if tournament_id != 'all':
-                tournament_participations = 1 if TournamentParticipant.objects.filter(
-                    bot=bot,
-                    tournament__id=tournament_id
-                ).exists() else 0
-            else:
-                tournament_participations = TournamentParticipant.objects.filter(
-                    bot=bot
-                ).count()
-            
-            # Add bot to stats
-            bot_stats.append({
-                'id': str(bot.id),
-                'name': bot.name,
-                'owner': bot.owner.email,
-                'total_games': total_games,
-                'wins': total_wins,
-                'draws': total_draws,
-                'losses': total_losses,
-                'win_percentage': round(win_percentage, 2),
-                'draw_percentage': round(draw_percentage, 2),
-                'tournament_participations': tournament_participations
-            })
-        
-        # Sort by win percentage (descending)
-        sorted_stats = sorted(bot_stats, key=lambda x: x['win_percentage'], reverse=True)
+        if tournament_id != 'all':
+            stats = stats.filter(tournament__id=tournament_id)
+        else:
+            stats = stats.filter(tournament__isnull=True)
+        
+        # Calculate tournament participations (still show total participations even when filtering)
+        participations = TournamentParticipant.objects.all()
+        if tournament_id != 'all':
+            participations = participations.filter(tournament__id=tournament_id)
+        participations = dict(participations.values('bot').annotate(count=Count('id')).values_list('bot', 'count'))
+        
+        # Ratings of the current version of each bot
+        stats = list(stats)
+        ratings = {
+            rating.bot_id: rating for rating in BotRating.objects.filter(
+                bot_id__in=[row.bot_id for row in stats], version=F('bot__version')
+            )
+        }
+        
+        sorted_stats = [{
+            'id': str(row.bot.id),
+            'name': row.bot.name,
+            'owner': row.bot.owner.email,
+            'total_games': row.games,
+            'wins': row.wins,
+            'draws': row.draws,
+            'losses': row.losses,
+            'win_percentage': round(row.win_percentage, 2),
+            'draw_percentage': round(row.draw_percentage, 2),
+            'tournament_participations': participations.get(row.bot_id, 0),
+            **self._rating_fields(ratings.get(row.bot_id))
+        } for row in stats]
+        
+        # Optionally rank by rating instead of win percentage
+        sort = request.query_params.get('sort')
+        if sort in ('elo', 'glicko_rating'):
+            sorted_stats.sort(key=lambda x: x[sort] if x[sort] is not None else float('-inf'), reverse=True)
         
         return Response({
             'leaderboard': sorted_stats
@@ -889,7 +990,7 @@ def confirm_remove_student(request, student_id):
     
     if request.method == 'POST':
         # Actually delete the student
-        student.delete()
+        _delete_with_matches(student, Match.objects.filter(Q(white_bot__owner=student) | Q(black_bot__owner=student)))
         return redirect('teacher_dashboard')
     
     return render(request, 'users/confirm_remove_student.html', {
@@ -1,6 +1,6 @@
 import os
 from celery import Celery
-from celery.signals import worker_ready
+from celery.signals import celeryd_init, worker_ready
 
 # Set the default Django settings module
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web_django.settings")
@@ -14,6 +14,46 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 # Auto-discover tasks in all installed apps
 app.autodiscover_tasks()
 
+# Games are CPU-heavy and can run for many minutes, so they get their own queue and workers;
+# everything else (completion checks, scheduling, ratings) is quick bookkeeping
+GAMES_QUEUE = "games"
+BOOKKEEPING_QUEUE = "bookkeeping"
+GAME_TASKS = ("users.tasks.run_chess_match", "users.tasks.run_match_batch")
+
+app.conf.update(
+    task_default_queue=BOOKKEEPING_QUEUE,
+    task_routes={name: {"queue": GAMES_QUEUE} for name in GAME_TASKS},
+    # Acknowledge games only once played, so a game lost with its worker is redelivered;
+    # finalizing a match is idempotent, so a redelivered game is never counted twice
+    task_annotations={name: {"acks_late": True, "reject_on_worker_lost": True} for name in GAME_TASKS},
+    # Unacknowledged games are redelivered after this long, so it must exceed the longest batch
+    broker_transport_options={"visibility_timeout": int(os.environ.get("CELERY_VISIBILITY_TIMEOUT", 12 * 3600))},
+)
+
+# Worker settings by queue, applied to workers consuming only that queue (celery worker -Q games)
+# unless given on the command line
+QUEUE_WORKER_SETTINGS = {
+    GAMES_QUEUE: {
+        # One game per process, and no game waiting prefetched behind a long one
+        "worker_concurrency": int(os.environ.get("CELERY_GAMES_CONCURRENCY", os.cpu_count() or 1)),
+        "worker_prefetch_multiplier": 1,
+    },
+    BOOKKEEPING_QUEUE: {
+        "worker_concurrency": int(os.environ.get("CELERY_BOOKKEEPING_CONCURRENCY", 2)),
+        "worker_prefetch_multiplier": 4,
+    },
+}
+
+@celeryd_init.connect
+def configure_queue_worker(sender=None, conf=None, options=None, **kwargs):
+    """Apply QUEUE_WORKER_SETTINGS to a worker started for a single queue"""
+    queues = (options or {}).get("queues") or []
+    if isinstance(queues, str):
+        queues = queues.split(",")
+    if len(queues) == 1 and queues[0] in QUEUE_WORKER_SETTINGS:
+        for name, value in QUEUE_WORKER_SETTINGS[queues[0]].items():
+            conf[name] = value
+
 @worker_ready.connect
 def setup_directories(**kwargs):
     """Set up media directories with proper permissions when worker starts"""
@@ -253,3 +253,19 @@ CELERY_TIMEZONE = "UTC"
 # Session and CSRF settings
 SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
 CSRF_COOKIE_SECURE = False     # Set to True in production with HTTPS
+
+# Bot host pool settings (see users/bot_host.py)
+BOT_HOST_MAX_GAMES = int(os.environ.get('BOT_HOST_MAX_GAMES', 50))  # Recycle a host after this many games
+BOT_HOST_MAX_RSS_GROWTH = 256 * 1024 * 1024  # Recycle a host once it grew by 256MB since loading the bot
+BOT_HOST_MAX_IDLE = 16  # Idle hosts kept per worker process
+
+# Number of matches played back to back by one run_match_batch task
+MATCH_BATCH_SIZE = int(os.environ.get('MATCH_BATCH_SIZE', 8))
+
+# Matches of a tournament queued or running at once; at least workers * MATCH_BATCH_SIZE keeps every worker busy
+SCHEDULER_MAX_IN_FLIGHT = int(os.environ.get('SCHEDULER_MAX_IN_FLIGHT', 64))
+# run_match_batch tasks a single bot may be queued or playing in at once (a gauntlet's challenger and SPRT bots excepted)
+SCHEDULER_BOT_CONCURRENCY = int(os.environ.get('SCHEDULER_BOT_CONCURRENCY', 2))
+
+# Move finished games into per-tournament compressed archives (see users/archive.py)
+MATCH_ARCHIVE = os.environ.get('MATCH_ARCHIVE', 'true').lower() in ('1', 'true', 'yes')